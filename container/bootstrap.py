@@ -2,8 +2,11 @@
 import os
 import subprocess
 import stat
+from contextlib import contextmanager
+from ipaddress import ip_network
 from secrets import token_urlsafe
 from shutil import which
+from time import perf_counter
 
 
 def run_command(command, check=True):
@@ -12,6 +15,25 @@ def run_command(command, check=True):
     subprocess.run(command, check=check)
 
 
+def start_command(command):
+    """Starts a command without waiting for it; pair with wait_command."""
+    print(f"Running command: {' '.join(command)}")
+    return subprocess.Popen(command)
+
+
+def wait_command(process):
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+
+
+@contextmanager
+def phase(name):
+    """Prints how long the enclosed bootstrap step took."""
+    start = perf_counter()
+    yield
+    print(f"Bootstrap: {name} took {(perf_counter() - start) * 1000:.0f} ms")
+
+
 def setup_secret_key():
     """Set up the application's secret key."""
     secret_file = "/data/app_secret"
@@ -27,21 +49,41 @@ def setup_secret_key():
             os.environ["SECRET_KEY"] = key
 
 
-def get_interface_info():
-    """Get info from environmnet for wg0 interface"""
+def server_addresses(pools_var, base, default_prefix):
+    """First host of every configured peer pool, with the pool's prefix."""
+    pools = os.environ.get(pools_var, "").strip(" '\"") or f"{base}/{default_prefix}"
+    addresses = []
+    for cidr in pools.split(","):
+        if cidr.strip():
+            network = ip_network(cidr.strip(), strict=False)
+            addresses.append(f"{network.network_address + 1}/{network.prefixlen}")
+    return addresses
+
+
+def interface_count():
+    """Number of WireGuard interfaces, wg0..wg{N-1}, from WG_INTERFACES."""
+    return int(os.environ.get("WG_INTERFACES", "1").strip(" '\""))
+
+
+def get_interface_info(index, count):
+    """
+    Get info from environment for interface wg{index}: pools are dealt
+    out to the interfaces in order, ports count up from WG_PORT.
+    """
     port = os.environ.get("WG_PORT")
     if not port:
         raise Exception("Missing WG_PORT")
+    ipv4 = os.environ.get("WG_IPV4_BASE_ADDRESS", "10.8.0.1")
+    ipv6 = os.environ.get("WG_IPV6_BASE_ADDRESS", "fd86:ea04:1111::1")
     return {
-        "ipv4": os.environ.get("WG_IPV4_BASE_ADDRESS", "10.8.0.1"),
-        "ipv6": os.environ.get("WG_IPV6_BASE_ADDRESS", "fd86:ea04:1111::1"),
-        "port": port.strip("'\""),
+        "ipv4": ", ".join(server_addresses("WG_IPV4_POOLS", ipv4, 24)[index::count]),
+        "ipv6": ", ".join(server_addresses("WG_IPV6_POOLS", ipv6, 64)[index::count]),
+        "port": str(int(port.strip("'\"")) + index),
     }
 
 
 def setup_wireguard():
-    """Configure and bring up the WireGuard interface."""
-    conf_file = "/etc/wireguard/wg0.conf"
+    """Write the WireGuard configs; returns the `wg-quick up` processes."""
     private_key_file = "/etc/wireguard/privatekey"
     secret_file = "/run/secrets/wg-privatekey"
 
@@ -59,7 +101,16 @@ def setup_wireguard():
         with open(private_key_file, "w") as f:
             f.write(private_key)
 
-    interface_info = get_interface_info()
+    count = interface_count()
+    return [
+        write_interface(f"wg{index}", get_interface_info(index, count), private_key)
+        for index in range(count)
+    ]
+
+
+def write_interface(name, interface_info, private_key):
+    """Write the config of one interface; returns its `wg-quick up` process."""
+    conf_file = f"/etc/wireguard/{name}.conf"
 
     # Check for port changes and warn the user
     if os.path.exists(conf_file):
@@ -91,25 +142,37 @@ def setup_wireguard():
     # Check file permissions for config
     os.chmod(conf_file, stat.S_IRUSR | stat.S_IWUSR)
     # Bring up the interface
-    run_command(["wg-quick", "up", "wg0"])
+    return start_command(["wg-quick", "up", name])
 
 
 def main():
     """Main bootstrap script."""
-    setup_secret_key()
-    setup_wireguard()
-
-    # Start Gunicorn with Uvicorn workers
-    gunicorn_args = os.environ.get(
-        "GUNICORN_CMD_ARGS",
-        "--workers 2 --worker-class uvicorn.workers.UvicornWorker --bind unix:/run/gunicorn.sock",
-    ).split()
+    started = perf_counter()
+    with phase("secret key"):
+        setup_secret_key()
+
+    # The interfaces and the firewall rules are independent of each other
+    with phase("interfaces and nftables"):
+        wg_quick = setup_wireguard()
+        nft = start_command(["nft", "-f", "/etc/nftables.conf"])
+        for process in wg_quick:
+            wait_command(process)
+        wait_command(nft)
+
+    # Gateways mirror the peers of a primary instead of serving the API
+    if os.environ.get("WG_PRIMARY_URL", "").strip(" '\""):
+        print(f"Bootstrap: handing over to the agent after {(perf_counter() - started) * 1000:.0f} ms")
+        os.execvp("python3", ["python3", "agent.py"])
+
+    # Start Gunicorn with Uvicorn workers; peer mutations are serialized
+    # across workers, so WG_WORKERS can go up to the core count. Gunicorn
+    # reads GUNICORN_CMD_ARGS itself, and these arguments take precedence.
+    workers = os.environ.get("WG_WORKERS", "2").strip(" '\"")
+    gunicorn_args = f"--workers {workers} --worker-class uvicorn.workers.UvicornWorker --bind unix:/run/gunicorn.sock".split()
     subprocess.Popen(["gunicorn", "main:app", *gunicorn_args])
+    print(f"Bootstrap: handing over to Caddy after {(perf_counter() - started) * 1000:.0f} ms")
 
-    # Apply nftables rules
-    run_command(["nft", "-f", "/etc/nftables.conf"])
-
-    # Exec into Caddy
+    # Exec into Caddy; it holds requests until gunicorn accepts them
     caddy_executable = which("caddy")
     if caddy_executable:
         os.execv(
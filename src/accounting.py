@@ -0,0 +1,123 @@
+"""
+Persistent per-peer traffic accounting and quota enforcement.
+
+Interface counters restart from zero whenever a peer is re-added or the
+interface is recreated. The worker holding the "accounting" leader lock
+turns the stats sampler's counter samples into increments, treating a
+counter that went down as restarted (so its whole value is new traffic),
+and every WG_ACCOUNTING_FLUSH seconds adds them to per-day and lifetime
+totals in one SQLite transaction. The counters the increments were
+measured against are stored in the same transaction, so a new leader
+carries on exactly where the last flush left off. Peers whose lifetime
+traffic reaches their quota are then disabled.
+"""
+
+import asyncio
+import logging
+from os import environ
+from time import gmtime, strftime, time
+
+from aiodb import get_traffic_baselines_db, record_traffic_db
+from locks import LeaderLoop
+from peers import disable_peers
+from sampler import sampler
+
+# Seconds between writes of accumulated traffic (and quota checks)
+FLUSH_SECONDS = float(environ.get("WG_ACCOUNTING_FLUSH", "60"))
+
+
+class TrafficAccountant:
+    """Accumulates traffic increments in memory and flushes them in batches."""
+
+    def __init__(self):
+        self._leader = LeaderLoop(
+            "accounting", "Accounting", "accounting", "recording traffic"
+        )
+        # {public_key: (rx, tx)} counters the next increments are measured
+        # from; None until loaded after acquiring leadership
+        self._last = None
+        # {(public_key, day): [rx, tx]} increments not yet flushed
+        self._daily = {}
+        # {public_key: [rx, tx, rx_last, tx_last]} likewise, per peer
+        self._pending = {}
+        self._next_flush = 0
+
+    def start(self):
+        """Starts accounting (or waiting to take it over) in the running loop."""
+        sampler.add_listener(self.observe)
+        self._leader.start(self._step)
+
+    async def shutdown(self):
+        await self._leader.stop()
+        if self._leader.held:
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Accounting: Failed to flush on shutdown: {e}")
+        self._leader.lock.release()
+
+    def observe(self, ts, samples):
+        """Adds the traffic since the previous sample to the pending totals."""
+        if self._last is None:
+            return
+        day = strftime("%Y-%m-%d", gmtime(ts))
+        last = self._last
+        current = {}
+        for pub, rx, tx, _, _ in samples:
+            last_rx, last_tx = last.get(pub, (0, 0))
+            rx_delta = rx - last_rx if rx >= last_rx else rx
+            tx_delta = tx - last_tx if tx >= last_tx else tx
+            current[pub] = (rx, tx)
+            if (rx, tx) != (last_rx, last_tx):
+                daily = self._daily.setdefault((pub, day), [0, 0])
+                daily[0] += rx_delta
+                daily[1] += tx_delta
+                pending = self._pending.setdefault(pub, [0, 0, 0, 0])
+                pending[0] += rx_delta
+                pending[1] += tx_delta
+                pending[2:] = rx, tx
+        # Peers gone from the interface start over from zero if they return
+        self._last = current
+
+    async def flush(self):
+        """Writes pending traffic and disables peers that reached their quota."""
+        if not self._pending:
+            return
+        daily, self._daily = self._daily, {}
+        pending, self._pending = self._pending, {}
+        try:
+            over_quota = await record_traffic_db(
+                [(pub, day, rx, tx) for (pub, day), (rx, tx) in daily.items()],
+                [
+                    (pub, rx_last, tx_last, rx, tx)
+                    for pub, (rx, tx, rx_last, tx_last) in pending.items()
+                ],
+            )
+        except BaseException:
+            # Keep the increments for the next attempt
+            for key, (rx, tx) in daily.items():
+                entry = self._daily.setdefault(key, [0, 0])
+                entry[0] += rx
+                entry[1] += tx
+            for pub, (rx, tx, rx_last, tx_last) in pending.items():
+                entry = self._pending.setdefault(pub, [0, 0, rx_last, tx_last])
+                entry[0] += rx
+                entry[1] += tx
+            raise
+        if over_quota:
+            disabled = await disable_peers(over_quota, "quota")
+            if disabled:
+                logging.info(
+                    f"Accounting: Disabled {len(disabled)} peer(s) over their quota."
+                )
+
+    async def _step(self):
+        if self._last is None:
+            self._last = await get_traffic_baselines_db()
+            self._next_flush = time() + FLUSH_SECONDS
+        await asyncio.sleep(max(0, self._next_flush - time()))
+        self._next_flush = time() + FLUSH_SECONDS
+        await self.flush()
+
+
+accountant = TrafficAccountant()
@@ -0,0 +1,226 @@
+"""
+Gateway agent: mirrors the peers of a primary onto this host's interfaces.
+
+With WG_PRIMARY_URL set, bootstrap runs this instead of the API. The agent
+follows the primary's peer change log (see replication.py) and applies each
+snapshot or batch of changes with one backend update and one config write
+per interface. What it applied, and up to which log version, is kept in its
+own database: after a restart the interfaces are restored from there and
+the stream resumes from that version, so only a primary whose log no longer
+reaches back that far sends a full snapshot.
+
+Gateways need the same WG_INTERFACES and address pools as the primary, and
+its private key, so client configs work against any of them.
+"""
+
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from os import environ
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from aiodb import close_db, get_replica_db, init_replica_db, save_replica_db
+from backend import get_backend
+from interfaces import INTERFACES
+from wgconf import wg_configs
+
+# Base URL of the primary, e.g. https://vpn.example.com
+PRIMARY_URL = environ.get("WG_PRIMARY_URL", "").strip(" '\"").rstrip("/")
+
+# Bearer token matching the primary's WG_REPLICATION_TOKEN
+REPLICATION_TOKEN = environ.get("WG_REPLICATION_TOKEN", "")
+
+# Seconds without any line from the primary (it sends keepalives every 15)
+READ_TIMEOUT_SECONDS = 60
+
+# Reconnect back-off bounds
+RETRY_SECONDS = 1
+MAX_RETRY_SECONDS = 30
+
+
+def _desired(entry):
+    """Returns (interface, allowed_ips) a replica entry asks for, or None."""
+    interface = entry.get("interface")
+    if interface is None:
+        return None
+    if interface not in wg_configs:
+        logging.warning(
+            f"Agent: Skipping peer {entry['public_key']} on unknown interface "
+            f"{interface}; WG_INTERFACES must match the primary."
+        )
+        return None
+    return interface, entry["allowed_ips"]
+
+
+def _read_events(response):
+    """
+    Yields (event, data) pairs from a server-sent event stream. Blocking:
+    each step reads the socket, so a silent primary holds the caller for
+    up to READ_TIMEOUT_SECONDS (the urlopen timeout) before it raises.
+    """
+    event, data = None, []
+    for raw in response:
+        line = raw.decode().rstrip("\r\n")
+        if not line:
+            if event is not None:
+                yield event, "\n".join(data)
+            event, data = None, []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+
+
+class ReplicaAgent:
+    """Applies the primary's peer change log to the local interfaces."""
+
+    def __init__(self):
+        # public key -> (interface, allowed_ips) currently applied
+        self.peers = {}
+        self.log = None
+        self.version = None
+
+    async def restore(self):
+        """Puts the peers applied before a restart back on the interfaces."""
+        await init_replica_db()
+        self.log, self.version, self.peers = await get_replica_db()
+        backend = get_backend()
+        wanted = {name: {} for name in INTERFACES}
+        for pub, (interface, allowed) in self.peers.items():
+            if interface in wanted:
+                wanted[interface][pub] = allowed
+        for interface, peers in wanted.items():
+            live = {
+                p.public_key: p.allowed_ips for p in await backend.get_peers(interface)
+            }
+            extra = [pub for pub in live if pub not in peers]
+            stale = [
+                (pub, allowed)
+                for pub, allowed in peers.items()
+                if set(live.get(pub, ())) != set(allowed)
+            ]
+            if extra:
+                await backend.remove_peers(interface, extra)
+            if stale:
+                await backend.set_peers(interface, stale)
+            await wg_configs[interface].replace_peers(peers.items())
+        logging.info(
+            f"Agent: Restored {len(self.peers)} peer(s) at version {self.version}."
+        )
+
+    async def apply(self, entries, log, version, snapshot=False):
+        """
+        Brings the interfaces in line with replica `entries`; a snapshot
+        also drops every applied peer it does not mention.
+        """
+        wanted = {entry["public_key"]: _desired(entry) for entry in entries}
+        if snapshot:
+            for pub in self.peers.keys() - wanted.keys():
+                wanted[pub] = None
+        removals = defaultdict(list)
+        additions = defaultdict(list)
+        changed = {}
+        removed = []
+        for pub, peer in wanted.items():
+            current = self.peers.get(pub)
+            if peer == current:
+                continue
+            if current is not None and (peer is None or peer[0] != current[0]):
+                removals[current[0]].append(pub)
+            if peer is None:
+                removed.append(pub)
+            else:
+                additions[peer[0]].append((pub, peer[1]))
+                changed[pub] = peer
+
+        backend = get_backend()
+        for interface, keys in removals.items():
+            await backend.remove_peers(interface, keys)
+            await wg_configs[interface].remove_peers(keys)
+        for interface, peers in additions.items():
+            await wg_configs[interface].add_peers(peers)
+            await backend.set_peers(interface, peers)
+        await save_replica_db(log, version, changed, removed)
+
+        for pub in removed:
+            self.peers.pop(pub, None)
+        self.peers.update(changed)
+        self.log, self.version = log, version
+        return len(changed), len(removed)
+
+    def _open(self):
+        query = {}
+        if self.version is not None:
+            query = {"since": self.version, "log": self.log}
+        request = Request(
+            f"{PRIMARY_URL}/api/replication/stream?{urlencode(query)}",
+            headers={
+                "Authorization": f"Bearer {REPLICATION_TOKEN}",
+                "Accept": "text/event-stream",
+            },
+        )
+        return urlopen(request, timeout=READ_TIMEOUT_SECONDS)
+
+    async def follow(self):
+        """Applies the stream until the connection ends."""
+        response = await asyncio.to_thread(self._open)
+        events = _read_events(response)
+        try:
+            logging.info(f"Agent: Following {PRIMARY_URL} from version {self.version}.")
+            while True:
+                # Bounded by the socket timeout set in _open
+                item = await asyncio.to_thread(next, events, None)
+                if item is None:
+                    return
+                event, data = item
+                payload = json.loads(data)
+                if event == "snapshot":
+                    changed, removed = await self.apply(
+                        payload["peers"], payload["log"], payload["version"], True
+                    )
+                    logging.info(
+                        f"Agent: Applied snapshot at version {self.version}: "
+                        f"{changed} set, {removed} removed."
+                    )
+                elif event == "changes":
+                    changed, removed = await self.apply(
+                        payload["peers"], self.log, payload["version"]
+                    )
+                    logging.info(
+                        f"Agent: Applied version {self.version}: "
+                        f"{changed} set, {removed} removed."
+                    )
+        finally:
+            response.close()
+
+    async def run(self):
+        if not PRIMARY_URL or not REPLICATION_TOKEN:
+            raise RuntimeError("Agent needs WG_PRIMARY_URL and WG_REPLICATION_TOKEN")
+        await self.restore()
+        delay = RETRY_SECONDS
+        while True:
+            try:
+                await self.follow()
+                delay = RETRY_SECONDS
+                logging.warning(
+                    f"Agent: Stream from the primary ended, reconnecting in {delay}s."
+                )
+                await asyncio.sleep(delay)
+            except Exception as e:
+                logging.error(f"Agent: Lost the primary ({e}), retrying in {delay}s.")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_SECONDS)
+
+
+async def main():
+    try:
+        await ReplicaAgent().run()
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
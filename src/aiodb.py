@@ -0,0 +1,74 @@
+"""
+Async facade over db.py for use from request handlers.
+
+Each function has the same name and arguments as its db.py counterpart but
+runs on a small dedicated thread pool, so a slow disk or a large table
+never stalls the event loop. SQLite releases the GIL while it works, and
+with WAL enabled readers on different threads overlap with the writer.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+import db
+from metrics import db_seconds
+
+_executor = ThreadPoolExecutor(max_workers=db.POOL_SIZE, thread_name_prefix="db")
+
+
+def _offload(fn):
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        with db_seconds.time(fn.__name__):
+            return await loop.run_in_executor(_executor, partial(fn, *args, **kwargs))
+
+    return wrapper
+
+
+init_db = _offload(db.init_db)
+add_peer_db = _offload(db.add_peer_db)
+add_peers_db = _offload(db.add_peers_db)
+add_placed_peers_db = _offload(db.add_placed_peers_db)
+remove_peer_db = _offload(db.remove_peer_db)
+remove_peers_db = _offload(db.remove_peers_db)
+backfill_ip_slots_db = _offload(db.backfill_ip_slots_db)
+assign_interfaces_db = _offload(db.assign_interfaces_db)
+remove_expired_peers_db = _offload(db.remove_expired_peers_db)
+get_peer_expiries = _offload(db.get_peer_expiries)
+get_peer_db = _offload(db.get_peer_db)
+get_all_peers = _offload(db.get_all_peers)
+set_peers_disabled_db = _offload(db.set_peers_disabled_db)
+touch_peers_db = _offload(db.touch_peers_db)
+get_idle_peers_db = _offload(db.get_idle_peers_db)
+get_changelog_db = _offload(db.get_changelog_db)
+get_replica_snapshot_db = _offload(db.get_replica_snapshot_db)
+get_peer_changes_db = _offload(db.get_peer_changes_db)
+init_replica_db = _offload(db.init_replica_db)
+get_replica_db = _offload(db.get_replica_db)
+save_replica_db = _offload(db.save_replica_db)
+get_traffic_baselines_db = _offload(db.get_traffic_baselines_db)
+record_traffic_db = _offload(db.record_traffic_db)
+set_quota_db = _offload(db.set_quota_db)
+get_traffic_db = _offload(db.get_traffic_db)
+get_peers_version = _offload(db.get_peers_version)
+count_peers_db = _offload(db.count_peers_db)
+count_peers_by_interface_db = _offload(db.count_peers_by_interface_db)
+list_peers_db = _offload(db.list_peers_db)
+add_user_db = _offload(db.add_user_db)
+add_or_update_user_db = _offload(db.add_or_update_user_db)
+set_password_hash_db = _offload(db.set_password_hash_db)
+get_password_hash_db = _offload(db.get_password_hash_db)
+remove_user_db = _offload(db.remove_user_db)
+revoke_token_db = _offload(db.revoke_token_db)
+get_revoked_tokens_db = _offload(db.get_revoked_tokens_db)
+record_login_failure_db = _offload(db.record_login_failure_db)
+get_login_failure_db = _offload(db.get_login_failure_db)
+clear_login_failures_db = _offload(db.clear_login_failures_db)
+
+
+async def close_db():
+    """Closes pooled connections and stops the DB threads."""
+    await _offload(db.close_db)()
+    _executor.shutdown(wait=False)
@@ -1,14 +1,53 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status, Request
-from pydantic import BaseModel
-from os import getloadavg
-from time import gmtime, strftime
+import asyncio
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from hashlib import sha1
+from hmac import compare_digest
+from typing import Dict, List, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from os import environ, getloadavg
+from time import gmtime, monotonic, strftime, time
 from aiofiles import open
 
-from peers import create_peer, delete_peer, list_peers, peer_stats
-from auth import verify_token
+from aiodb import get_idle_peers_db, get_peers_version, get_traffic_db
+from db import PEER_FIELDS, PEER_SORT_KEYS
+from clientconf import MEDIA_TYPES, artifact_etag, get_artifact, stream_zip
+from interfaces import INTERFACES, interface_port
+from ipam import get_address_pools
+from peers import (
+    create_peer,
+    create_peers,
+    delete_peer,
+    get_peer,
+    interface_peers,
+    iter_peer_pages,
+    list_peers,
+    peer_state,
+    peer_stats,
+    resume_peer,
+    set_peer_quota,
+)
+from replication import REPLICATION_TOKEN, change_events
+from sampler import sampler
+from auth import TOKEN_MAX_AGE, verify_token
+from metrics import render_histograms
 
 router = APIRouter()
+metrics_router = APIRouter()
+
+# Bearer token Prometheus must present; /metrics is disabled when unset
+METRICS_TOKEN = environ.get("WG_METRICS_TOKEN", "")
+
+# Fields /peers/list returns unless `fields` asks otherwise (no private keys)
+DEFAULT_PEER_FIELDS = tuple(f for f in PEER_FIELDS if f != "private_key")
+
+# Most peers one /peers/batch request may create
+MAX_BATCH_SIZE = 5000
+
+# Comment line sent on idle streams so proxies keep them open
+STREAM_KEEPALIVE_SECONDS = 15
 
 
 # --- Pydantic Models for API ---
@@ -19,16 +58,32 @@ class DeletePeerRequest(BaseModel):
 class ServerInfo(BaseModel):
     uptime: str
     load: str
+    peers: int
 
 
 class ServerConfig(BaseModel):
     public_key: str
     endpoint: str
     port: str
+    # Listen port of every interface
+    ports: Dict[str, str]
     allowed_ips: str
     dns_server: str
 
 
+class InterfaceInfo(BaseModel):
+    name: str
+    port: str
+    pools: List[str]
+    capacity: int
+    # Stored peers, and those on the interface in the last stats sample
+    peers: int
+    live_peers: int
+    connected: int
+    rx_bytes: int
+    tx_bytes: int
+
+
 class Peer(BaseModel):
     public_key: str
     private_key: str
@@ -36,19 +91,47 @@ class Peer(BaseModel):
     ipv6_address: str
     expires_at: str
     created_at: str
+    label: Optional[str] = None
+    interface: Optional[str] = None
 
 
 class PeerCreate(BaseModel):
     days_valid: int = 7
 
 
+class PeerSpec(BaseModel):
+    label: Optional[str] = Field(None, max_length=64)
+    days_valid: Optional[int] = None
+
+
+class PeerBatchCreate(BaseModel):
+    count: Optional[int] = Field(None, ge=1, le=MAX_BATCH_SIZE)
+    peers: Optional[List[PeerSpec]] = Field(
+        None, min_length=1, max_length=MAX_BATCH_SIZE
+    )
+    days_valid: int = 7
+
+
 class DeleteResponse(BaseModel):
     deleted: bool
 
 
-# --- API Endpoints ---po
-@router.get("/config", response_model=ServerConfig)
-async def get_config(request: Request, current_user: str = Depends(verify_token)):
+class ResumeResponse(BaseModel):
+    resumed: bool
+
+
+class QuotaRequest(BaseModel):
+    public_key: str
+    # Lifetime rx + tx bytes; None removes the quota
+    quota_bytes: Optional[int] = Field(None, ge=1)
+
+
+class QuotaResponse(BaseModel):
+    quota_bytes: Optional[int]
+    used_bytes: int
+
+
+def _require_config(request):
     if not all(
         [
             request.app.state.config.wg_public_key,
@@ -62,10 +145,41 @@ async def get_config(request: Request, current_user: str = Depends(verify_token)
             status_code=503,
             detail="Server configuration is not available due to a startup error.",
         )
+    return request.app.state.config
+
+
+def _require_bearer(request, expected, name):
+    """Checks a static bearer token; a feature without one is disabled."""
+    if not expected:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not compare_digest(token, expected):
+        raise HTTPException(
+            status_code=401,
+            detail=f"Invalid {name} token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+def _etag_matches(etag, request):
+    if_none_match = request.headers.get("If-None-Match", "")
+    return if_none_match.strip() == "*" or etag in map(
+        str.strip, if_none_match.split(",")
+    )
+
+
+# --- API Endpoints ---po
+@router.get("/config", response_model=ServerConfig)
+async def get_config(request: Request, current_user: str = Depends(verify_token)):
+    _require_config(request)
     return {
         "public_key": request.app.state.config.wg_public_key,
         "endpoint": request.app.state.config.wg_endpoint,
         "port": request.app.state.config.wg_port,
+        "ports": {
+            name: interface_port(request.app.state.config.wg_port, name)
+            for name in INTERFACES
+        },
         "allowed_ips": request.app.state.config.wg_allowed_ips,
         "dns_server": request.app.state.config.wg_dns_server,
     }
@@ -76,6 +190,33 @@ async def api_create_peer(req: PeerCreate, current_user: str = Depends(verify_to
     return await create_peer(req.days_valid)
 
 
+@router.post("/peers/batch", status_code=status.HTTP_201_CREATED)
+async def api_create_peers(
+    req: PeerBatchCreate, current_user: str = Depends(verify_token)
+):
+    """
+    Creates `count` peers, or one per entry of `peers`, all or nothing.
+    Streams the created peers back as NDJSON, one peer per line.
+    """
+    if (req.count is None) == (req.peers is None):
+        raise HTTPException(
+            status_code=422, detail="Provide exactly one of `count` or `peers`"
+        )
+    if req.peers is None:
+        specs = [(None, req.days_valid)] * req.count
+    else:
+        specs = [
+            (p.label, req.days_valid if p.days_valid is None else p.days_valid)
+            for p in req.peers
+        ]
+    created = await create_peers(specs)
+    return StreamingResponse(
+        (json.dumps(peer) + "\n" for peer in created),
+        status_code=status.HTTP_201_CREATED,
+        media_type="application/x-ndjson",
+    )
+
+
 @router.post("/peers/delete", response_model=DeleteResponse)
 async def api_delete_peer(
     req: DeletePeerRequest, current_user: str = Depends(verify_token)
@@ -83,14 +224,296 @@ async def api_delete_peer(
     return {"deleted": await delete_peer(req.public_key)}
 
 
-@router.get("/peers/list", response_model=List[Peer])
-async def api_list_peers(current_user: str = Depends(verify_token)):
-    return list_peers()
+@router.get("/peers/idle")
+async def api_idle_peers(
+    days: float = Query(30, gt=0),
+    limit: int = Query(1000, ge=1, le=10000),
+    current_user: str = Depends(verify_token),
+):
+    """
+    Lists peers without a handshake for more than `days` days, longest
+    idle first, including ones already suspended (`disabled_reason`).
+    """
+    return await get_idle_peers_db(time() - days * 86400, limit=limit)
+
+
+@router.post("/peers/resume", response_model=ResumeResponse)
+async def api_resume_peer(
+    req: DeletePeerRequest, current_user: str = Depends(verify_token)
+):
+    """Puts a peer suspended for being idle back on the interface."""
+    return {"resumed": await resume_peer(req.public_key)}
+
+
+@router.post("/peers/quota", response_model=QuotaResponse)
+async def api_set_quota(req: QuotaRequest, current_user: str = Depends(verify_token)):
+    """
+    Sets the lifetime traffic quota of a peer. Peers over their quota are
+    disabled; raising or removing the quota enables them again.
+    """
+    used = await set_peer_quota(req.public_key, req.quota_bytes)
+    if used is None:
+        raise HTTPException(status_code=404, detail="Peer not found")
+    return {"quota_bytes": req.quota_bytes, "used_bytes": used}
+
+
+@router.get("/traffic")
+async def api_traffic(
+    period: Literal["day", "month"] = "day",
+    since: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}(-\d{2})?$"),
+    until: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}(-\d{2})?$"),
+    public_key: Optional[str] = None,
+    current_user: str = Depends(verify_token),
+):
+    """
+    Returns accounted traffic per peer and day or month, e.g.
+    `?period=month&since=2025-01&until=2025-03`, as a list of
+    {"public_key", "period", "rx_bytes", "tx_bytes"} oldest first.
+    """
+    return await get_traffic_db(period, since, until, public_key)
+
+
+def _encode_cursor(after):
+    return urlsafe_b64encode(json.dumps(after).encode()).decode()
+
+
+def _decode_cursor(cursor, sort):
+    try:
+        after = json.loads(urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # One value per sort key plus the public key tiebreaker
+    if not isinstance(after, list) or len(after) != len(PEER_SORT_KEYS[sort]) + 1:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Values are bound as SQL parameters, which take only scalars that fit
+    for value in after:
+        if not isinstance(value, (str, int, float, type(None))) or (
+            isinstance(value, int) and not -(2**63) <= value < 2**63
+        ):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return after
+
+
+def _list_etag(version, request):
+    # The page depends on the query as well as on the table contents
+    query = sha1(str(sorted(request.query_params.multi_items())).encode())
+    return f'W/"{version}-{query.hexdigest()[:16]}"'
+
+
+@router.get("/peers/list")
+async def api_list_peers(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    sort: Literal["created_at", "expires_at", "address"] = "created_at",
+    order: Literal["asc", "desc"] = "asc",
+    fields: Optional[str] = None,
+    expires_before: Optional[str] = None,
+    expires_after: Optional[str] = None,
+    created_before: Optional[str] = None,
+    created_after: Optional[str] = None,
+    q: Optional[str] = Query(None, max_length=64),
+    interface: Optional[str] = None,
+    current_user: str = Depends(verify_token),
+):
+    """
+    Returns one page of peers as {"items": [...], "next_cursor": ...},
+    across every interface unless `interface` is given.
+    Pass `next_cursor` back as `cursor` for the following page. Replies
+    304 to a matching If-None-Match without touching the peers table.
+    """
+    projection = DEFAULT_PEER_FIELDS
+    if fields:
+        projection = tuple(dict.fromkeys(["public_key", *fields.split(",")]))
+        unknown = [f for f in projection if f not in PEER_FIELDS]
+        if unknown:
+            raise HTTPException(
+                status_code=400, detail=f"Unknown fields: {', '.join(unknown)}"
+            )
+
+    activity = "last_active_at" in projection
+    etag = _list_etag(await get_peers_version(activity), request)
+    if _etag_matches(etag, request):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    rows, next_after, version = await list_peers(
+        projection,
+        sort=sort,
+        descending=order == "desc",
+        limit=limit,
+        after=_decode_cursor(cursor, sort) if cursor else None,
+        expires_before=expires_before,
+        expires_after=expires_after,
+        created_before=created_before,
+        created_after=created_after,
+        search=q,
+        interface=interface,
+    )
+    return JSONResponse(
+        {
+            "items": rows,
+            "next_cursor": _encode_cursor(next_after) if next_after else None,
+        },
+        headers={"ETag": _list_etag(version, request), "Cache-Control": "no-cache"},
+    )
+
+
+@router.get("/peers/export.zip")
+async def api_export_peers(
+    request: Request,
+    qr: Optional[Literal["png", "svg"]] = None,
+    created_after: Optional[str] = None,
+    q: Optional[str] = Query(None, max_length=64),
+    current_user: str = Depends(verify_token),
+):
+    """
+    Streams a zip with the client config of every peer (optionally only
+    those created after `created_after` or matching `q`), plus a QR code
+    per peer when `qr` is "png" or "svg".
+    """
+    config = _require_config(request)
+    pages = iter_peer_pages(PEER_FIELDS, created_after=created_after, search=q)
+    return StreamingResponse(
+        stream_zip(pages, config, qr),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": 'attachment; filename="wireguard-peers.zip"',
+            "Cache-Control": "no-store",
+        },
+    )
+
+
+async def _peer_artifact(kind, public_key, request):
+    config = _require_config(request)
+    peer = await get_peer(public_key)
+    if peer is None:
+        raise HTTPException(status_code=404, detail="Peer not found")
+    # Private keys inside: let the browser revalidate but never share it
+    headers = {
+        "ETag": artifact_etag(peer, config),
+        "Cache-Control": "private, no-cache",
+    }
+    if _etag_matches(headers["ETag"], request):
+        return Response(status_code=304, headers=headers)
+    if kind == "conf":
+        filename = f"wg-peer-{peer['ipv4_address']}.conf"
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return Response(
+        await get_artifact(kind, peer, config),
+        media_type=MEDIA_TYPES[kind],
+        headers=headers,
+    )
+
+
+@router.get("/peers/{public_key:path}/config")
+async def api_peer_config(
+    public_key: str, request: Request, current_user: str = Depends(verify_token)
+):
+    """Returns the client .conf file of one peer."""
+    return await _peer_artifact("conf", public_key, request)
+
+
+@router.get("/peers/{public_key:path}/qr")
+async def api_peer_qr(
+    public_key: str,
+    request: Request,
+    format: Literal["png", "svg"] = "png",
+    current_user: str = Depends(verify_token),
+):
+    """Returns the client config of one peer as a PNG or SVG QR code."""
+    return await _peer_artifact(format, public_key, request)
 
 
 @router.get("/peers/stats")
-async def api_peer_stats(current_user: str = Depends(verify_token)):
-    return await peer_stats()
+async def api_peer_stats(
+    since: Optional[float] = None,
+    resolution: float = Query(0, ge=0),
+    current_user: str = Depends(verify_token),
+):
+    return await peer_stats(since, resolution)
+
+
+async def _stats_events():
+    """
+    Yields a `snapshot` event with every peer, then a `delta` event for
+    each sample that changed rx/tx/handshake values. Ends once the token
+    that opened it could have expired, so the client re-authenticates.
+    """
+    queue = sampler.subscribe()
+    deadline = monotonic() + TOKEN_MAX_AGE
+    try:
+        event = None
+        while monotonic() < deadline:
+            if event is None:
+                yield f"event: snapshot\ndata: {json.dumps(sampler.current())}\n\n"
+            else:
+                yield f"event: delta\ndata: {event}\n\n"
+            while True:
+                timeout = min(STREAM_KEEPALIVE_SECONDS, deadline - monotonic())
+                try:
+                    event = await asyncio.wait_for(queue.get(), max(0, timeout))
+                    break
+                except TimeoutError:
+                    if monotonic() >= deadline:
+                        return
+                    yield ": keepalive\n\n"
+    finally:
+        sampler.unsubscribe(queue)
+
+
+@router.get("/peers/stats/stream")
+async def api_peer_stats_stream(current_user: str = Depends(verify_token)):
+    return StreamingResponse(
+        _stats_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/interfaces", response_model=List[InterfaceInfo])
+async def api_interfaces(request: Request, current_user: str = Depends(verify_token)):
+    """
+    Returns every interface with its port, address pools, stored peers
+    and the traffic of its peers as of the last stats sample.
+    """
+    config = _require_config(request)
+    pools = await get_address_pools()
+    stored = interface_peers.read()
+    live = sampler.interface_stats()
+    empty = {"peers": 0, "connected": 0, "rx_bytes": 0, "tx_bytes": 0}
+    result = []
+    for name in INTERFACES:
+        stats = live.get(name, empty)
+        result.append(
+            {
+                "name": name,
+                "port": interface_port(config.wg_port, name),
+                "pools": [pool.name for pool in pools.by_interface[name]],
+                "capacity": pools.interface_capacity(name),
+                "peers": stored[name],
+                "live_peers": stats["peers"],
+                "connected": stats["connected"],
+                "rx_bytes": stats["rx_bytes"],
+                "tx_bytes": stats["tx_bytes"],
+            }
+        )
+    return result
+
+
+@router.get("/replication/stream", include_in_schema=False)
+async def api_replication_stream(
+    request: Request, since: Optional[int] = None, log: Optional[str] = None
+):
+    """
+    Streams the peer change log to a gateway agent as server-sent events,
+    resuming after version `since` of change log `log` when possible.
+    """
+    _require_bearer(request, REPLICATION_TOKEN, "replication")
+    return StreamingResponse(
+        change_events(since, log),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get("/serverinfo", response_model=ServerInfo)
@@ -102,6 +525,63 @@ async def server_info(current_user: str = Depends(verify_token)):
         return {
             "uptime": strftime("%H:%M:%S", gmtime(up)),
             "load": "{:.2f} {:.2f} {:.2f}".format(*getloadavg()),
+            "peers": peer_state.read()["count"],
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+_peer_metrics = (None, "")
+
+
+def _render_peer_metrics():
+    """Per-peer lines, rebuilt only when the sampler has a new sample."""
+    global _peer_metrics
+    sampled_at, text = _peer_metrics
+    if sampled_at == sampler.sampled_at:
+        return text
+    families = {
+        "wireguard_peer_receive_bytes_total": ("counter", "Bytes received."),
+        "wireguard_peer_transmit_bytes_total": ("counter", "Bytes sent."),
+        "wireguard_peer_last_handshake_age_seconds": (
+            "gauge",
+            "Seconds since the last handshake, as of the last sample.",
+        ),
+    }
+    rx, tx, age = [], [], []
+    for interface, samples in sampler.by_interface():
+        for pub, rx_bytes, tx_bytes, handshake, _ in samples:
+            labels = f'{{interface="{interface}",public_key="{pub}"}}'
+            rx.append(f"wireguard_peer_receive_bytes_total{labels} {rx_bytes}")
+            tx.append(f"wireguard_peer_transmit_bytes_total{labels} {tx_bytes}")
+            if handshake:
+                age.append(
+                    f"wireguard_peer_last_handshake_age_seconds{labels} "
+                    f"{max(0, int(sampler.sampled_at) - handshake)}"
+                )
+    lines = []
+    for (name, (kind, help_text)), samples in zip(families.items(), (rx, tx, age)):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", *samples]
+    lines += [
+        "# HELP wireguard_peers Peers on the interfaces in the last sample.",
+        "# TYPE wireguard_peers gauge",
+        f"wireguard_peers {len(sampler.latest)}",
+        "# HELP wireguard_interface_peers Peers per interface in the last sample.",
+        "# TYPE wireguard_interface_peers gauge",
+        *(
+            f'wireguard_interface_peers{{interface="{interface}"}} {count}'
+            for interface, count in sampler.spans
+        ),
+    ]
+    text = "\n".join(lines)
+    _peer_metrics = (sampler.sampled_at, text)
+    return text
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    _require_bearer(request, METRICS_TOKEN, "metrics")
+    return PlainTextResponse(
+        "\n".join(render_histograms()) + "\n" + _render_peer_metrics() + "\n",
+        media_type="text/plain; version=0.0.4",
+    )
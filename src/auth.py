@@ -1,56 +1,242 @@
+from collections import OrderedDict
+from hashlib import sha256
+from os import environ
+from time import time
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from itsdangerous import SignatureExpired, BadSignature
 
-from db import verify_user_db
+from aiodb import (
+    clear_login_failures_db,
+    get_login_failure_db,
+    get_revoked_tokens_db,
+    record_login_failure_db,
+    revoke_token_db,
+)
+from passwords import HashingBusy, verify_user
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/login")
 
+# Lifetime of an access token, in seconds
+TOKEN_MAX_AGE = 1800
+
+# Verified tokens remembered per worker
+TOKEN_CACHE_SIZE = int(environ.get("WG_TOKEN_CACHE_SIZE", "1024"))
+
+# How stale a worker's view of revoked tokens may get
+REVOCATION_REFRESH_SECONDS = 1.0
+
+# Failed logins tolerated per window before further attempts are refused
+LOGIN_WINDOW_SECONDS = int(environ.get("WG_LOGIN_WINDOW", "300"))
+MAX_FAILURES_PER_USER = int(environ.get("WG_LOGIN_MAX_FAILURES_USER", "5"))
+MAX_FAILURES_PER_IP = int(environ.get("WG_LOGIN_MAX_FAILURES_IP", "20"))
+
+
+class LoginThrottle:
+    """
+    Sliding-window count of failed logins per key (username or client IP).
+    Failures are stored in the DB, so the limit holds across all workers.
+    """
+
+    def __init__(self, name, limit, window):
+        self.name = name
+        self.limit = limit
+        self.window = window
+
+    async def retry_after(self, key) -> int:
+        """Returns seconds until `key` may try again, 0 if allowed now."""
+        now = time()
+        oldest = await get_login_failure_db(
+            self.name, key, now - self.window, self.limit - 1
+        )
+        if oldest is None:
+            return 0
+        return int(oldest + self.window - now) + 1
+
+    async def record_failure(self, key) -> None:
+        now = time()
+        await record_login_failure_db(self.name, key, now, now - self.window)
+
+    async def reset(self, key) -> None:
+        await clear_login_failures_db(self.name, key)
+
+
+user_throttle = LoginThrottle("user", MAX_FAILURES_PER_USER, LOGIN_WINDOW_SECONDS)
+ip_throttle = LoginThrottle("ip", MAX_FAILURES_PER_IP, LOGIN_WINDOW_SECONDS)
+
+
+def client_ip(request: Request) -> str:
+    """Returns the client address forwarded by Caddy, or the socket peer."""
+    forwarded = request.headers.get("x-real-ip")
+    if forwarded:
+        return forwarded
+    return request.client.host if request.client else "unknown"
+
 
 def generate_token(request: Request, username: str) -> str:
     """Generates a time-sensitive token for the user."""
     return request.app.state.config.ts.dumps({"user": username})
 
 
-def verify_token(request: Request, token: str = Depends(oauth2_scheme)) -> str:
+def _unauthorized(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+class TokenCache:
+    """
+    Bounded LRU of verified tokens, keyed by token digest and mapping to
+    (user, expiry). Hits skip the signature check entirely. Revocations are
+    stored in the DB and pulled at most once per REVOCATION_REFRESH_SECONDS,
+    so a logout in one worker reaches the others within that interval.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._revoked = set()
+        self._revoked_at = 0.0
+
+    @staticmethod
+    def digest(token: str) -> str:
+        return sha256(token.encode()).hexdigest()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, user, expires_at):
+        self._entries[key] = (user, expires_at)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def discard(self, key):
+        self._entries.pop(key, None)
+
+    def is_revoked(self, key) -> bool:
+        return key in self._revoked
+
+    async def refresh_revocations(self):
+        now = time()
+        if now - self._revoked_at < REVOCATION_REFRESH_SECONDS:
+            return
+        self._revoked_at = now
+        self._revoked = set(await get_revoked_tokens_db(now))
+        for key in self._revoked:
+            self.discard(key)
+
+    async def revoke(self, key, expires_at):
+        self._revoked.add(key)
+        self.discard(key)
+        await revoke_token_db(key, expires_at, time())
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._entries),
+        }
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
+
+async def verify_token(request: Request, token: str = Depends(oauth2_scheme)) -> str:
     """Verifies the provided token. Raises HTTPException on failure."""
     if not request.app.state.config.ts:
         raise HTTPException(
             status_code=503,
             detail="Authentication service not available due to startup error.",
         )
+    await token_cache.refresh_revocations()
+    key = token_cache.digest(token)
+    if token_cache.is_revoked(key):
+        raise _unauthorized("Token has been revoked")
+
+    cached = token_cache.get(key)
+    if cached is not None:
+        user, expires_at = cached
+        if time() < expires_at:
+            token_cache.hits += 1
+            return user
+        token_cache.discard(key)
+        raise _unauthorized("Token has expired")
+
+    token_cache.misses += 1
     try:
-        user = request.app.state.config.ts.loads(token, max_age=1800).get("user")
-        if user is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid token",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        return user
-    except SignatureExpired:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token has expired",
-            headers={"WWW-Authenticate": "Bearer"},
+        payload, issued = request.app.state.config.ts.loads(
+            token, max_age=TOKEN_MAX_AGE, return_timestamp=True
         )
+    except SignatureExpired:
+        raise _unauthorized("Token has expired")
     except BadSignature:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid token signature",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        raise _unauthorized("Invalid token signature")
+    user = payload.get("user")
+    if user is None:
+        raise _unauthorized("Invalid token")
+    token_cache.put(key, user, issued.timestamp() + TOKEN_MAX_AGE)
+    return user
 
 
 @router.post("/login")
 async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
     """Endpoint to authenticate a user and provide an access token."""
-    if not verify_user_db(form_data.username, form_data.password):
+    ip = client_ip(request)
+    retry = max(
+        await user_throttle.retry_after(form_data.username),
+        await ip_throttle.retry_after(ip),
+    )
+    if retry:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many failed login attempts",
+            headers={"Retry-After": str(retry)},
+        )
+    try:
+        valid = await verify_user(form_data.username, form_data.password)
+    except HashingBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Login service is busy, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    if not valid:
+        await user_throttle.record_failure(form_data.username)
+        await ip_throttle.record_failure(ip)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    await user_throttle.reset(form_data.username)
     access_token = generate_token(request, form_data.username)
     return {"access_token": access_token, "token_type": "bearer"}
+
+
+@router.post("/logout")
+async def logout(
+    token: str = Depends(oauth2_scheme), current_user: str = Depends(verify_token)
+):
+    """Revokes the caller's access token."""
+    key = token_cache.digest(token)
+    cached = token_cache.get(key)
+    expires_at = cached[1] if cached else time() + TOKEN_MAX_AGE
+    await token_cache.revoke(key, expires_at)
+    return {"revoked": True}
+
+
+@router.get("/auth/cache")
+async def token_cache_stats(current_user: str = Depends(verify_token)):
+    """Reports hit/miss counters of the verified-token cache."""
+    return token_cache.stats()
@@ -0,0 +1,545 @@
+"""
+Interface backends for the live WireGuard device.
+
+Every backend exposes the same three coroutines:
+
+    get_peers(interface)            -> list of PeerState
+    set_peers(interface, peers)     -> add/update (public_key, allowed_ips) pairs
+    remove_peers(interface, keys)   -> drop peers by public key
+
+`NetlinkBackend` speaks the kernel's WireGuard generic-netlink family,
+`UapiBackend` speaks the cross-platform userspace socket used by boringtun,
+`CliBackend` falls back to the `wg` binary, and `FakeBackend` keeps
+everything in memory so the rest of the app can run without a kernel module.
+"""
+
+import asyncio
+import logging
+import socket
+import struct
+from base64 import b64decode, b64encode
+from ipaddress import ip_address, ip_network
+from os import environ, path
+
+from cli import run_command
+from interfaces import INTERFACES
+
+# First interface managed by the app, probed to pick a backend
+WG_INTERFACE = INTERFACES[0]
+
+# Directory where userspace implementations (boringtun) expose their UAPI sockets
+UAPI_DIR = "/var/run/wireguard"
+
+# Peers per message/command, keeps netlink messages and argv well under limits
+CHUNK_SIZE = 256
+
+# Bytes read from a UAPI socket at a time
+UAPI_READ_SIZE = 1 << 16
+
+
+class PeerState:
+    """Live state of one peer on an interface."""
+
+    __slots__ = (
+        "public_key",
+        "allowed_ips",
+        "endpoint",
+        "last_handshake",
+        "rx_bytes",
+        "tx_bytes",
+        "persistent_keepalive",
+    )
+
+    def __init__(
+        self,
+        public_key,
+        allowed_ips=(),
+        endpoint=None,
+        last_handshake=0,
+        rx_bytes=0,
+        tx_bytes=0,
+        persistent_keepalive=0,
+    ):
+        self.public_key = public_key
+        self.allowed_ips = list(allowed_ips)
+        self.endpoint = endpoint
+        self.last_handshake = last_handshake
+        self.rx_bytes = rx_bytes
+        self.tx_bytes = tx_bytes
+        self.persistent_keepalive = persistent_keepalive
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+class Backend:
+    """Base class documenting the backend interface."""
+
+    name = "base"
+
+    async def get_peers(self, interface):
+        raise NotImplementedError
+
+    async def set_peers(self, interface, peers):
+        raise NotImplementedError
+
+    async def remove_peers(self, interface, public_keys):
+        raise NotImplementedError
+
+
+# --- wg(8) subprocess fallback ---
+class CliBackend(Backend):
+    """Drives the interface through the `wg` binary, batching peers per call."""
+
+    name = "cli"
+
+    async def get_peers(self, interface):
+        output = await run_command(f"wg show {interface} dump")
+        peers = []
+        for line in output.split("\n")[1:]:  # Skip interface line
+            fields = line.split("\t")
+            if len(fields) < 8:
+                continue
+            pub, _, endpoint, allowed, last_hs, rx, tx, keepalive, *_ = fields
+            peers.append(
+                PeerState(
+                    pub,
+                    [] if allowed == "(none)" else allowed.split(","),
+                    None if endpoint == "(none)" else endpoint,
+                    int(last_hs),
+                    int(rx),
+                    int(tx),
+                    0 if keepalive == "off" else int(keepalive),
+                )
+            )
+        return peers
+
+    async def set_peers(self, interface, peers):
+        for chunk in _chunks(peers):
+            args = " ".join(
+                f"peer {pub} allowed-ips {','.join(allowed)}" for pub, allowed in chunk
+            )
+            await run_command(f"wg set {interface} {args}")
+
+    async def remove_peers(self, interface, public_keys):
+        for chunk in _chunks(public_keys):
+            args = " ".join(f"peer {pub} remove" for pub in chunk)
+            await run_command(f"wg set {interface} {args}")
+
+
+# --- Cross-platform userspace API (boringtun, wireguard-go) ---
+class UapiBackend(Backend):
+    """Talks the text-based configuration protocol over the UAPI unix socket."""
+
+    name = "uapi"
+
+    def __init__(self, socket_dir=UAPI_DIR):
+        self.socket_dir = socket_dir
+
+    def socket_path(self, interface):
+        return path.join(self.socket_dir, f"{interface}.sock")
+
+    async def _request(self, interface, payload):
+        sock_path = self.socket_path(interface)
+        reader, writer = await asyncio.open_unix_connection(sock_path)
+        try:
+            writer.write(payload.encode())
+            await writer.drain()
+            # A get=1 dump grows with the peer count, past the StreamReader
+            # limit readuntil() enforces, so collect it up to the blank
+            # line that ends every response
+            response = bytearray()
+            while not response.endswith(b"\n\n"):
+                chunk = await reader.read(UAPI_READ_SIZE)
+                if not chunk:
+                    break
+                response += chunk
+        finally:
+            writer.close()
+            await writer.wait_closed()
+        lines = response.decode().strip().split("\n")
+        if not lines or not lines[-1].startswith("errno="):
+            raise RuntimeError(f"Malformed UAPI response from {interface}")
+        errno = int(lines[-1].split("=", 1)[1])
+        if errno != 0:
+            raise RuntimeError(f"UAPI request on {interface} failed with errno {errno}")
+        return lines[:-1]
+
+    async def get_peers(self, interface):
+        peers = []
+        current = None
+        for line in await self._request(interface, "get=1\n\n"):
+            key, _, value = line.partition("=")
+            if key == "public_key":
+                current = PeerState(b64encode(bytes.fromhex(value)).decode())
+                peers.append(current)
+            elif current is None:
+                continue  # Interface-level keys
+            elif key == "allowed_ip":
+                current.allowed_ips.append(value)
+            elif key == "endpoint":
+                current.endpoint = value
+            elif key == "last_handshake_time_sec":
+                current.last_handshake = int(value)
+            elif key == "rx_bytes":
+                current.rx_bytes = int(value)
+            elif key == "tx_bytes":
+                current.tx_bytes = int(value)
+            elif key == "persistent_keepalive_interval":
+                current.persistent_keepalive = int(value)
+        return peers
+
+    async def set_peers(self, interface, peers):
+        for chunk in _chunks(peers):
+            lines = ["set=1"]
+            for pub, allowed in chunk:
+                lines.append(f"public_key={b64decode(pub).hex()}")
+                lines.append("replace_allowed_ips=true")
+                lines.extend(f"allowed_ip={ip}" for ip in allowed)
+            await self._request(interface, "\n".join(lines) + "\n\n")
+
+    async def remove_peers(self, interface, public_keys):
+        for chunk in _chunks(public_keys):
+            lines = ["set=1"]
+            for pub in chunk:
+                lines.append(f"public_key={b64decode(pub).hex()}")
+                lines.append("remove=true")
+            await self._request(interface, "\n".join(lines) + "\n\n")
+
+
+# --- Kernel generic netlink ---
+NETLINK_GENERIC = 16
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 0x2
+NLMSG_DONE = 0x3
+NLA_F_NESTED = 1 << 15
+NLA_TYPE_MASK = ~(NLA_F_NESTED | (1 << 14))
+
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+WG_GENL_NAME = "wireguard"
+WG_GENL_VERSION = 1
+WG_CMD_GET_DEVICE = 0
+WG_CMD_SET_DEVICE = 1
+WGDEVICE_A_IFNAME = 2
+WGDEVICE_A_PEERS = 8
+WGPEER_A_PUBLIC_KEY = 1
+WGPEER_A_FLAGS = 3
+WGPEER_A_ENDPOINT = 4
+WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL = 5
+WGPEER_A_LAST_HANDSHAKE_TIME = 6
+WGPEER_A_RX_BYTES = 7
+WGPEER_A_TX_BYTES = 8
+WGPEER_A_ALLOWEDIPS = 9
+WGPEER_F_REMOVE_ME = 1
+WGPEER_F_REPLACE_ALLOWEDIPS = 2
+WGALLOWEDIP_A_FAMILY = 1
+WGALLOWEDIP_A_IPADDR = 2
+WGALLOWEDIP_A_CIDR_MASK = 3
+
+
+def _nla(attr_type, payload):
+    header = struct.pack("=HH", 4 + len(payload), attr_type)
+    return header + payload + b"\0" * (-len(payload) % 4)
+
+
+def _nested(attr_type, *children):
+    return _nla(attr_type | NLA_F_NESTED, b"".join(children))
+
+
+def _parse_attrs(data):
+    attrs = []
+    offset = 0
+    while offset + 4 <= len(data):
+        length, attr_type = struct.unpack_from("=HH", data, offset)
+        if length < 4:
+            break
+        attrs.append((attr_type & NLA_TYPE_MASK, data[offset + 4 : offset + length]))
+        offset += (length + 3) & ~3
+    return attrs
+
+
+def _parse_sockaddr(data):
+    family = struct.unpack_from("=H", data)[0]
+    port = struct.unpack_from("!H", data, 2)[0]
+    if family == socket.AF_INET:
+        return f"{socket.inet_ntop(socket.AF_INET, data[4:8])}:{port}"
+    if family == socket.AF_INET6:
+        return f"[{socket.inet_ntop(socket.AF_INET6, data[8:24])}]:{port}"
+    return None
+
+
+def _allowed_ip_attr(cidr):
+    network = ip_network(cidr, strict=False)
+    family = socket.AF_INET if network.version == 4 else socket.AF_INET6
+    return _nested(
+        0,
+        _nla(WGALLOWEDIP_A_FAMILY, struct.pack("=H", family)),
+        _nla(WGALLOWEDIP_A_IPADDR, network.network_address.packed),
+        _nla(WGALLOWEDIP_A_CIDR_MASK, struct.pack("=B", network.prefixlen)),
+    )
+
+
+class NetlinkBackend(Backend):
+    """Talks to the in-kernel WireGuard module over generic netlink."""
+
+    name = "netlink"
+
+    def __init__(self):
+        self._family_id = None
+        self._seq = 0
+
+    def _open(self):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_GENERIC)
+        sock.bind((0, 0))
+        return sock
+
+    def _transact(self, sock, msg_type, flags, cmd, version, attrs):
+        """Send one request and collect reply payloads until DONE or ACK."""
+        self._seq += 1
+        seq = self._seq
+        payload = struct.pack("=BBH", cmd, version, 0) + attrs
+        header = struct.pack("=IHHII", 16 + len(payload), msg_type, flags, seq, 0)
+        sock.send(header + payload)
+
+        replies = []
+        while True:
+            data = sock.recv(1 << 16)
+            offset = 0
+            while offset + 16 <= len(data):
+                length, rtype, rflags, rseq, _ = struct.unpack_from(
+                    "=IHHII", data, offset
+                )
+                body = data[offset + 16 : offset + length]
+                offset += (length + 3) & ~3
+                if rseq != seq:
+                    continue
+                if rtype == NLMSG_ERROR:
+                    error = struct.unpack_from("=i", body)[0]
+                    if error != 0:
+                        raise OSError(-error, "WireGuard netlink request failed")
+                    return replies
+                if rtype == NLMSG_DONE:
+                    return replies
+                replies.append(body[4:])  # Strip genlmsghdr
+                if not rflags & NLM_F_MULTI and not flags & NLM_F_ACK:
+                    return replies
+
+    def _resolve_family(self, sock):
+        if self._family_id is None:
+            name = _nla(CTRL_ATTR_FAMILY_NAME, WG_GENL_NAME.encode() + b"\0")
+            replies = self._transact(
+                sock,
+                GENL_ID_CTRL,
+                NLM_F_REQUEST | NLM_F_ACK,
+                CTRL_CMD_GETFAMILY,
+                1,
+                name,
+            )
+            for reply in replies:
+                for attr_type, value in _parse_attrs(reply):
+                    if attr_type == CTRL_ATTR_FAMILY_ID:
+                        self._family_id = struct.unpack("=H", value)[0]
+            if self._family_id is None:
+                raise RuntimeError("WireGuard generic netlink family not found")
+        return self._family_id
+
+    def available(self):
+        """Return True if the kernel exposes the WireGuard netlink family."""
+        try:
+            with self._open() as sock:
+                self._resolve_family(sock)
+            return True
+        except (OSError, RuntimeError):
+            return False
+
+    def _get_peers(self, interface):
+        ifname = _nla(WGDEVICE_A_IFNAME, interface.encode() + b"\0")
+        with self._open() as sock:
+            family = self._resolve_family(sock)
+            replies = self._transact(
+                sock,
+                family,
+                NLM_F_REQUEST | NLM_F_ACK | NLM_F_DUMP,
+                WG_CMD_GET_DEVICE,
+                WG_GENL_VERSION,
+                ifname,
+            )
+
+        # A peer's allowed IPs may be split across dump messages; merge by key
+        peers = {}
+        for reply in replies:
+            for attr_type, value in _parse_attrs(reply):
+                if attr_type != WGDEVICE_A_PEERS:
+                    continue
+                for _, peer_attrs in _parse_attrs(value):
+                    self._parse_peer(_parse_attrs(peer_attrs), peers)
+        return list(peers.values())
+
+    @staticmethod
+    def _parse_peer(attrs, peers):
+        fields = dict(attrs)
+        pub = b64encode(fields[WGPEER_A_PUBLIC_KEY]).decode()
+        peer = peers.get(pub)
+        if peer is None:
+            peer = peers[pub] = PeerState(pub)
+        if WGPEER_A_ENDPOINT in fields:
+            peer.endpoint = _parse_sockaddr(fields[WGPEER_A_ENDPOINT])
+        if WGPEER_A_LAST_HANDSHAKE_TIME in fields:
+            peer.last_handshake = struct.unpack_from(
+                "=q", fields[WGPEER_A_LAST_HANDSHAKE_TIME]
+            )[0]
+        if WGPEER_A_RX_BYTES in fields:
+            peer.rx_bytes = struct.unpack("=Q", fields[WGPEER_A_RX_BYTES])[0]
+        if WGPEER_A_TX_BYTES in fields:
+            peer.tx_bytes = struct.unpack("=Q", fields[WGPEER_A_TX_BYTES])[0]
+        if WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL in fields:
+            peer.persistent_keepalive = struct.unpack(
+                "=H", fields[WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL]
+            )[0]
+        if WGPEER_A_ALLOWEDIPS in fields:
+            for _, allowed in _parse_attrs(fields[WGPEER_A_ALLOWEDIPS]):
+                ip = dict(_parse_attrs(allowed))
+                address = ip_address(ip[WGALLOWEDIP_A_IPADDR])
+                prefix = ip[WGALLOWEDIP_A_CIDR_MASK][0]
+                peer.allowed_ips.append(f"{address}/{prefix}")
+
+    def _set_device(self, interface, peer_attrs):
+        if not peer_attrs:
+            return
+        ifname = _nla(WGDEVICE_A_IFNAME, interface.encode() + b"\0")
+        with self._open() as sock:
+            family = self._resolve_family(sock)
+            for chunk in _chunks(peer_attrs):
+                self._transact(
+                    sock,
+                    family,
+                    NLM_F_REQUEST | NLM_F_ACK,
+                    WG_CMD_SET_DEVICE,
+                    WG_GENL_VERSION,
+                    ifname + _nested(WGDEVICE_A_PEERS, *chunk),
+                )
+
+    def _set_peers(self, interface, peers):
+        # List entries are all nested under type 0, like wg(8) does
+        flags = _nla(WGPEER_A_FLAGS, struct.pack("=I", WGPEER_F_REPLACE_ALLOWEDIPS))
+        entries = []
+        for pub, allowed in peers:
+            entries.append(
+                _nested(
+                    0,
+                    _nla(WGPEER_A_PUBLIC_KEY, b64decode(pub)),
+                    flags,
+                    _nested(
+                        WGPEER_A_ALLOWEDIPS,
+                        *(_allowed_ip_attr(cidr) for cidr in allowed),
+                    ),
+                )
+            )
+        self._set_device(interface, entries)
+
+    def _remove_peers(self, interface, public_keys):
+        entries = [
+            _nested(
+                0,
+                _nla(WGPEER_A_PUBLIC_KEY, b64decode(pub)),
+                _nla(WGPEER_A_FLAGS, struct.pack("=I", WGPEER_F_REMOVE_ME)),
+            )
+            for pub in public_keys
+        ]
+        self._set_device(interface, entries)
+
+    async def get_peers(self, interface):
+        return await asyncio.to_thread(self._get_peers, interface)
+
+    async def set_peers(self, interface, peers):
+        await asyncio.to_thread(self._set_peers, interface, list(peers))
+
+    async def remove_peers(self, interface, public_keys):
+        await asyncio.to_thread(self._remove_peers, interface, list(public_keys))
+
+
+# --- In-memory backend for tests and benchmarks ---
+class FakeBackend(Backend):
+    """Keeps peers in memory, keyed by interface then public key."""
+
+    name = "fake"
+
+    def __init__(self):
+        self.interfaces = {}
+        self.calls = 0
+
+    async def get_peers(self, interface):
+        self.calls += 1
+        return list(self.interfaces.get(interface, {}).values())
+
+    async def set_peers(self, interface, peers):
+        self.calls += 1
+        device = self.interfaces.setdefault(interface, {})
+        for pub, allowed in peers:
+            if pub in device:
+                device[pub].allowed_ips = list(allowed)
+            else:
+                device[pub] = PeerState(pub, allowed)
+
+    async def remove_peers(self, interface, public_keys):
+        self.calls += 1
+        device = self.interfaces.setdefault(interface, {})
+        for pub in public_keys:
+            device.pop(pub, None)
+
+
+BACKENDS = {
+    "cli": CliBackend,
+    "uapi": UapiBackend,
+    "netlink": NetlinkBackend,
+    "fake": FakeBackend,
+}
+
+_backend = None
+
+
+def _detect_backend():
+    if path.exists(path.join(UAPI_DIR, f"{WG_INTERFACE}.sock")):
+        return UapiBackend()
+    netlink = NetlinkBackend()
+    if netlink.available():
+        return netlink
+    return CliBackend()
+
+
+def get_backend() -> Backend:
+    """
+    Returns the process-wide interface backend, chosen by WG_BACKEND
+    (auto, netlink, uapi, cli, fake). `auto` prefers a UAPI socket, then
+    the kernel netlink family, then the `wg` binary.
+    """
+    global _backend
+    if _backend is None:
+        choice = environ.get("WG_BACKEND", "auto").strip(" '\"").lower()
+        if choice == "auto":
+            _backend = _detect_backend()
+        elif choice in BACKENDS:
+            _backend = BACKENDS[choice]()
+        else:
+            raise RuntimeError(f"Unknown WG_BACKEND '{choice}'")
+        logging.info(f"Using '{_backend.name}' WireGuard interface backend")
+    return _backend
+
+
+def set_backend(backend: Backend) -> None:
+    """Overrides the process-wide backend (tests, benchmarks)."""
+    global _backend
+    _backend = backend
@@ -1,17 +1,20 @@
 import asyncio
 
+from metrics import command_seconds
+
 
 async def run_command(command, stdin_input=None):
     """Helper to run a shell command asynchronously."""
-    process = await asyncio.create_subprocess_shell(
-        command,
-        stdin=asyncio.subprocess.PIPE if stdin_input else None,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
-    stdout, stderr = await process.communicate(
-        input=stdin_input.encode() if stdin_input else None
-    )
+    with command_seconds.time(" ".join(command.split()[:2])):
+        process = await asyncio.create_subprocess_shell(
+            command,
+            stdin=asyncio.subprocess.PIPE if stdin_input else None,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await process.communicate(
+            input=stdin_input.encode() if stdin_input else None
+        )
 
     if process.returncode != 0:
         raise RuntimeError(
@@ -0,0 +1,170 @@
+"""
+Client-side WireGuard configs and their QR codes, rendered on the server.
+
+Artifacts are cached per worker in a small LRU keyed by the peer's
+keys and addresses plus a fingerprint of the server settings that go into
+the file, so a changed endpoint, DNS server or server key is picked up
+without any explicit invalidation.
+"""
+
+import asyncio
+from collections import OrderedDict
+from hashlib import sha1
+from os import environ
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+from interfaces import interface_port
+
+# qr is imported on first use, keeping the encoder off the startup path
+
+# Rendered configs and QR codes kept per worker
+CACHE_SIZE = int(environ.get("WG_ARTIFACT_CACHE_SIZE", "256"))
+
+# Media types of the artifact kinds
+MEDIA_TYPES = {
+    "conf": "text/plain; charset=utf-8",
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+
+_cache = OrderedDict()
+
+
+def config_version(config):
+    """Fingerprint of the server settings that go into client configs."""
+    return sha1(
+        "\0".join(
+            [
+                config.wg_public_key,
+                config.wg_endpoint,
+                config.wg_port,
+                config.wg_dns_server,
+                config.wg_allowed_ips,
+            ]
+        ).encode()
+    ).hexdigest()[:16]
+
+
+def render_client_config(peer, config):
+    """
+    Returns the .conf text a client imports to connect as `peer`, pointed
+    at the port of the peer's interface.
+    """
+    return "\n".join(
+        [
+            "[Interface]",
+            f"PrivateKey = {peer['private_key']}",
+            f"Address = {peer['ipv4_address']}/32, {peer['ipv6_address']}/128",
+            f"DNS = {config.wg_dns_server}",
+            "",
+            "[Peer]",
+            f"PublicKey = {config.wg_public_key}",
+            f"Endpoint = {config.wg_endpoint}:"
+            f"{interface_port(config.wg_port, peer['interface'])}",
+            f"AllowedIPs = {config.wg_allowed_ips}",
+            "PersistentKeepalive = 25",
+            "",
+        ]
+    )
+
+
+def artifact_etag(peer, config):
+    """Strong ETag shared by every artifact kind of one peer and config."""
+    digest = sha1(
+        "\0".join(
+            [
+                peer["public_key"],
+                peer["private_key"],
+                peer["ipv4_address"],
+                peer["ipv6_address"],
+                peer["interface"],
+                config_version(config),
+            ]
+        ).encode()
+    )
+    return f'"{digest.hexdigest()[:24]}"'
+
+
+def render_artifact(kind, peer, config):
+    """Renders the `kind` artifact of `peer` as bytes, bypassing the cache."""
+    text = render_client_config(peer, config)
+    if kind == "conf":
+        return text.encode()
+    import qr
+
+    code = qr.encode(text)
+    return code.png() if kind == "png" else code.svg().encode()
+
+
+async def get_artifact(kind, peer, config):
+    """
+    Returns the `kind` artifact of `peer` from the cache, rendering it on
+    a miss. QR codes are encoded off the event loop, as a full config
+    takes tens of milliseconds to encode.
+    """
+    key = (kind, artifact_etag(peer, config))
+    body = _cache.get(key)
+    if body is not None:
+        _cache.move_to_end(key)
+        return body
+    if kind == "conf":
+        body = render_artifact(kind, peer, config)
+    else:
+        body = await asyncio.to_thread(render_artifact, kind, peer, config)
+    if CACHE_SIZE > 0:
+        _cache[key] = body
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return body
+
+
+class _ZipSink:
+    """Write-only file for ZipFile whose output is drained chunk by chunk."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _zip_peers(archive, sink, peers, config, qr_kind):
+    for peer in peers:
+        name = f"wg-peer-{peer['ipv4_address']}"
+        archive.writestr(
+            f"{name}.conf", render_artifact("conf", peer, config), ZIP_DEFLATED
+        )
+        if qr_kind:
+            # PNGs are already deflated
+            method = ZIP_STORED if qr_kind == "png" else ZIP_DEFLATED
+            archive.writestr(
+                f"{name}.{qr_kind}", render_artifact(qr_kind, peer, config), method
+            )
+    return sink.take()
+
+
+async def stream_zip(pages, config, qr_kind=None):
+    """
+    Yields a zip archive of the client config (and QR code, if `qr_kind`
+    is "png" or "svg") of every peer from the async iterator `pages`,
+    one chunk per page, without holding the archive in memory.
+    """
+    sink = _ZipSink()
+    archive = ZipFile(sink, "w")
+    async for peers in pages:
+        chunk = await asyncio.to_thread(
+            _zip_peers, archive, sink, peers, config, qr_kind
+        )
+        if chunk:
+            yield chunk
+    archive.close()
+    yield sink.take()
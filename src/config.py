@@ -1,9 +1,55 @@
 import logging
-from os import environ
+from hashlib import sha256
+from os import environ, makedirs, path, replace, unlink
+from tempfile import NamedTemporaryFile
 from itsdangerous import URLSafeTimedSerializer as Serializer
-from cli import run_command
-from asyncio import Lock
-from aiofiles import open
+from keys import public_key
+from locks import LOCK_DIR
+from asyncio import Lock, to_thread
+
+# Server private key, and where the public key derived from it is cached
+PRIVATE_KEY_PATH = "/etc/wireguard/privatekey"
+PUBLIC_KEY_CACHE = path.join(LOCK_DIR, "server.pub")
+
+
+def _env_list(name, default):
+    """Reads a comma-separated environment variable into a list of strings."""
+    value = environ.get(name, "").strip(" '\"") or default
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def _cached_server_pubkey():
+    """
+    Returns the public key of PRIVATE_KEY_PATH, derived by the first worker
+    to start and cached next to the locks, keyed by a digest of the
+    private key so a rotated key is never answered from the cache.
+    """
+    with open(PRIVATE_KEY_PATH) as f:
+        priv = f.read().strip()
+    digest = sha256(priv.encode()).hexdigest()
+    try:
+        with open(PUBLIC_KEY_CACHE) as f:
+            cached_digest, _, pub = f.read().strip().partition(" ")
+        if cached_digest == digest:
+            return pub
+    except (FileNotFoundError, ValueError):
+        pass
+    pub = public_key(priv)
+    try:
+        makedirs(LOCK_DIR, exist_ok=True)
+        # Own temp file per worker, as several may start at once
+        with NamedTemporaryFile(
+            "w", dir=LOCK_DIR, prefix=".server-", suffix=".pub", delete=False
+        ) as f:
+            f.write(f"{digest} {pub}\n")
+        try:
+            replace(f.name, PUBLIC_KEY_CACHE)
+        except OSError:
+            unlink(f.name)
+            raise
+    except OSError as e:
+        logging.warning(f"Could not cache the server public key: {e}")
+    return pub
 
 
 class AppConfig:
@@ -19,6 +65,8 @@ class AppConfig:
         self.ts = None
         self.wg_ipv4_base_addr = None
         self.wg_ipv6_base_addr = None
+        self.wg_ipv4_pools = None
+        self.wg_ipv6_pools = None
 
         self._is_loaded = False
         self._load_lock = Lock()
@@ -27,9 +75,7 @@ class AppConfig:
         """
         Derive server public key from stored private key asynchronously.
         """
-        async with open("/etc/wireguard/privatekey") as f:
-            priv = (await f.read()).strip()
-        return await run_command("wg pubkey", stdin_input=priv)
+        return await to_thread(_cached_server_pubkey)
 
     async def load(self):
         """
@@ -55,6 +101,14 @@ class AppConfig:
             self.wg_ipv6_base_addr = environ.get(
                 "WG_IPV6_BASE_ADDR", "fd86:ea04:1111::1"
             )
+            # Peer address pools as CIDRs, paired by position; default to the
+            # /24 and /64 around the base addresses
+            self.wg_ipv4_pools = _env_list(
+                "WG_IPV4_POOLS", f"{self.wg_ipv4_base_addr}/24"
+            )
+            self.wg_ipv6_pools = _env_list(
+                "WG_IPV6_POOLS", f"{self.wg_ipv6_base_addr}/64"
+            )
             self._is_loaded = True
             logging.info("Successfully loaded server public key and config.")
 
@@ -1,64 +1,742 @@
-from os import makedirs, path
+from contextlib import contextmanager
+from os import getpid, makedirs, path
+from queue import Empty, Full, LifoQueue
 from sqlite3 import connect, Row, IntegrityError
+from threading import Lock
 from bcrypt import checkpw, hashpw, gensalt
 
 
 DB_FILE = "/data/peers.db"
 
+# Long-lived connections kept per worker process
+POOL_SIZE = 4
 
-def _ensure_dir():
-    makedirs(path.dirname(DB_FILE), exist_ok=True)
+# Entries of the peer change log kept for gateway agents to resume from
+CHANGELOG_SIZE = 100_000
 
+# Applied once to every new connection
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -8000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
 
-def db_conn():
-    _ensure_dir()
-    conn = connect(DB_FILE)
-    conn.row_factory = Row
-    return conn
+
+class ConnectionPool:
+    """
+    Pool of long-lived SQLite connections in WAL mode. Connections are
+    reused across calls (and threads), so each keeps its statement cache
+    warm. A pool belongs to the process that created it.
+    """
+
+    def __init__(self, db_file, size=POOL_SIZE):
+        self.db_file = db_file
+        self.pid = getpid()
+        self._idle = LifoQueue(maxsize=size)
+        makedirs(path.dirname(db_file), exist_ok=True)
+
+    def _open(self):
+        conn = connect(
+            self.db_file,
+            check_same_thread=False,
+            cached_statements=256,
+            isolation_level=None,
+        )
+        conn.row_factory = Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            return self._open()
+
+    def release(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                return
+
+
+_pool = None
+_pool_lock = Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != getpid() or _pool.db_file != DB_FILE:
+            _pool = ConnectionPool(DB_FILE)
+        return _pool
+
+
+@contextmanager
+def db_conn(immediate=False):
+    """
+    Borrows a pooled connection for one transaction: commits on success,
+    rolls back on error, and returns the connection to the pool.
+    `immediate` takes the write lock up front, serializing read-modify-write
+    transactions across workers.
+    """
+    pool = _get_pool()
+    conn = pool.acquire()
+    try:
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        pool.release(conn)
+
+
+def close_db():
+    """Closes every pooled connection of this process."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+# Columns whose updates bump the peers table version (not last_active_at)
+VERSIONED_COLUMNS = (
+    "private_key",
+    "ipv4_address",
+    "ipv6_address",
+    "created_at",
+    "expires_at",
+    "ip_pool",
+    "ip_slot",
+    "label",
+    "quota_bytes",
+    "disabled_reason",
+    "interface",
+)
 
 
 def init_db():
-    conn = db_conn()
-    c = conn.cursor()
-    c.execute("""
-      CREATE TABLE IF NOT EXISTS peers (
-        public_key TEXT PRIMARY KEY,
-        private_key TEXT,
-        ipv4_address TEXT,
-        ipv6_address TEXT,
-        created_at TEXT DEFAULT (datetime('now')),
-        expires_at TEXT
-      )
-    """)
-    c.execute("""
-      CREATE TABLE IF NOT EXISTS users (
-        username TEXT PRIMARY KEY,
-        password_hash BLOB NOT NULL,
-        created_at TEXT DEFAULT (datetime('now'))
-      )
-    """)
-    conn.commit()
-    c.close()
-    conn.close()
-
-
-def add_peer_db(pub, priv, ipv4, ipv6, expires):
     with db_conn() as conn:
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS peers (
+            public_key TEXT PRIMARY KEY,
+            private_key TEXT,
+            ipv4_address TEXT,
+            ipv6_address TEXT,
+            created_at TEXT DEFAULT (datetime('now')),
+            expires_at TEXT
+          )
+        """)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_xinfo(peers)")}
+        if "ip_pool" not in columns:
+            conn.execute("ALTER TABLE peers ADD COLUMN ip_pool TEXT")
+            conn.execute("ALTER TABLE peers ADD COLUMN ip_slot INTEGER")
+        if "label" not in columns:
+            conn.execute("ALTER TABLE peers ADD COLUMN label TEXT")
+        if "quota_bytes" not in columns:
+            # NULL means unlimited / active; see record_traffic_db
+            conn.execute("ALTER TABLE peers ADD COLUMN quota_bytes INTEGER")
+            conn.execute("ALTER TABLE peers ADD COLUMN disabled_reason TEXT")
+        if "last_active_at" not in columns:
+            # Epoch of the last handshake seen, or of creation before one
+            conn.execute("ALTER TABLE peers ADD COLUMN last_active_at INTEGER")
+            conn.execute("""
+              UPDATE peers
+                 SET last_active_at = CAST(strftime('%s', created_at) AS INTEGER)
+            """)
+        if "interface" not in columns:
+            # WireGuard interface the peer lives on, see interfaces.py
+            conn.execute(
+                "ALTER TABLE peers ADD COLUMN interface TEXT NOT NULL DEFAULT 'wg0'"
+            )
+        if "address_key" not in columns:
+            # Sortable by pool then slot, so address order can be seeked
+            conn.execute("""
+              ALTER TABLE peers ADD COLUMN address_key TEXT GENERATED ALWAYS AS
+                (IFNULL(ip_pool, '') || printf('%010d', IFNULL(ip_slot, -1))) VIRTUAL
+            """)
+        # Keyset pagination indexes, one per sort order of list_peers_db
+        conn.execute("DROP INDEX IF EXISTS idx_peers_expires_at")
+        conn.execute("""
+          CREATE INDEX IF NOT EXISTS idx_peers_expires_key
+            ON peers (expires_at, public_key)
+        """)
+        conn.execute("""
+          CREATE INDEX IF NOT EXISTS idx_peers_created_key
+            ON peers (created_at, public_key)
+        """)
+        conn.execute("""
+          CREATE INDEX IF NOT EXISTS idx_peers_address_key
+            ON peers (address_key, public_key)
+        """)
+        conn.execute("""
+          CREATE INDEX IF NOT EXISTS idx_peers_last_active
+            ON peers (last_active_at)
+        """)
+        conn.execute("""
+          CREATE INDEX IF NOT EXISTS idx_peers_interface
+            ON peers (interface)
+        """)
+        # Bumped on every change to peers, so readers can tell cheaply
+        # whether anything changed since they last looked
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+          ) WITHOUT ROWID
+        """)
+        conn.execute("INSERT OR IGNORE INTO table_versions VALUES ('peers', 0)")
         conn.execute(
+            "INSERT OR IGNORE INTO table_versions VALUES ('peer_activity', 0)"
+        )
+        for event in ("INSERT", "DELETE"):
+            conn.execute(f"""
+              CREATE TRIGGER IF NOT EXISTS peers_version_{event.lower()}
+                AFTER {event} ON peers
+              BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = 'peers';
+              END
+            """)
+        # Activity tracking rewrites last_active_at every flush; leaving it
+        # out keeps list ETags stable while peers are merely in use. Such
+        # writes bump 'peer_activity' instead, once per flush (see
+        # touch_peers_db), for the listings that show last_active_at
+        conn.execute("DROP TRIGGER IF EXISTS peers_version_update")
+        conn.execute(f"""
+          CREATE TRIGGER IF NOT EXISTS peers_version_edit
+            AFTER UPDATE OF {", ".join(VERSIONED_COLUMNS)} ON peers
+          BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'peers';
+          END
+        """)
+        # Change log of what gateway agents mirror (see replication.py): one
+        # entry per change to a peer's addresses, interface or status
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS peer_changes (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            public_key TEXT NOT NULL
+          )
+        """)
+        # Identifies this log, so agents notice when it was started over
+        conn.execute("CREATE TABLE IF NOT EXISTS changelog (id TEXT NOT NULL)")
+        conn.execute("""
+          INSERT INTO changelog (id)
+          SELECT lower(hex(randomblob(8)))
+           WHERE NOT EXISTS (SELECT 1 FROM changelog)
+        """)
+        for event, row in (("INSERT", "NEW"), ("DELETE", "OLD")):
+            conn.execute(f"""
+              CREATE TRIGGER IF NOT EXISTS peers_changes_{event.lower()}
+                AFTER {event} ON peers
+              BEGIN
+                INSERT INTO peer_changes (public_key) VALUES ({row}.public_key);
+              END
+            """)
+        conn.execute("""
+          CREATE TRIGGER IF NOT EXISTS peers_changes_update
+            AFTER UPDATE OF ipv4_address, ipv6_address, interface, disabled_reason
+            ON peers
+            WHEN OLD.ipv4_address IS NOT NEW.ipv4_address
+              OR OLD.ipv6_address IS NOT NEW.ipv6_address
+              OR OLD.interface IS NOT NEW.interface
+              OR OLD.disabled_reason IS NOT NEW.disabled_reason
+          BEGIN
+            INSERT INTO peer_changes (public_key) VALUES (NEW.public_key);
+          END
+        """)
+        conn.execute(f"""
+          CREATE TRIGGER IF NOT EXISTS peer_changes_prune
+            AFTER INSERT ON peer_changes
+            WHEN NEW.version % 1000 = 0
+          BEGIN
+            DELETE FROM peer_changes WHERE version <= NEW.version - {CHANGELOG_SIZE};
+          END
+        """)
+        conn.execute("""
+          CREATE UNIQUE INDEX IF NOT EXISTS idx_peers_ip_slot
+            ON peers (ip_pool, ip_slot)
+        """)
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS ip_pools (
+            pool TEXT PRIMARY KEY,
+            next_slot INTEGER NOT NULL
+          )
+        """)
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS ip_free (
+            pool TEXT NOT NULL,
+            slot INTEGER NOT NULL,
+            PRIMARY KEY (pool, slot)
+          ) WITHOUT ROWID
+        """)
+        # Traffic accounting: the last counters seen and lifetime totals per
+        # peer, plus per-day totals that outlive the peer for billing
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS traffic_counters (
+            public_key TEXT PRIMARY KEY,
+            rx_last INTEGER NOT NULL,
+            tx_last INTEGER NOT NULL,
+            rx_total INTEGER NOT NULL DEFAULT 0,
+            tx_total INTEGER NOT NULL DEFAULT 0
+          ) WITHOUT ROWID
+        """)
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS traffic_daily (
+            public_key TEXT NOT NULL,
+            day TEXT NOT NULL,
+            rx_bytes INTEGER NOT NULL,
+            tx_bytes INTEGER NOT NULL,
+            PRIMARY KEY (day, public_key)
+          ) WITHOUT ROWID
+        """)
+        conn.execute("""
+          CREATE INDEX IF NOT EXISTS idx_traffic_daily_key
+            ON traffic_daily (public_key, day)
+        """)
+        conn.execute("""
+          CREATE TRIGGER IF NOT EXISTS peers_traffic_counters_delete
+            AFTER DELETE ON peers
+          BEGIN
+            DELETE FROM traffic_counters WHERE public_key = OLD.public_key;
+          END
+        """)
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password_hash BLOB NOT NULL,
+            created_at TEXT DEFAULT (datetime('now'))
+          )
+        """)
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS revoked_tokens (
+            token_hash TEXT PRIMARY KEY,
+            expires_at REAL NOT NULL
+          )
+        """)
+        # Failed logins per throttle ("user" or "ip") and key, shared by
+        # every worker so the limits do not scale with WG_WORKERS
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS login_failures (
+            throttle TEXT NOT NULL,
+            key TEXT NOT NULL,
+            failed_at REAL NOT NULL
+          )
+        """)
+        conn.execute("""
+          CREATE INDEX IF NOT EXISTS idx_login_failures
+            ON login_failures (throttle, key, failed_at)
+        """)
+
+
+def _allocate_slots(conn, pool, count):
+    """
+    Takes up to `count` slots of `pool`: the lowest released ones first,
+    then never-used ones. `pool` provides `name` and `capacity`.
+    Returns the slots taken, fewer than `count` if the pool fills up.
+    """
+    slots = [
+        row["slot"]
+        for row in conn.execute(
+            """
+          DELETE FROM ip_free
+           WHERE pool = ?
+             AND slot IN (SELECT slot FROM ip_free
+                           WHERE pool = ? AND slot < ?
+                           ORDER BY slot LIMIT ?)
+          RETURNING slot
+        """,
+            (pool.name, pool.name, pool.capacity, count),
+        )
+    ]
+    missing = count - len(slots)
+    if missing:
+        row = conn.execute(
+            "SELECT next_slot FROM ip_pools WHERE pool = ?", (pool.name,)
+        ).fetchone()
+        start = row["next_slot"] if row else 0
+        end = min(start + missing, pool.capacity)
+        if end > start:
+            conn.execute(
+                """
+              INSERT INTO ip_pools (pool, next_slot) VALUES (?, ?)
+              ON CONFLICT (pool) DO UPDATE SET next_slot = excluded.next_slot
+            """,
+                (pool.name, end),
+            )
+            slots.extend(range(start, end))
+    return sorted(slots)
+
+
+def _release_slots(conn, rows):
+    conn.executemany(
+        "INSERT OR IGNORE INTO ip_free (pool, slot) VALUES (?, ?)",
+        [
+            (row["ip_pool"], row["ip_slot"])
+            for row in rows
+            if row["ip_pool"] is not None and row["ip_slot"] is not None
+        ],
+    )
+
+
+def add_placed_peers_db(groups):
+    """
+    Allocates address slots for every (pub, priv, expires, label) of each
+    (interface, peers, pools) in `groups`, filling the group's `pools` in
+    order, and inserts them all in one transaction. Each pool provides
+    `name`, `capacity` and `addresses(slot)`. Nothing is inserted unless
+    every peer fits. Returns the (ipv4, ipv6) addresses assigned, one
+    list per group.
+    """
+    with db_conn(immediate=True) as conn:
+        rows = []
+        assigned = []
+        for interface, peers, pools in groups:
+            slots = []
+            for pool in pools:
+                missing = len(peers) - len(slots)
+                if not missing:
+                    break
+                slots.extend(
+                    (pool, slot) for slot in _allocate_slots(conn, pool, missing)
+                )
+            if len(slots) < len(peers):
+                raise RuntimeError(
+                    f"No free addresses left in the address pools of {interface}"
+                )
+            addresses = []
+            for (pub, priv, expires, label), (pool, slot) in zip(peers, slots):
+                ipv4, ipv6 = pool.addresses(slot)
+                rows.append(
+                    (pub, priv, ipv4, ipv6, expires, label, pool.name, slot, interface)
+                )
+                addresses.append((ipv4, ipv6))
+            assigned.append(addresses)
+        conn.executemany(
             """
           INSERT INTO peers
-            (public_key, private_key, ipv4_address, ipv6_address, expires_at)
-          VALUES (?, ?, ?, ?, ?)
+            (public_key, private_key, ipv4_address, ipv6_address, expires_at,
+             label, ip_pool, ip_slot, interface, last_active_at)
+          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?,
+                  CAST(strftime('%s', 'now') AS INTEGER))
         """,
-            (pub, priv, ipv4, ipv6, expires),
+            rows,
         )
+    return assigned
+
+
+def add_peers_db(peers, pools, interface="wg0"):
+    """
+    Allocates address slots for every (pub, priv, expires, label) in
+    `peers` from `pools` and inserts them on `interface` in one
+    transaction. Returns the (ipv4, ipv6) addresses assigned, in order.
+    """
+    return add_placed_peers_db([(interface, peers, pools)])[0]
+
+
+def add_peer_db(pub, priv, expires, pools):
+    """
+    Allocates an address slot from the first of `pools` with room and
+    inserts the peer, in one transaction.
+    Returns the (ipv4, ipv6) addresses assigned.
+    """
+    return add_peers_db([(pub, priv, expires, None)], pools)[0]
 
 
 def remove_peer_db(pub):
-    with db_conn() as conn:
+    with db_conn(immediate=True) as conn:
         # Trailing comma is necessary since pub isn't typechecked
-        cur = conn.execute("DELETE FROM peers WHERE public_key = ?", (pub,))
-        return cur.rowcount > 0
+        rows = conn.execute(
+            "DELETE FROM peers WHERE public_key = ? RETURNING ip_pool, ip_slot", (pub,)
+        ).fetchall()
+        _release_slots(conn, rows)
+        return len(rows) > 0
+
+
+def remove_peers_db(pubs):
+    """
+    Deletes peers in one transaction; returns the (public_key, interface)
+    pairs removed.
+    """
+    with db_conn(immediate=True) as conn:
+        rows = []
+        for pub in pubs:
+            rows += conn.execute(
+                """
+              DELETE FROM peers WHERE public_key = ?
+              RETURNING public_key, interface, ip_pool, ip_slot
+            """,
+                (pub,),
+            ).fetchall()
+        _release_slots(conn, rows)
+        return [(row["public_key"], row["interface"]) for row in rows]
+
+
+def _rebuild_free_list(conn, pool):
+    used = {
+        row["ip_slot"]
+        for row in conn.execute(
+            "SELECT ip_slot FROM peers WHERE ip_pool = ?", (pool.name,)
+        )
+    }
+    conn.execute(
+        """
+      INSERT INTO ip_pools (pool, next_slot) VALUES (?, ?)
+      ON CONFLICT (pool) DO UPDATE SET next_slot = MAX(next_slot, excluded.next_slot)
+    """,
+        (pool.name, max(used) + 1 if used else 0),
+    )
+    next_slot = conn.execute(
+        "SELECT next_slot FROM ip_pools WHERE pool = ?", (pool.name,)
+    ).fetchone()["next_slot"]
+    conn.execute("DELETE FROM ip_free WHERE pool = ?", (pool.name,))
+    conn.executemany(
+        "INSERT INTO ip_free (pool, slot) VALUES (?, ?)",
+        ((pool.name, slot) for slot in range(next_slot) if slot not in used),
+    )
+
+
+def backfill_ip_slots_db(pools, locate):
+    """
+    Assigns slots to peers that have none, or whose pool is no longer
+    configured, and rebuilds the free lists of `pools` when anything moved.
+    `locate(ipv4)` returns the (pool name, slot) of an address, or None if
+    it lies outside every pool.
+    Returns the number of peers that were (re)assigned.
+    """
+    names = [pool.name for pool in pools]
+    marks = ", ".join("?" * len(names))
+    with db_conn(immediate=True) as conn:
+        stale = conn.execute(
+            f"""
+          SELECT public_key, ipv4_address FROM peers
+           WHERE ip_pool IS NULL OR ip_pool NOT IN ({marks})
+        """,
+            names,
+        ).fetchall()
+        known = {
+            row["pool"]
+            for row in conn.execute(
+                f"SELECT pool FROM ip_pools WHERE pool IN ({marks})", names
+            )
+        }
+        moved = 0
+        for row in stale:
+            location = locate(row["ipv4_address"])
+            if location is not None:
+                conn.execute(
+                    "UPDATE peers SET ip_pool = ?, ip_slot = ? WHERE public_key = ?",
+                    (*location, row["public_key"]),
+                )
+                moved += 1
+        # Drop bookkeeping of pools that are no longer configured
+        conn.execute(f"DELETE FROM ip_pools WHERE pool NOT IN ({marks})", names)
+        conn.execute(f"DELETE FROM ip_free WHERE pool NOT IN ({marks})", names)
+        for pool in pools:
+            if moved or pool.name not in known:
+                _rebuild_free_list(conn, pool)
+        return moved
+
+
+def assign_interfaces_db(interface_of, default):
+    """
+    Moves every peer to the interface owning its pool, per `interface_of`
+    ({pool name: interface}); peers outside every pool, or on an interface
+    that is no longer configured, go to `default`.
+    Returns the number of peers that moved.
+    """
+    interfaces = sorted(set(interface_of.values()) | {default})
+    marks = ", ".join("?" * len(interfaces))
+    with db_conn(immediate=True) as conn:
+        moved = 0
+        for pool, interface in interface_of.items():
+            moved += conn.execute(
+                "UPDATE peers SET interface = ? WHERE ip_pool = ? AND interface != ?",
+                (interface, pool, interface),
+            ).rowcount
+        moved += conn.execute(
+            f"UPDATE peers SET interface = ? WHERE interface NOT IN ({marks})",
+            (default, *interfaces),
+        ).rowcount
+        return moved
+
+
+def remove_expired_peers_db(now):
+    """
+    Deletes every peer whose `expires_at` is at or before `now` (a UTC
+    "%Y-%m-%d %H:%M:%S" string) in one transaction.
+    Returns the (public_key, interface) pairs that were removed.
+    """
+    with db_conn(immediate=True) as conn:
+        rows = conn.execute(
+            """
+          DELETE FROM peers WHERE expires_at <= ?
+          RETURNING public_key, interface, ip_pool, ip_slot
+        """,
+            (now,),
+        ).fetchall()
+        _release_slots(conn, rows)
+        return [(row["public_key"], row["interface"]) for row in rows]
+
+
+def get_peer_expiries(before):
+    """
+    Returns (public_key, expires_at epoch seconds) for every peer expiring
+    at or before `before` (a UTC "%Y-%m-%d %H:%M:%S" string).
+    """
+    with db_conn() as conn:
+        cur = conn.execute(
+            """
+          SELECT public_key,
+                 CAST(strftime('%s', expires_at) AS INTEGER) AS expires_ts
+            FROM peers
+           WHERE expires_at <= ?
+        """,
+            (before,),
+        )
+        return [(row["public_key"], row["expires_ts"]) for row in cur.fetchall()]
+
+
+# Columns list_peers_db may project
+PEER_FIELDS = (
+    "public_key",
+    "private_key",
+    "ipv4_address",
+    "ipv6_address",
+    "created_at",
+    "expires_at",
+    "label",
+    "quota_bytes",
+    "disabled_reason",
+    "last_active_at",
+    "interface",
+)
+
+# Sort orders of list_peers_db; public_key breaks ties
+PEER_SORT_KEYS = {
+    "expires_at": ("expires_at",),
+    "created_at": ("created_at",),
+    "address": ("address_key",),
+}
+
+
+def _peers_version(conn, activity=False):
+    version = conn.execute(
+        "SELECT version FROM table_versions WHERE name = 'peers'"
+    ).fetchone()["version"]
+    if not activity:
+        return version
+    touched = conn.execute(
+        "SELECT version FROM table_versions WHERE name = 'peer_activity'"
+    ).fetchone()["version"]
+    return f"{version}.{touched}"
+
+
+def count_peers_by_interface_db():
+    """Returns {interface: stored peers}."""
+    with db_conn() as conn:
+        cur = conn.execute("SELECT interface, COUNT(*) FROM peers GROUP BY interface")
+        return {row[0]: row[1] for row in cur}
+
+
+def count_peers_db():
+    with db_conn() as conn:
+        return conn.execute("SELECT COUNT(*) FROM peers").fetchone()[0]
+
+
+def get_peers_version(activity=False):
+    """
+    Returns a counter that changes whenever the peers table does, apart
+    from last_active_at; with `activity`, a version covering it as well.
+    """
+    with db_conn() as conn:
+        return _peers_version(conn, activity)
+
+
+def list_peers_db(
+    fields,
+    sort="created_at",
+    descending=False,
+    limit=100,
+    after=None,
+    expires_before=None,
+    expires_after=None,
+    created_before=None,
+    created_after=None,
+    search=None,
+    interface=None,
+):
+    """
+    Returns one page of peers as (rows, next_after, version). Rows hold
+    `fields` (a subset of PEER_FIELDS). `after` is the `next_after` of the
+    previous page, None for the first one; `next_after` is None on the
+    last page. Pages are seeked through the sort index, never offset.
+    `version` covers activity when `fields` include last_active_at.
+    """
+    keys = [*PEER_SORT_KEYS[sort], "public_key"]
+    where = []
+    params = []
+    for column, op, value in (
+        ("expires_at", "<", expires_before),
+        ("expires_at", ">=", expires_after),
+        ("created_at", "<", created_before),
+        ("created_at", ">=", created_after),
+        ("interface", "=", interface),
+    ):
+        if value is not None:
+            where.append(f"{column} {op} ?")
+            params.append(value)
+    if search:
+        where.append(
+            "(instr(public_key, ?) OR instr(ipv4_address, ?)"
+            " OR instr(ipv6_address, ?) OR instr(IFNULL(label, ''), ?))"
+        )
+        params.extend([search] * 4)
+    if after is not None:
+        where.append(
+            f"({', '.join(keys)}) {'<' if descending else '>'}"
+            f" ({', '.join('?' * len(keys))})"
+        )
+        params.extend(after)
+    direction = "DESC" if descending else "ASC"
+    sql = f"""
+      SELECT {', '.join(fields)},
+             {', '.join(f'{key} AS _k{i}' for i, key in enumerate(keys))}
+        FROM peers
+       {'WHERE ' + ' AND '.join(where) if where else ''}
+       ORDER BY {', '.join(f'{key} {direction}' for key in keys)}
+       LIMIT ?
+    """
+    with db_conn() as conn:
+        version = _peers_version(conn, "last_active_at" in fields)
+        rows = conn.execute(sql, (*params, limit + 1)).fetchall()
+    next_after = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_after = [rows[-1][f"_k{i}"] for i in range(len(keys))]
+    return [{f: row[f] for f in fields} for row in rows], next_after, version
+
+
+def get_peer_db(pub):
+    """Returns one peer as a dict of PEER_FIELDS, or None if it is unknown."""
+    with db_conn() as conn:
+        row = conn.execute(
+            f"SELECT {', '.join(PEER_FIELDS)} FROM peers WHERE public_key = ?",
+            (pub,),
+        ).fetchone()
+    return dict(row) if row else None
 
 
 def get_all_peers():
@@ -69,13 +747,332 @@ def get_all_peers():
                  ipv4_address,
                  ipv6_address,
                  created_at,
-                 expires_at
+                 expires_at,
+                 label,
+                 disabled_reason,
+                 interface
             FROM peers
         """)
         rows = cur.fetchall()
     return [dict(row) for row in rows]
 
 
+def set_peers_disabled_db(pubs, reason, only_reason=None):
+    """
+    Marks active peers among `pubs` disabled for `reason`, or with `reason`
+    None makes disabled ones active again (with `only_reason`, only those
+    disabled for that reason). Returns the peers that changed as
+    (public_key, ipv4, ipv6, interface) tuples.
+    """
+    if reason is not None:
+        where, extra = "disabled_reason IS NULL", ()
+    elif only_reason is not None:
+        where, extra = "disabled_reason = ?", (only_reason,)
+    else:
+        where, extra = "disabled_reason IS NOT NULL", ()
+    with db_conn(immediate=True) as conn:
+        changed = []
+        for pub in pubs:
+            changed += conn.execute(
+                f"""
+              UPDATE peers SET disabled_reason = ?
+               WHERE public_key = ? AND {where}
+              RETURNING public_key, ipv4_address, ipv6_address, interface
+            """,
+                (reason, pub, *extra),
+            ).fetchall()
+    return [tuple(row) for row in changed]
+
+
+def touch_peers_db(seen):
+    """
+    Records activity from (epoch seconds, public_key) pairs, keeping the
+    latest time per peer, in one transaction.
+    """
+    with db_conn(immediate=True) as conn:
+        cur = conn.executemany(
+            """
+          UPDATE peers SET last_active_at = ?1
+           WHERE public_key = ?2 AND IFNULL(last_active_at, 0) < ?1
+        """,
+            seen,
+        )
+        if cur.rowcount > 0:
+            conn.execute("""
+              UPDATE table_versions SET version = version + 1
+               WHERE name = 'peer_activity'
+            """)
+
+
+def get_idle_peers_db(before, active_only=False, limit=None):
+    """
+    Returns peers last active before `before` (epoch seconds), longest
+    idle first, optionally only those not disabled.
+    """
+    with db_conn() as conn:
+        cur = conn.execute(
+            f"""
+          SELECT public_key, label, ipv4_address, ipv6_address, last_active_at,
+                 disabled_reason
+            FROM peers
+           WHERE last_active_at < ?
+             {'AND disabled_reason IS NULL' if active_only else ''}
+           ORDER BY last_active_at
+           LIMIT ?
+        """,
+            (before, -1 if limit is None else limit),
+        )
+        return [dict(row) for row in cur]
+
+
+# Fields gateway agents mirror
+REPLICA_FIELDS = (
+    "public_key",
+    "ipv4_address",
+    "ipv6_address",
+    "interface",
+    "disabled_reason",
+)
+
+
+def _changelog(conn):
+    log = conn.execute("SELECT id FROM changelog").fetchone()[0]
+    oldest, latest = conn.execute(
+        "SELECT MIN(version), MAX(version) FROM peer_changes"
+    ).fetchone()
+    if latest is None:
+        # Empty log: continue from the last version ever handed out
+        row = conn.execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'peer_changes'"
+        ).fetchone()
+        latest = row[0] if row else 0
+    return log, oldest, latest
+
+
+def get_changelog_db():
+    """
+    Returns (log id, oldest version kept or None if none is, latest
+    version) of the peer change log.
+    """
+    with db_conn() as conn:
+        return _changelog(conn)
+
+
+def get_replica_snapshot_db():
+    """
+    Returns (log id, version, peers) read in one transaction: every peer
+    as a dict of REPLICA_FIELDS, as of change log `version`.
+    """
+    with db_conn() as conn:
+        log, _, latest = _changelog(conn)
+        cur = conn.execute(f"SELECT {', '.join(REPLICA_FIELDS)} FROM peers")
+        return log, latest, [dict(row) for row in cur]
+
+
+def get_peer_changes_db(since, limit):
+    """
+    Returns (version, peers) for up to `limit` change log entries after
+    `since`: the last version read and the current state of every peer
+    changed meanwhile, as a dict of REPLICA_FIELDS, or None for a peer
+    that is gone (keyed by public key).
+    """
+    columns = ", ".join(f"p.{field}" for field in REPLICA_FIELDS[1:])
+    with db_conn() as conn:
+        rows = conn.execute(
+            f"""
+          SELECT c.version, c.public_key, p.public_key IS NOT NULL AS present,
+                 {columns}
+            FROM peer_changes c LEFT JOIN peers p USING (public_key)
+           WHERE c.version > ?
+           ORDER BY c.version
+           LIMIT ?
+        """,
+            (since, limit),
+        ).fetchall()
+    if not rows:
+        return since, {}
+    changed = {
+        row["public_key"]: (
+            {field: row[field] for field in REPLICA_FIELDS} if row["present"] else None
+        )
+        for row in rows
+    }
+    return rows[-1]["version"], changed
+
+
+def init_replica_db():
+    """Creates the tables a gateway agent keeps its mirrored peers in."""
+    with db_conn() as conn:
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS replica_peers (
+            public_key TEXT PRIMARY KEY,
+            interface TEXT NOT NULL,
+            allowed_ips TEXT NOT NULL
+          ) WITHOUT ROWID
+        """)
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS replica_state (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            log TEXT NOT NULL,
+            version INTEGER NOT NULL
+          )
+        """)
+
+
+def get_replica_db():
+    """
+    Returns (log id, version, {public_key: (interface, allowed_ips)}) as
+    last applied by the gateway agent; log and version are None before
+    the first snapshot.
+    """
+    with db_conn() as conn:
+        state = conn.execute("SELECT log, version FROM replica_state").fetchone()
+        peers = {
+            row[0]: (row[1], row[2].split(","))
+            for row in conn.execute(
+                "SELECT public_key, interface, allowed_ips FROM replica_peers"
+            )
+        }
+    return (state[0], state[1], peers) if state else (None, None, peers)
+
+
+def save_replica_db(log, version, changed, removed):
+    """
+    Records what the gateway agent applied, in one transaction: `changed`
+    maps public keys to (interface, allowed_ips), `removed` lists public
+    keys.
+    """
+    with db_conn(immediate=True) as conn:
+        conn.executemany(
+            "DELETE FROM replica_peers WHERE public_key = ?",
+            [(pub,) for pub in removed],
+        )
+        conn.executemany(
+            """
+          INSERT INTO replica_peers (public_key, interface, allowed_ips)
+          VALUES (?, ?, ?)
+          ON CONFLICT (public_key) DO UPDATE SET
+            interface = excluded.interface,
+            allowed_ips = excluded.allowed_ips
+        """,
+            [
+                (pub, interface, ",".join(allowed))
+                for pub, (interface, allowed) in changed.items()
+            ],
+        )
+        conn.execute(
+            """
+          INSERT INTO replica_state (id, log, version) VALUES (0, ?, ?)
+          ON CONFLICT (id) DO UPDATE SET
+            log = excluded.log,
+            version = excluded.version
+        """,
+            (log, version),
+        )
+
+
+def get_traffic_baselines_db():
+    """Returns {public_key: (rx_last, tx_last)} as of the last flush."""
+    with db_conn() as conn:
+        cur = conn.execute("SELECT public_key, rx_last, tx_last FROM traffic_counters")
+        return {row[0]: (row[1], row[2]) for row in cur}
+
+
+def record_traffic_db(daily, counters):
+    """
+    Adds traffic in one transaction: `daily` holds (public_key, day,
+    rx_bytes, tx_bytes) increments, `counters` holds (public_key, rx_last,
+    tx_last, rx_increment, tx_increment). Counters of peers deleted
+    meanwhile are skipped. Returns the public keys of active peers whose
+    lifetime traffic reached their quota.
+    """
+    with db_conn(immediate=True) as conn:
+        conn.executemany(
+            """
+          INSERT INTO traffic_daily (public_key, day, rx_bytes, tx_bytes)
+          VALUES (?, ?, ?, ?)
+          ON CONFLICT (day, public_key) DO UPDATE SET
+            rx_bytes = rx_bytes + excluded.rx_bytes,
+            tx_bytes = tx_bytes + excluded.tx_bytes
+        """,
+            daily,
+        )
+        conn.executemany(
+            """
+          INSERT INTO traffic_counters
+            (public_key, rx_last, tx_last, rx_total, tx_total)
+          SELECT ?1, ?2, ?3, ?4, ?5
+           WHERE EXISTS (SELECT 1 FROM peers WHERE public_key = ?1)
+          ON CONFLICT (public_key) DO UPDATE SET
+            rx_last = excluded.rx_last,
+            tx_last = excluded.tx_last,
+            rx_total = rx_total + excluded.rx_total,
+            tx_total = tx_total + excluded.tx_total
+        """,
+            counters,
+        )
+        cur = conn.execute("""
+          SELECT p.public_key
+            FROM peers p JOIN traffic_counters t USING (public_key)
+           WHERE p.quota_bytes IS NOT NULL
+             AND p.disabled_reason IS NULL
+             AND t.rx_total + t.tx_total >= p.quota_bytes
+        """)
+        return [row[0] for row in cur]
+
+
+def set_quota_db(pub, quota_bytes):
+    """
+    Sets (or with None clears) the lifetime byte quota of a peer.
+    Returns the peer's lifetime traffic in bytes, or None if it is unknown.
+    """
+    with db_conn(immediate=True) as conn:
+        cur = conn.execute(
+            "UPDATE peers SET quota_bytes = ? WHERE public_key = ?", (quota_bytes, pub)
+        )
+        if not cur.rowcount:
+            return None
+        row = conn.execute(
+            "SELECT rx_total + tx_total FROM traffic_counters WHERE public_key = ?",
+            (pub,),
+        ).fetchone()
+    return row[0] if row else 0
+
+
+def get_traffic_db(period="day", since=None, until=None, public_key=None):
+    """
+    Returns traffic totals per peer and day (`period` "day", since/until
+    as "YYYY-MM-DD") or month ("month", "YYYY-MM"), oldest first, as dicts
+    of public_key, period, rx_bytes and tx_bytes. `until` is inclusive.
+    """
+    width = 10 if period == "day" else 7
+    where = []
+    params = []
+    if since is not None:
+        where.append("day >= ?")
+        params.append(since)
+    if until is not None:
+        # Inclusive of the whole day or month
+        where.append("substr(day, 1, ?) <= ?")
+        params.extend([width, until])
+    if public_key is not None:
+        where.append("public_key = ?")
+        params.append(public_key)
+    with db_conn() as conn:
+        cur = conn.execute(
+            f"""
+          SELECT public_key, substr(day, 1, {width}) AS period,
+                 SUM(rx_bytes) AS rx_bytes, SUM(tx_bytes) AS tx_bytes
+            FROM traffic_daily
+           {'WHERE ' + ' AND '.join(where) if where else ''}
+           GROUP BY period, public_key
+           ORDER BY period, public_key
+        """,
+            params,
+        )
+        return [dict(row) for row in cur]
+
+
 def add_user_db(username: str, password: str) -> bool:
     """
     Hashes `password` with bcrypt and inserts a new user.
@@ -98,22 +1095,28 @@ def add_or_update_user_db(username: str, password: str) -> None:
     """
     Inserts a new user or, if they already exist, updates their password_hash.
     """
-    pwd_hash = hashpw(password.encode("utf-8"), gensalt())
-    conn = db_conn()
-    try:
+    set_password_hash_db(username, hashpw(password.encode("utf-8"), gensalt()))
+
+
+def set_password_hash_db(username: str, pwd_hash: bytes) -> None:
+    """Inserts a user with an already computed hash, or replaces their hash."""
+    with db_conn() as conn:
         conn.execute(
-            "INSERT INTO users (username, password_hash) VALUES (?, ?)",
+            """
+          INSERT INTO users (username, password_hash) VALUES (?, ?)
+          ON CONFLICT (username) DO UPDATE SET password_hash = excluded.password_hash
+        """,
             (username, pwd_hash),
         )
-    except IntegrityError:
-        # user exists → update their password
-        conn.execute(
-            "UPDATE users SET password_hash = ? WHERE username = ?",
-            (pwd_hash, username),
-        )
-    finally:
-        conn.commit()
-        conn.close()
+
+
+def get_password_hash_db(username: str):
+    """Returns the stored bcrypt hash for `username`, or None."""
+    with db_conn() as conn:
+        row = conn.execute(
+            "SELECT password_hash FROM users WHERE username = ?", (username,)
+        ).fetchone()
+    return row["password_hash"] if row else None
 
 
 def verify_user_db(username: str, password: str) -> bool:
@@ -121,17 +1124,70 @@ def verify_user_db(username: str, password: str) -> bool:
     Fetches the stored hash for `username` and verifies `password`.
     Returns True if credentials match.
     """
-    row = (
-        db_conn()
-        .execute("SELECT password_hash FROM users WHERE username = ?", (username,))
-        .fetchone()
-    )
-    if not row:
+    stored_hash = get_password_hash_db(username)
+    if stored_hash is None:
         return False
-    stored_hash = row["password_hash"]
     return checkpw(password.encode("utf-8"), stored_hash)
 
 
+def revoke_token_db(token_hash: str, expires_at: float, now: float) -> None:
+    """Records a revoked token until it would have expired anyway."""
+    with db_conn() as conn:
+        conn.execute("DELETE FROM revoked_tokens WHERE expires_at <= ?", (now,))
+        conn.execute(
+            """
+          INSERT OR REPLACE INTO revoked_tokens (token_hash, expires_at)
+          VALUES (?, ?)
+        """,
+            (token_hash, expires_at),
+        )
+
+
+def get_revoked_tokens_db(now: float) -> list[str]:
+    """Returns hashes of revoked tokens that have not expired yet."""
+    with db_conn() as conn:
+        cur = conn.execute(
+            "SELECT token_hash FROM revoked_tokens WHERE expires_at > ?", (now,)
+        )
+        return [row["token_hash"] for row in cur.fetchall()]
+
+
+def record_login_failure_db(throttle: str, key: str, now: float, cutoff: float):
+    """Records a failed login of `key`, dropping failures older than `cutoff`."""
+    with db_conn() as conn:
+        conn.execute("DELETE FROM login_failures WHERE failed_at < ?", (cutoff,))
+        conn.execute(
+            "INSERT INTO login_failures (throttle, key, failed_at) VALUES (?, ?, ?)",
+            (throttle, key, now),
+        )
+
+
+def get_login_failure_db(throttle: str, key: str, since: float, skip: int):
+    """
+    Returns the time of the failed login of `key` after `since` that has
+    `skip` later ones, or None if there are not that many.
+    """
+    with db_conn() as conn:
+        row = conn.execute(
+            """
+          SELECT failed_at FROM login_failures
+           WHERE throttle = ? AND key = ? AND failed_at >= ?
+           ORDER BY failed_at DESC
+           LIMIT 1 OFFSET ?
+        """,
+            (throttle, key, since, skip),
+        ).fetchone()
+        return row["failed_at"] if row else None
+
+
+def clear_login_failures_db(throttle: str, key: str) -> None:
+    with db_conn() as conn:
+        conn.execute(
+            "DELETE FROM login_failures WHERE throttle = ? AND key = ?",
+            (throttle, key),
+        )
+
+
 def remove_user_db(username: str) -> bool:
     """Deletes a user; returns True if a row was removed."""
     with db_conn() as conn:
@@ -5,18 +5,18 @@ import { PeersComponent } from '../peers/peers.component';
 import { StatsComponent } from '../stats/stats.component';
 import { CommonModule } from '@angular/common';
 import { Router } from '@angular/router';
-import { QRCodeComponent } from 'angularx-qrcode';
 
 @Component({
   selector: 'app-dashboard',
   standalone: true,
-  imports: [CommonModule, PeersComponent, QRCodeComponent, StatsComponent],
+  imports: [CommonModule, PeersComponent, StatsComponent],
   templateUrl: './dashboard.component.html',
   styleUrls: ['./dashboard.component.css']
 })
 export class DashboardComponent implements OnInit {
   uptime   = 'Loading...';
   loadAvg  = 'Loading...';
+  peerCount = 0;
   isDarkMode = false;
   zoomedQr = signal<string|null>(null);
   @Output() peerAdded = new EventEmitter<void>();
@@ -67,15 +67,19 @@ export class DashboardComponent implements OnInit {
     this.api.getServerHealth().subscribe((info: ServerHealthcheck) => {
       this.uptime  = info.uptime;
       this.loadAvg = info.load;
+      this.peerCount = info.peers;
     });
   }
 
-  onQrClick(cfg: string) {
-    this.zoomedQr.set(cfg);
+  /** Show a QR code image by its object URL */
+  onQrClick(url: string) {
+    this.zoomedQr.set(url);
     document.body.classList.add('modal-open');
   }
 
   closeQr() {
+    const url = this.zoomedQr();
+    if (url) URL.revokeObjectURL(url);
     this.zoomedQr.set(null);
     document.body.classList.remove('modal-open');
   }
@@ -1,26 +1,24 @@
 import { Component, EventEmitter, OnInit, Output, signal } from '@angular/core';
 import { CommonModule } from '@angular/common';
-import { QRCodeComponent } from 'angularx-qrcode';
-import { ApiService, Peer, ServerConfig } from '../services/api.service';
+import { ApiService, Peer, PeerListQuery } from '../services/api.service';
+
+// Client configs and QR codes are rendered by the server, so the list
+// never needs private keys
+const PEER_QUERY: PeerListQuery = {
+  limit: 100,
+  sort: 'created_at',
+  fields: 'public_key,ipv4_address,ipv6_address,expires_at,interface'
+};
 
 @Component({
   selector: 'app-peers',
   standalone: true,
-  imports: [CommonModule, QRCodeComponent],
-  templateUrl: './peers.component.html',
-  styles: `.qrcode {
-  width: 80px; height: 80px; margin: auto;
-}`
+  imports: [CommonModule],
+  templateUrl: './peers.component.html'
 })
 export class PeersComponent implements OnInit {
   peers = signal<any[]>([]);
-  config: ServerConfig = {
-    public_key:  '',
-    endpoint:    '',
-    port:        '',
-    allowed_ips: '',
-    dns_server:  ''
-  };
+  nextCursor: string | null = null;
   @Output() qrClick = new EventEmitter<string>();
   @Output() peerChange = new EventEmitter<void>();
 
@@ -28,42 +26,41 @@ export class PeersComponent implements OnInit {
 
   ngOnInit() {
     this.loadPeers();
-    this.loadConfig();
   }
 
   loadPeers() {
-    this.api.listPeers().subscribe(list => this.peers.set(list));
+    this.api.listPeers(PEER_QUERY).subscribe(page => {
+      this.peers.set(page.items);
+      this.nextCursor = page.next_cursor;
+    });
   }
 
-  loadConfig() {
-    this.api.getServerConfig().subscribe((config: ServerConfig) => this.config = config);
+  loadMore() {
+    if (!this.nextCursor) return;
+    this.api.listPeers({ ...PEER_QUERY, cursor: this.nextCursor }).subscribe(page => {
+      this.peers.update(list => [...list, ...page.items]);
+      this.nextCursor = page.next_cursor;
+    });
   }
 
   trackByKey(_idx: number, peer: any) {
     return peer.public_key;
   }
 
-  makeCfg(p: Peer): string {
-    return [
-      `[Interface]`,
-      `PrivateKey = ${p.private_key}`,
-      `Address = ${p.ipv4_address}/32`,
-      `DNS = ${this.config.dns_server}`,
-      ``,
-      `[Peer]`,
-      `PublicKey = ${this.config.public_key}`,
-      `Endpoint = ${this.config.endpoint}:${this.config.port}`,
-      `AllowedIPs = ${this.config.allowed_ips}`,
-      `PersistentKeepalive = 25`
-    ].join('\n');
+  download(p: Peer) {
+    this.api.getPeerConfig(p.public_key).subscribe(blob => this.save(blob, `wg-peer-${p.ipv4_address}.conf`));
   }
 
-  download(p: Peer) {
-    const blob = new Blob([this.makeCfg(p)], { type: 'text/plain' });
+  exportAll() {
+    this.api.exportPeers('png').subscribe(blob => this.save(blob, 'wireguard-peers.zip'));
+  }
+
+  private save(blob: Blob, filename: string) {
     const a = document.createElement('a');
     a.href = URL.createObjectURL(blob);
-    a.download = `wg-peer-${p.ipv4_address}.conf`;
+    a.download = filename;
     a.click();
+    URL.revokeObjectURL(a.href);
   }
 
   remove(key: string) {
@@ -75,8 +72,9 @@ export class PeersComponent implements OnInit {
     });
   }
 
+  /** Fetch the server-rendered QR code; the dashboard shows and revokes the URL */
   openQr(peer: Peer) {
-    this.qrClick.emit(this.makeCfg(peer));
+    this.api.getPeerQr(peer.public_key).subscribe(blob => this.qrClick.emit(URL.createObjectURL(blob)));
   }
 
 }
@@ -1,13 +1,46 @@
 import { Injectable } from '@angular/core';
-import { HttpClient, HttpHeaders } from '@angular/common/http';
+import { HttpClient, HttpHeaders, HttpParams } from '@angular/common/http';
 import { Observable } from 'rxjs';
+import { AuthService } from './auth.service';
 
 export interface Peer {
-  private_key: string;
   public_key: string;
   ipv4_address: string;
   ipv6_address: string;
   expires_at?: string;
+  created_at?: string;
+  label?: string | null;
+  quota_bytes?: number | null;
+  disabled_reason?: string | null;
+  interface?: string;
+}
+
+export interface TrafficRow {
+  public_key: string;
+  period: string;
+  rx_bytes: number;
+  tx_bytes: number;
+}
+
+export interface PeerPage {
+  items: Peer[];
+  next_cursor: string | null;
+}
+
+export interface PeerListQuery {
+  limit?: number;
+  cursor?: string;
+  sort?: 'created_at' | 'expires_at' | 'address';
+  order?: 'asc' | 'desc';
+  fields?: string;
+  q?: string;
+  interface?: string;
+}
+
+export interface StatHistory {
+  t: number[];
+  rx: number[];
+  tx: number[];
 }
 
 export interface Stat {
@@ -15,17 +48,37 @@ export interface Stat {
   last_handshake_time: number;
   rx_bytes: number;
   tx_bytes: number;
+  history?: StatHistory;
 }
 
+/** Pushed by /api/peers/stats/stream: a full snapshot, then per-sample changes */
+export type StatsEvent =
+  | { type: 'snapshot'; peers: Stat[] }
+  | { type: 'delta'; t: number; interval: number; peers: Stat[]; removed: string[] };
+
 export interface ServerHealthcheck {
   uptime: string;
   load: string;
+  peers: number;
+}
+
+export interface InterfaceInfo {
+  name: string;
+  port: string;
+  pools: string[];
+  capacity: number;
+  peers: number;
+  live_peers: number;
+  connected: number;
+  rx_bytes: number;
+  tx_bytes: number;
 }
 
 export interface ServerConfig {
     public_key: string;
     endpoint: string;
     port: string;
+    ports?: Record<string, string>;
     allowed_ips: string;
     dns_server: string;
 }
@@ -34,7 +87,7 @@ export interface ServerConfig {
 export class ApiService {
   private jsonHeaders = { headers: new HttpHeaders({ 'Content-Type': 'application/json' }), withCredentials: true };
 
-  constructor(private http: HttpClient) {}
+  constructor(private http: HttpClient, private auth: AuthService) {}
 
   /** Create a new peer, returns the Peer object */
   createPeer(daysValid: number = 7): Observable<Peer> {
@@ -46,14 +99,105 @@ export class ApiService {
     return this.http.post<{ deleted: boolean }>('/api/peers/delete', { public_key: publicKey }, this.jsonHeaders);
   }
 
-  /** List all peers */
-  listPeers(): Observable<Peer[]> {
-    return this.http.get<Peer[]>('/api/peers/list', { withCredentials: true });
+  /** List one page of peers; pass the returned `next_cursor` back for the next */
+  listPeers(query: PeerListQuery = {}): Observable<PeerPage> {
+    let params = new HttpParams();
+    for (const [key, value] of Object.entries(query)) {
+      if (value !== undefined) params = params.set(key, value);
+    }
+    return this.http.get<PeerPage>('/api/peers/list', { params, withCredentials: true });
+  }
+
+  /** Every WireGuard interface with its port, pools, peers and traffic */
+  getInterfaces(): Observable<InterfaceInfo[]> {
+    return this.http.get<InterfaceInfo[]>('/api/interfaces', { withCredentials: true });
+  }
+
+  /** Accounted traffic per peer and day or month, e.g. since '2025-01' */
+  getTraffic(period: 'day' | 'month' = 'day', since?: string, publicKey?: string): Observable<TrafficRow[]> {
+    let params = new HttpParams().set('period', period);
+    if (since) params = params.set('since', since);
+    if (publicKey) params = params.set('public_key', publicKey);
+    return this.http.get<TrafficRow[]>('/api/traffic', { params, withCredentials: true });
+  }
+
+  /** Set (or clear with null) a peer's lifetime traffic quota in bytes */
+  setQuota(publicKey: string, quotaBytes: number | null): Observable<{ quota_bytes: number | null; used_bytes: number }> {
+    return this.http.post<{ quota_bytes: number | null; used_bytes: number }>(
+      '/api/peers/quota', { public_key: publicKey, quota_bytes: quotaBytes }, this.jsonHeaders);
+  }
+
+  /** Download the client .conf file of one peer, rendered by the server */
+  getPeerConfig(publicKey: string): Observable<Blob> {
+    return this.http.get(`/api/peers/${publicKey}/config`, { responseType: 'blob', withCredentials: true });
+  }
+
+  /** The client config of one peer as a QR code image, rendered by the server */
+  getPeerQr(publicKey: string, format: 'png' | 'svg' = 'svg'): Observable<Blob> {
+    const params = new HttpParams().set('format', format);
+    return this.http.get(`/api/peers/${publicKey}/qr`, { params, responseType: 'blob', withCredentials: true });
+  }
+
+  /** Download every peer's client config, plus a QR code each if `qr` is set, as a zip */
+  exportPeers(qr?: 'png' | 'svg'): Observable<Blob> {
+    let params = new HttpParams();
+    if (qr) params = params.set('qr', qr);
+    return this.http.get('/api/peers/export.zip', { params, responseType: 'blob', withCredentials: true });
+  }
+
+  /** Get live peer stats, with rx/tx history after `since` (unix seconds) if given */
+  getStats(since?: number, resolution?: number): Observable<Stat[]> {
+    let params = new HttpParams();
+    if (since !== undefined) params = params.set('since', since);
+    if (resolution !== undefined) params = params.set('resolution', resolution);
+    return this.http.get<Stat[]>('/api/peers/stats', { params, withCredentials: true });
   }
 
-  /** Get live peer stats */
-  getStats(): Observable<Stat[]> {
-    return this.http.get<Stat[]>('/api/peers/stats', { withCredentials: true });
+  /**
+   * Subscribe to live stats pushed over Server-Sent Events. Uses fetch rather
+   * than EventSource so the bearer token travels in a header, not the URL.
+   * Completes when the server closes the stream.
+   */
+  streamStats(): Observable<StatsEvent> {
+    return new Observable<StatsEvent>(observer => {
+      const controller = new AbortController();
+      const read = async () => {
+        const res = await fetch('/api/peers/stats/stream', {
+          headers: { Authorization: `Bearer ${this.auth.getToken()}` },
+          signal: controller.signal
+        });
+        if (!res.ok || !res.body) {
+          throw new Error(`Stats stream failed with status ${res.status}`);
+        }
+        const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = '';
+        for (;;) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += value;
+          const events = buffer.split('\n\n');
+          buffer = events.pop() ?? '';
+          for (const raw of events) {
+            let type = 'message';
+            let data = '';
+            for (const line of raw.split('\n')) {
+              if (line.startsWith('event: ')) type = line.slice(7);
+              else if (line.startsWith('data: ')) data += line.slice(6);
+            }
+            if (type === 'snapshot') {
+              observer.next({ type, peers: JSON.parse(data) });
+            } else if (type === 'delta') {
+              observer.next({ type, ...JSON.parse(data) });
+            }
+          }
+        }
+        observer.complete();
+      };
+      read().catch(err => {
+        if (!controller.signal.aborted) observer.error(err);
+      });
+      return () => controller.abort();
+    });
   }
 
   /** Fetch server config properties */
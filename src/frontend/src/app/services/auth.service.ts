@@ -30,6 +30,10 @@ export class AuthService {
   }
 
   logout(): void {
+    // Revoke server-side first; the interceptor reads the token on subscribe
+    if (this.getToken()) {
+      this.httpClient.post('/api/logout', {}).subscribe({ error: () => {} });
+    }
     localStorage.removeItem(this.TOKEN_KEY);
   }
 }
\ No newline at end of file
@@ -1,4 +1,4 @@
-import { Component, OnInit, ViewChildren, QueryList } from '@angular/core';
+import { Component, OnDestroy, OnInit, ViewChildren, QueryList } from '@angular/core';
 import { CommonModule } from '@angular/common';
 import {
   ChartComponent,
@@ -10,7 +10,15 @@ import {
   ApexStroke,
   ApexTooltip
 } from 'ng-apexcharts';
-import { ApiService, Stat } from '../services/api.service';
+import { Subscription } from 'rxjs';
+import { ApiService, Stat, StatsEvent } from '../services/api.service';
+
+// Points shown per chart, at the server's default 10 s sampling interval
+const HISTORY_POINTS = 20;
+const HISTORY_SECONDS = HISTORY_POINTS * 10;
+
+// Delay before reopening a dropped live stats stream
+const RECONNECT_MS = 5_000;
 
 @Component({
   selector: 'app-stats',
@@ -18,13 +26,20 @@ import { ApiService, Stat } from '../services/api.service';
   imports: [CommonModule, NgApexchartsModule],
   templateUrl: './stats.component.html'
 })
-export class StatsComponent implements OnInit {
+export class StatsComponent implements OnInit, OnDestroy {
   @ViewChildren('chart') charts!: QueryList<ChartComponent>;
 
   stats: Stat[] = [];
   timeLabels: string[] = [];
+  /** Sample times (unix seconds) the chart points are plotted at */
+  private times: number[] = [];
   clientHistories: Record<string, { rx: number[]; tx: number[] }> = {};
 
+  /** Latest raw stats by public key, as pushed by the server */
+  private live = new Map<string, Stat>();
+  private stream?: Subscription;
+  private reconnectTimer?: ReturnType<typeof setTimeout>;
+
   public chartConfig = {
     series: [
       { name: 'Received (MB)', data: [] },
@@ -56,56 +71,130 @@ export class StatsComponent implements OnInit {
 
   ngOnInit() {
     this.fetchAndUpdate();
-    setInterval(() => this.fetchAndUpdate(), 10_000);
+    this.connect();
+  }
+
+  ngOnDestroy() {
+    clearTimeout(this.reconnectTimer);
+    this.stream?.unsubscribe();
   }
 
   trackByKey(_: number, s: Stat): string {
     return s.public_key;
   }
 
+  /** Load recent history from the server's sampler, so it survives reloads */
   fetchAndUpdate(): void {
-    this.api.getStats().subscribe(raw => {
-      const now = Math.floor(Date.now() / 1000);
-      const updated = raw.map(s => ({
-        ...s,
-        last_handshake_time: now - Number(s.last_handshake_time)
-      }));
-
-      this.stats.splice(0, this.stats.length, ...updated);
-
-      const label = new Date().toLocaleTimeString();
-      this.timeLabels = [...this.timeLabels, label].slice(-20);
-
-      updated.forEach(s => {
-        const mbRx = +(s.rx_bytes / 1e6).toFixed(2);
-        const mbTx = +(s.tx_bytes / 1e6).toFixed(2);
-        const key  = s.public_key;
-        if (!this.clientHistories[key]) {
-          this.clientHistories[key] = { rx: [], tx: [] };
-        }
-        const hist = this.clientHistories[key];
-        hist.rx = [...hist.rx, mbTx].slice(-20);
-        hist.tx = [...hist.tx, mbRx].slice(-20);
-      });
+    const now = Math.floor(Date.now() / 1000);
+    this.api.getStats(now - HISTORY_SECONDS).subscribe(raw => {
+      this.live = new Map(raw.map(s => [s.public_key, s]));
+
+      const times = raw.find(s => s.history?.t.length)?.history?.t ?? [];
+      this.times = times.slice(-HISTORY_POINTS);
+      this.timeLabels = this.times.map(label);
 
-      this.charts.forEach((chartComp, idx) => {
-        const peer = this.stats[idx];
-        if (!peer) return;
-
-        const hist = this.clientHistories[peer.public_key];
-        chartComp.updateSeries(
-          [
-            { name: 'Received (MB)', data: hist.rx },
-            { name: 'Sent (MB)', data: hist.tx }
-          ],
-          false
-        );
-        chartComp.updateOptions(
-          { xaxis: { categories: this.timeLabels } },
-          false,
-          false
-        );
+      this.clientHistories = {};
+      raw.forEach(s => {
+        const hist = s.history ?? { t: [], rx: [], tx: [] };
+        this.clientHistories[s.public_key] = {
+          rx: hist.tx.slice(-HISTORY_POINTS).map(toMb),
+          tx: hist.rx.slice(-HISTORY_POINTS).map(toMb)
+        };
       });
+      this.render();
+    });
+  }
+
+  /** Follow live changes; the server only pushes when counters move */
+  private connect(): void {
+    this.stream = this.api.streamStats().subscribe({
+      next: event => this.apply(event),
+      error: () => this.reconnect(),
+      complete: () => this.reconnect()
+    });
+  }
+
+  private reconnect(): void {
+    clearTimeout(this.reconnectTimer);
+    this.reconnectTimer = setTimeout(() => {
+      this.fetchAndUpdate();
+      this.connect();
+    }, RECONNECT_MS);
+  }
+
+  private apply(event: StatsEvent): void {
+    if (event.type === 'snapshot') {
+      this.live = new Map(event.peers.map(s => [s.public_key, s]));
+      this.render();
+      return;
+    }
+
+    // Deltas only come for samples that changed something: the samples
+    // in between left every counter as it was, so plot them unchanged
+    const last = this.times[this.times.length - 1];
+    if (last !== undefined) {
+      const missed = Math.round((event.t - last) / event.interval) - 1;
+      for (let i = Math.max(0, missed - HISTORY_POINTS); i < missed; i++) {
+        this.addPoint(Math.round(last + (i + 1) * event.interval));
+      }
+    }
+
+    event.removed.forEach(key => {
+      this.live.delete(key);
+      delete this.clientHistories[key];
+    });
+    event.peers.forEach(s => this.live.set(s.public_key, s));
+
+    this.addPoint(event.t);
+    this.render();
+  }
+
+  /** Appends the current counters of every peer as the point for sample `t` */
+  private addPoint(t: number): void {
+    this.times = [...this.times, t].slice(-HISTORY_POINTS);
+    this.timeLabels = this.times.map(label);
+    this.live.forEach((s, key) => {
+      const hist = this.clientHistories[key] ?? { rx: [], tx: [] };
+      this.clientHistories[key] = {
+        rx: [...hist.rx, toMb(s.tx_bytes)].slice(-HISTORY_POINTS),
+        tx: [...hist.tx, toMb(s.rx_bytes)].slice(-HISTORY_POINTS)
+      };
     });
   }
-}
\ No newline at end of file
+
+  private render(): void {
+    const now = Math.floor(Date.now() / 1000);
+    const updated = [...this.live.values()].map(s => ({
+      ...s,
+      last_handshake_time: now - Number(s.last_handshake_time)
+    }));
+    this.stats.splice(0, this.stats.length, ...updated);
+
+    this.charts.forEach((chartComp, idx) => {
+      const peer = this.stats[idx];
+      if (!peer) return;
+
+      const hist = this.clientHistories[peer.public_key] ?? { rx: [], tx: [] };
+      chartComp.updateSeries(
+        [
+          { name: 'Received (MB)', data: hist.rx },
+          { name: 'Sent (MB)', data: hist.tx }
+        ],
+        false
+      );
+      chartComp.updateOptions(
+        { xaxis: { categories: this.timeLabels } },
+        false,
+        false
+      );
+    });
+  }
+}
+
+function label(t: number): string {
+  return new Date(t * 1000).toLocaleTimeString();
+}
+
+function toMb(bytes: number): number {
+  return +(bytes / 1e6).toFixed(2);
+}
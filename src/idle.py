@@ -0,0 +1,117 @@
+"""
+Idle peer detection and reclamation.
+
+The worker holding the "idle" leader lock watches the last handshake of
+every peer in the stats sampler's samples and periodically stores the
+newer ones as `last_active_at`, which is indexed. Every WG_IDLE_CHECK
+seconds peers idle for more than WG_IDLE_DAYS are handled according to
+WG_IDLE_POLICY: "report" only logs them, "suspend" takes them off the
+interface while keeping them stored (see peers.resume_peer), "delete"
+removes them for good and frees their addresses.
+"""
+
+import asyncio
+import logging
+from os import environ
+from time import time
+
+from aiodb import get_idle_peers_db, touch_peers_db
+from locks import LeaderLoop
+from peers import delete_peers, disable_peers
+from sampler import sampler
+
+# Days without a handshake after which a peer counts as idle; 0 turns the
+# policy off (idle peers can still be listed)
+IDLE_DAYS = float(environ.get("WG_IDLE_DAYS", "0"))
+
+# What to do with idle peers: report, suspend or delete
+IDLE_POLICY = environ.get("WG_IDLE_POLICY", "report").strip(" '\"").lower()
+
+# Seconds between idle checks
+CHECK_SECONDS = float(environ.get("WG_IDLE_CHECK", "3600"))
+
+# Seconds between writes of new handshake times
+FLUSH_SECONDS = 60
+
+POLICIES = ("report", "suspend", "delete")
+
+
+class IdleReaper:
+    """Persists handshake times and applies the idle policy."""
+
+    def __init__(self):
+        self._leader = LeaderLoop("idle", "Idle", "idle tracking", "tracking idle peers")
+        # Latest handshake seen per peer, and those not yet stored
+        self._seen = {}
+        self._pending = {}
+        # Whether a sample was seen, and stored, since taking over; until
+        # then stored activity may be stale and nothing is reclaimed
+        self._observed = False
+        self._synced = False
+        self._next_check = 0
+
+    def start(self):
+        """Starts tracking (or waiting to take it over) in the running loop."""
+        if IDLE_POLICY not in POLICIES:
+            raise RuntimeError(f"Unknown WG_IDLE_POLICY '{IDLE_POLICY}'")
+        sampler.add_listener(self.observe)
+        self._leader.start(self._step, acquired=self._acquired)
+
+    async def shutdown(self):
+        await self._leader.shutdown()
+
+    def observe(self, ts, samples):
+        if not self._leader.held:
+            return
+        for pub, _, _, handshake, _ in samples:
+            if handshake > self._seen.get(pub, 0):
+                self._seen[pub] = self._pending[pub] = handshake
+        present = {sample[0] for sample in samples}
+        for pub in self._seen.keys() - present:
+            del self._seen[pub]
+        self._observed = True
+
+    async def flush(self):
+        """Stores handshake times seen since the last flush."""
+        observed = self._observed
+        pending, self._pending = self._pending, {}
+        if pending:
+            try:
+                await touch_peers_db([(hs, pub) for pub, hs in pending.items()])
+            except BaseException:
+                for pub, handshake in pending.items():
+                    self._pending.setdefault(pub, handshake)
+                raise
+        self._synced = observed
+
+    async def reclaim(self):
+        """Applies the idle policy; returns the public keys it acted on."""
+        if IDLE_DAYS <= 0 or not self._synced:
+            return []
+        await self.flush()
+        idle = await get_idle_peers_db(time() - IDLE_DAYS * 86400, active_only=True)
+        if not idle:
+            return []
+        keys = [peer["public_key"] for peer in idle]
+        if IDLE_POLICY == "suspend":
+            keys = await disable_peers(keys, "idle")
+            logging.info(f"Idle: Suspended {len(keys)} idle peer(s).")
+        elif IDLE_POLICY == "delete":
+            keys = await delete_peers(keys)
+            logging.info(f"Idle: Deleted {len(keys)} idle peer(s).")
+        else:
+            logging.info(f"Idle: {len(keys)} peer(s) idle for over {IDLE_DAYS} days.")
+        return keys
+
+    def _acquired(self):
+        self._next_check = time() + FLUSH_SECONDS
+
+    async def _step(self):
+        await asyncio.sleep(FLUSH_SECONDS)
+        await self.flush()
+        if time() >= self._next_check:
+            self._next_check = time() + CHECK_SECONDS
+            await self.reclaim()
+
+
+reaper = IdleReaper()
@@ -0,0 +1,70 @@
+"""
+The WireGuard interfaces peers are spread over.
+
+WG_INTERFACES devices wg0, wg1, ... each listen on their own port (WG_PORT,
+WG_PORT + 1, ...), keep their own config file and own their own address
+pools: the configured pool pairs are dealt out in order, pool i going to
+interface i % WG_INTERFACES. Each peer lives on exactly one interface, so
+the data plane of a userspace implementation such as boringtun can use one
+core per interface. New peers are placed by WG_PLACEMENT: "least-loaded"
+picks the interface with the fewest peers, "hash" derives it from the
+public key, which keeps placement stable without any shared state.
+"""
+
+from base64 import b64decode
+from os import environ
+
+# Number of interfaces, named wg0..wg{N-1}
+INTERFACE_COUNT = int(environ.get("WG_INTERFACES", "1").strip(" '\""))
+
+INTERFACES = tuple(f"wg{i}" for i in range(INTERFACE_COUNT))
+
+# How new peers are spread over the interfaces: least-loaded or hash
+PLACEMENT = environ.get("WG_PLACEMENT", "least-loaded").strip(" '\"").lower()
+
+PLACEMENTS = ("least-loaded", "hash")
+
+if INTERFACE_COUNT < 1:
+    raise RuntimeError("WG_INTERFACES must be at least 1")
+if PLACEMENT not in PLACEMENTS:
+    raise RuntimeError(f"Unknown WG_PLACEMENT '{PLACEMENT}'")
+
+
+def interface_port(base_port, interface):
+    """Returns the listen port of `interface` given WG_PORT."""
+    return str(int(base_port) + INTERFACES.index(interface))
+
+
+def _hashed(public_key):
+    return int.from_bytes(b64decode(public_key)[:8], "big") % INTERFACE_COUNT
+
+
+def place_peers(public_keys, load, room):
+    """
+    Returns the interface of each new peer in `public_keys`. `load` maps
+    every interface to its peers, `room` to its free addresses; a full
+    interface is skipped. Raises RuntimeError if everything is full.
+    """
+    if INTERFACE_COUNT == 1:
+        # Allocation itself tells whether the pools are full
+        return [INTERFACES[0]] * len(public_keys)
+    load = dict(load)
+    room = dict(room)
+    placed = []
+    for pub in public_keys:
+        open_interfaces = [name for name in INTERFACES if room[name] > 0]
+        if not open_interfaces:
+            raise RuntimeError("No free addresses left in any address pool")
+        if PLACEMENT == "hash":
+            # Probe onwards from the hashed interface while it is full
+            start = _hashed(pub)
+            interface = min(
+                open_interfaces,
+                key=lambda name: (INTERFACES.index(name) - start) % INTERFACE_COUNT,
+            )
+        else:
+            interface = min(open_interfaces, key=lambda name: load[name])
+        load[interface] += 1
+        room[interface] -= 1
+        placed.append(interface)
+    return placed
@@ -0,0 +1,141 @@
+"""
+Peer address allocation.
+
+Address pools are configured as CIDRs (WG_IPV4_POOLS / WG_IPV6_POOLS,
+paired by position). Each peer owns an integer slot in one pool; the slot
+maps to one IPv4 and one IPv6 address with plain integer arithmetic, so a
+/16 holds ~65k peers at the same cost as a /24. Slots are handed out by
+db.add_peer_db from a persisted free list plus a high-water mark, inside the
+same transaction as the insert, so allocation never scans the peer table and
+concurrent creates cannot collide.
+
+Pools belong to interfaces (see interfaces.py): pool i is served by
+interface i % WG_INTERFACES, and a peer is only ever given an address
+from a pool of its own interface.
+"""
+
+import logging
+from bisect import bisect_right
+from ipaddress import IPv4Address, IPv6Address, ip_address, ip_network
+
+from aiodb import assign_interfaces_db, backfill_ip_slots_db
+from config import get_config
+from interfaces import INTERFACE_COUNT, INTERFACES
+
+# First host offsets handed to peers (.1 is the server, IPv6 starts at ::100)
+IPV4_FIRST_HOST = 2
+IPV6_FIRST_HOST = 0x100
+
+
+class AddressPool:
+    """Maps slots to the peer addresses of an IPv4 + IPv6 CIDR pair."""
+
+    def __init__(self, ipv4_cidr, ipv6_cidr):
+        self.ipv4_network = ip_network(ipv4_cidr, strict=False)
+        self.ipv6_network = ip_network(ipv6_cidr, strict=False)
+        if self.ipv4_network.version != 4 or self.ipv6_network.version != 6:
+            raise ValueError(f"Invalid address pool pair {ipv4_cidr}, {ipv6_cidr}")
+        self.name = f"{self.ipv4_network},{self.ipv6_network}"
+        self._ipv4_first = int(self.ipv4_network.network_address) + IPV4_FIRST_HOST
+        self._ipv6_first = int(self.ipv6_network.network_address) + IPV6_FIRST_HOST
+        # Last IPv4 host is the broadcast address
+        self.capacity = min(
+            self.ipv4_network.num_addresses - IPV4_FIRST_HOST - 1,
+            self.ipv6_network.num_addresses - IPV6_FIRST_HOST,
+        )
+        if self.capacity <= 0:
+            raise ValueError(f"Address pool {self.name} has no room for peers")
+
+    def addresses(self, slot):
+        """Returns the (ipv4, ipv6) strings of `slot`."""
+        return (
+            str(IPv4Address(self._ipv4_first + slot)),
+            str(IPv6Address(self._ipv6_first + slot)),
+        )
+
+    def slot_of(self, ipv4):
+        """Returns the slot of `ipv4`, or None if it is outside the pool."""
+        slot = int(ip_address(ipv4)) - self._ipv4_first
+        return slot if 0 <= slot < self.capacity else None
+
+
+class AddressPools:
+    """The configured pools, tried in order when allocating."""
+
+    def __init__(self, ipv4_cidrs, ipv6_cidrs):
+        if len(ipv4_cidrs) != len(ipv6_cidrs):
+            raise ValueError("WG_IPV4_POOLS and WG_IPV6_POOLS must pair up")
+        if len(ipv4_cidrs) < INTERFACE_COUNT:
+            raise ValueError(
+                f"WG_INTERFACES={INTERFACE_COUNT} needs at least as many address "
+                "pools, one per interface"
+            )
+        self.pools = [AddressPool(v4, v6) for v4, v6 in zip(ipv4_cidrs, ipv6_cidrs)]
+        # Pools of each interface, dealt out in order
+        self.by_interface = {
+            name: self.pools[i::INTERFACE_COUNT] for i, name in enumerate(INTERFACES)
+        }
+        for family in ("ipv6_network", "ipv4_network"):
+            ordered = sorted(
+                self.pools, key=lambda p: getattr(p, family).network_address
+            )
+            for a, b in zip(ordered, ordered[1:]):
+                if getattr(a, family).overlaps(getattr(b, family)):
+                    raise ValueError(f"Address pools {a.name} and {b.name} overlap")
+        self._starts = [int(p.ipv4_network.network_address) for p in ordered]
+        self._ordered = ordered
+
+    def __iter__(self):
+        return iter(self.pools)
+
+    @property
+    def capacity(self):
+        return sum(pool.capacity for pool in self.pools)
+
+    def interface_capacity(self, interface):
+        return sum(pool.capacity for pool in self.by_interface[interface])
+
+    def interface_of(self):
+        """Returns {pool name: interface} for every pool."""
+        return {
+            pool.name: name
+            for name, pools in self.by_interface.items()
+            for pool in pools
+        }
+
+    def locate(self, ipv4):
+        """Returns (pool name, slot) of `ipv4`, or None if no pool holds it."""
+        index = bisect_right(self._starts, int(ip_address(ipv4))) - 1
+        if index < 0:
+            return None
+        pool = self._ordered[index]
+        slot = pool.slot_of(ipv4)
+        return (pool.name, slot) if slot is not None else None
+
+
+_pools = None
+
+
+async def get_address_pools() -> AddressPools:
+    """Returns the address pools built from the loaded configuration."""
+    global _pools
+    if _pools is None:
+        config = await get_config()
+        _pools = AddressPools(config.wg_ipv4_pools, config.wg_ipv6_pools)
+    return _pools
+
+
+async def init_address_pools() -> None:
+    """Brings slot bookkeeping in line with the configured pools."""
+    pools = await get_address_pools()
+    moved = await backfill_ip_slots_db(pools.pools, pools.locate)
+    if moved:
+        logging.info(f"Assigned address slots to {moved} existing peer(s).")
+    moved = await assign_interfaces_db(pools.interface_of(), INTERFACES[0])
+    if moved:
+        logging.info(f"Moved {moved} peer(s) to the interface owning their pool.")
+    for name, owned in pools.by_interface.items():
+        logging.info(
+            f"Address pools of {name}: {', '.join(p.name for p in owned)} "
+            f"({pools.interface_capacity(name)} peer addresses)"
+        )
@@ -0,0 +1,89 @@
+"""
+In-process Curve25519 (X25519) key generation, compatible with `wg genkey`
+and `wg pubkey`, through the `cryptography` package. Keys are
+base64-encoded 32-byte strings.
+"""
+
+import asyncio
+import logging
+from base64 import b64decode, b64encode
+from collections import deque
+from os import environ, urandom
+
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+
+
+def _clamp(scalar: bytes) -> bytes:
+    k = bytearray(scalar)
+    k[0] &= 248
+    k[31] &= 127
+    k[31] |= 64
+    return bytes(k)
+
+
+def generate_private_key() -> str:
+    """Returns a new clamped private key, like `wg genkey`."""
+    return b64encode(_clamp(urandom(32))).decode()
+
+
+def public_key(private_key: str) -> str:
+    """Derives the public key from a private key, like `wg pubkey`."""
+    raw = b64decode(private_key.strip())
+    if len(raw) != 32:
+        raise ValueError("WireGuard keys must be 32 bytes")
+    pub = X25519PrivateKey.from_private_bytes(raw).public_key().public_bytes_raw()
+    return b64encode(pub).decode()
+
+
+def generate_keypairs(count: int) -> list[tuple[str, str]]:
+    """Returns `count` (private, public) keypairs."""
+    pairs = []
+    for _ in range(count):
+        priv = generate_private_key()
+        pairs.append((priv, public_key(priv)))
+    return pairs
+
+
+class KeyPool:
+    """
+    Pool of pre-generated keypairs, refilled in a worker thread whenever it
+    drops below half of its target size. A size of 0 disables pre-generation.
+    """
+
+    def __init__(self, size: int = 0):
+        self.size = size
+        self._pairs = deque()
+        self._refill_task = None
+
+    async def take(self, count: int = 1) -> list[tuple[str, str]]:
+        """Returns `count` keypairs, from the pool first and freshly generated after."""
+        pairs = []
+        while self._pairs and len(pairs) < count:
+            pairs.append(self._pairs.popleft())
+        missing = count - len(pairs)
+        if missing:
+            pairs.extend(await asyncio.to_thread(generate_keypairs, missing))
+        self._schedule_refill()
+        return pairs
+
+    def _schedule_refill(self):
+        if len(self._pairs) * 2 >= self.size:
+            return
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self):
+        try:
+            missing = self.size - len(self._pairs)
+            if missing > 0:
+                self._pairs.extend(await asyncio.to_thread(generate_keypairs, missing))
+        except Exception as e:
+            logging.error(f"Key pool refill failed: {e}")
+
+
+key_pool = KeyPool(int(environ.get("WG_KEY_POOL_SIZE", "32")))
+
+
+async def generate_keypair() -> tuple[str, str]:
+    """Returns a single (private, public) keypair from the shared pool."""
+    return (await key_pool.take(1))[0]
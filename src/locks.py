@@ -0,0 +1,201 @@
+"""
+Cross-process coordination between gunicorn workers on the same host.
+"""
+
+import asyncio
+import logging
+from fcntl import LOCK_EX, LOCK_NB, LOCK_UN, flock
+from mmap import mmap
+from os import O_CREAT, O_RDWR, close, fstat, ftruncate, makedirs, open as os_open, path
+from struct import Struct
+from time import time
+
+# Shared by every worker in the container, cleared on restart
+LOCK_DIR = "/run/wireguard-pro"
+
+# How often followers try to take over a LeaderLoop
+LEADER_RETRY_SECONDS = 10
+
+# Default back-off after a failed LeaderLoop step
+ERROR_BACKOFF_SECONDS = 5
+
+
+class LeaderLock:
+    """
+    Non-blocking exclusive flock on a named lock file. Exactly one process
+    holds it at a time; the kernel releases it when the holder exits.
+    """
+
+    def __init__(self, name):
+        self.path = path.join(LOCK_DIR, f"{name}.lock")
+        self._fd = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        """Returns True if this process is (now) the leader."""
+        if self._fd is not None:
+            return True
+        makedirs(LOCK_DIR, exist_ok=True)
+        fd = os_open(self.path, O_RDWR | O_CREAT, 0o600)
+        try:
+            flock(fd, LOCK_EX | LOCK_NB)
+        except BlockingIOError:
+            close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is not None:
+            flock(self._fd, LOCK_UN)
+            close(self._fd)
+            self._fd = None
+
+
+class LeaderLoop:
+    """
+    A background service that runs on one worker per host: the one that
+    holds the LeaderLock `name` calls `step` over and over, the others
+    call `follow` (if any) and try to take over every LEADER_RETRY_SECONDS.
+    A failing step is logged and retried after `backoff` seconds.
+    """
+
+    def __init__(self, name, prefix, role, activity, backoff=ERROR_BACKOFF_SECONDS):
+        self.lock = LeaderLock(name)
+        self.prefix = prefix
+        self.role = role
+        self.activity = activity
+        self.backoff = backoff
+        self._task = None
+
+    @property
+    def held(self) -> bool:
+        return self.lock.held
+
+    def start(self, step, follow=None, acquired=None):
+        """Starts the loop in the running event loop; `acquired` runs on takeover."""
+        self._task = asyncio.create_task(self._run(step, follow, acquired))
+
+    async def stop(self):
+        """Stops the loop but keeps the lock, so the caller can wrap up."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def shutdown(self):
+        await self.stop()
+        self.lock.release()
+
+    async def _run(self, step, follow, acquired):
+        next_claim = 0
+        while True:
+            try:
+                if not self.lock.held and time() >= next_claim:
+                    next_claim = time() + LEADER_RETRY_SECONDS
+                    if self.lock.try_acquire():
+                        logging.info(f"{self.prefix}: Acquired {self.role} leadership.")
+                        if acquired is not None:
+                            acquired()
+                if self.lock.held:
+                    await step()
+                elif follow is not None:
+                    await follow()
+                else:
+                    await asyncio.sleep(max(0, next_claim - time()))
+            except Exception as e:
+                logging.error(f"{self.prefix}: Error while {self.activity}: {e}")
+                await asyncio.sleep(self.backoff)
+
+
+def _lock_file(file_path):
+    makedirs(LOCK_DIR, exist_ok=True)
+    fd = os_open(file_path, O_RDWR | O_CREAT, 0o600)
+    try:
+        flock(fd, LOCK_EX)
+    except BaseException:
+        close(fd)
+        raise
+    return fd
+
+
+def _unlock_file(fd):
+    flock(fd, LOCK_UN)
+    close(fd)
+
+
+class WriteLock:
+    """
+    Blocking exclusive flock serializing one kind of mutation across every
+    worker on the host, used as `async with`. Waiters within a worker
+    queue on an asyncio.Lock, so at most one thread per worker blocks on
+    the file lock and the event loop never does.
+    """
+
+    def __init__(self, name):
+        self.path = path.join(LOCK_DIR, f"{name}.write.lock")
+        self._local = asyncio.Lock()
+        self._fd = None
+
+    async def __aenter__(self):
+        await self._local.acquire()
+        pending = asyncio.ensure_future(asyncio.to_thread(_lock_file, self.path))
+        try:
+            self._fd = await asyncio.shield(pending)
+        except asyncio.CancelledError:
+            # The thread may still get the lock; hand it straight back
+            pending.add_done_callback(
+                lambda f: f.cancelled() or f.exception() or _unlock_file(f.result())
+            )
+            self._local.release()
+            raise
+        except BaseException:
+            self._local.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        fd, self._fd = self._fd, None
+        _unlock_file(fd)
+        self._local.release()
+
+
+class SharedCounters:
+    """
+    Unsigned 64-bit counters in a memory-mapped file under LOCK_DIR, so
+    every worker reads the same values without a syscall. Updates must
+    be made while holding a WriteLock covering the counters.
+    """
+
+    def __init__(self, name, fields):
+        self.path = path.join(LOCK_DIR, f"{name}.counters")
+        self.fields = fields
+        self._struct = Struct(f"<{len(fields)}Q")
+        self._map = None
+
+    def _mapped(self):
+        if self._map is None:
+            makedirs(LOCK_DIR, exist_ok=True)
+            fd = os_open(self.path, O_RDWR | O_CREAT, 0o600)
+            try:
+                if fstat(fd).st_size < self._struct.size:
+                    ftruncate(fd, self._struct.size)
+                self._map = mmap(fd, self._struct.size)
+            finally:
+                close(fd)
+        return self._map
+
+    def read(self):
+        """Returns {field: value} as last written by any worker."""
+        return dict(zip(self.fields, self._struct.unpack_from(self._mapped())))
+
+    def write(self, **values):
+        current = self.read()
+        current.update(values)
+        self._struct.pack_into(self._mapped(), 0, *(current[f] for f in self.fields))
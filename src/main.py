@@ -1,49 +1,135 @@
+import asyncio
 import logging
 from aiofiles import open
 from contextlib import asynccontextmanager
+from time import perf_counter
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from config import get_config
-from db import init_db, add_or_update_user_db
+from aiodb import init_db, close_db
+from ipam import init_address_pools
+from locks import LeaderLock
+from passwords import ensure_user
+from peers import init_peer_state, reconcile_peers, remove_expired_peers
+import metrics
+from metrics import MetricsMiddleware
+from sampler import sampler
+from accounting import accountant
+from idle import reaper
 from scheduler import scheduler
 from auth import router as auth_router
-from api import router as api_router
+from api import router as api_router, metrics_router
 
 # --- Configuration & Logging ---
 logging.basicConfig(level=logging.INFO)
 
-# --- Lifespan Management (for startup/shutdown events) ---
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Startup
+async def _timed(phases, name, coro):
+    """Awaits `coro`, recording its wall time in `phases[name]`."""
+    start = perf_counter()
+    try:
+        return await coro
+    finally:
+        phases[name] = perf_counter() - start
+
+
+async def seed_admin_user():
+    """
+    Seed initial admin user from secrets. Runs in the background on one
+    worker per host, and only pays for a bcrypt hash when the secret
+    differs from the stored password.
+    """
+    lock = LeaderLock("seed")
+    if not lock.try_acquire():
+        return
     try:
-        init_db()
-        app.state.config = await get_config()
-        
-        # Seed initial admin user from secrets
         async with open('/run/secrets/admin-user') as f:
             user = (await f.read()).strip()
         async with open('/run/secrets/admin-pass') as f:
             pw = (await f.read()).strip()
-        add_or_update_user_db(user, pw)
-        logging.info(f"Seeded user `{user}`")
-
+        if await ensure_user(user, pw):
+            logging.info(f"Seeded user `{user}`")
+        else:
+            logging.info(f"User `{user}` is up to date")
     except FileNotFoundError:
         logging.warning("Admin secrets not found. Skipping user seeding.")
+    except Exception as e:
+        logging.error(f"Failed to seed admin user: {e}")
+    finally:
+        lock.release()
+
+
+async def reconcile_on_boot():
+    """
+    Restore stored peers to their interfaces and config files, which
+    bootstrap recreates without them. Runs in the background on one worker per host
+    so startup time does not grow with the number of peers.
+    """
+    lock = LeaderLock("reconcile")
+    if not lock.try_acquire():
+        return
+    try:
+        start = perf_counter()
+        restored, removed, expired = await reconcile_peers()
+        logging.info(
+            f"Reconciled peers in {(perf_counter() - start) * 1000:.0f} ms: "
+            f"{restored} restored, {removed} unknown removed, {expired} expired"
+        )
+    except Exception as e:
+        logging.error(f"Failed to reconcile peers with the interfaces: {e}")
+    finally:
+        lock.release()
+
+
+# --- Lifespan Management (for startup/shutdown events) ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup: independent steps run concurrently, each phase is timed
+    started = perf_counter()
+    phases = {}
+    try:
+        _, app.state.config = await asyncio.gather(
+            _timed(phases, "db", init_db()),
+            _timed(phases, "config", get_config()),
+        )
+        # Peers are counted per interface once they sit on the right one
+        await _timed(phases, "address pools", init_address_pools())
+        await _timed(phases, "peer state", init_peer_state())
     except Exception as e:
         logging.critical(f"FATAL: An error occurred during startup: {e}")
         # Ensure state is clean on failure to prevent routes from using stale/bad config
         app.state.config = None
 
-    scheduler.start()
+    background = [
+        asyncio.create_task(reconcile_on_boot()),
+        asyncio.create_task(seed_admin_user()),
+    ]
+    scheduler.start(remove_expired_peers)
+    sampler.start()
+    accountant.start()
+    reaper.start()
+    metrics.start()
+    logging.info(
+        f"Startup: ready in {(perf_counter() - started) * 1000:.0f} ms ("
+        + ", ".join(f"{name} {t * 1000:.0f} ms" for name, t in phases.items())
+        + ")"
+    )
     yield
     # Shutdown
-    scheduler.shutdown()
+    for task in background:
+        task.cancel()
+    await metrics.shutdown()
+    await reaper.shutdown()
+    await accountant.shutdown()
+    await sampler.shutdown()
+    await scheduler.shutdown()
+    await close_db()
 
 # --- FastAPI App ---
 app = FastAPI(lifespan=lifespan)
 
+app.add_middleware(MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:51819", "http://0.0.0.0:51819"], # Be more specific in production
@@ -55,3 +141,4 @@ app.add_middleware(
 # --- API Routers ---
 app.include_router(auth_router, prefix="/api", tags=["Authentication"])
 app.include_router(api_router, prefix="/api", tags=["API"])
+app.include_router(metrics_router, tags=["Metrics"])
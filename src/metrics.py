@@ -0,0 +1,232 @@
+"""
+Prometheus metrics for the API hot paths.
+
+Histograms are plain in-process counters updated from the event loop. Each
+worker periodically writes its counters to a file under LOCK_DIR so that
+whichever worker answers a scrape can report totals for the whole host.
+Per-peer traffic metrics come from the stats sampler (see api.py).
+"""
+
+import asyncio
+import json
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from os import getpid, kill, listdir, makedirs, path, replace, unlink
+from time import perf_counter
+
+from locks import LOCK_DIR
+
+METRICS_DIR = path.join(LOCK_DIR, "metrics")
+
+# How often each worker publishes its counters for the others
+FLUSH_SECONDS = 5
+
+# Upper bounds in seconds, from sub-millisecond DB hits to slow bcrypt
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """A labelled histogram; each series is [bucket counts..., +Inf, sum]."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.series = {}
+        registry.append(self)
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, *labels)
+
+    def render(self, series):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        bounds = [repr(b) for b in self.buckets] + ["+Inf"]
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, values):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            plain = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{plain} {values[-1]}")
+            lines.append(f"{self.name}_count{plain} {cumulative}")
+        return lines
+
+
+registry = []
+
+request_seconds = Histogram(
+    "wireguard_pro_http_request_duration_seconds",
+    "Time from request to response headers, by route handler.",
+    ("method", "handler", "status"),
+)
+command_seconds = Histogram(
+    "wireguard_pro_command_duration_seconds",
+    "Subprocess run time of run_command, by program and subcommand.",
+    ("command",),
+)
+db_seconds = Histogram(
+    "wireguard_pro_db_query_duration_seconds",
+    "Database call latency including executor wait, by operation.",
+    ("operation",),
+)
+bcrypt_seconds = Histogram(
+    "wireguard_pro_bcrypt_duration_seconds",
+    "bcrypt hash and check time including pool wait.",
+    ("operation",),
+)
+sweep_seconds = Histogram(
+    "wireguard_pro_expiry_sweep_duration_seconds",
+    "Duration of expired peer sweeps.",
+)
+
+
+def _snapshot():
+    return {
+        h.name: [[list(labels), values] for labels, values in h.series.items()]
+        for h in registry
+    }
+
+
+def _publish(data):
+    makedirs(METRICS_DIR, exist_ok=True)
+    target = path.join(METRICS_DIR, f"{getpid()}.json")
+    with open(f"{target}.tmp", "w") as f:
+        f.write(data)
+    replace(f"{target}.tmp", target)
+
+
+def _other_workers():
+    try:
+        names = listdir(METRICS_DIR)
+    except FileNotFoundError:
+        return
+    for name in names:
+        pid, ext = path.splitext(name)
+        if ext != ".json" or not pid.isdigit() or int(pid) == getpid():
+            continue
+        file_path = path.join(METRICS_DIR, name)
+        try:
+            kill(int(pid), 0)
+        except ProcessLookupError:
+            unlink(file_path)
+            continue
+        try:
+            with open(file_path) as f:
+                yield json.load(f)
+        except (OSError, ValueError):
+            continue
+
+
+def render_histograms():
+    """Returns exposition lines for every histogram summed over workers."""
+    merged = {h.name: {k: list(v) for k, v in h.series.items()} for h in registry}
+    for snapshot in _other_workers():
+        for name, entries in snapshot.items():
+            target = merged.get(name)
+            if target is None:
+                continue
+            for labels, values in entries:
+                current = target.get(tuple(labels))
+                if current is None or len(current) != len(values):
+                    target[tuple(labels)] = values
+                else:
+                    target[tuple(labels)] = [a + b for a, b in zip(current, values)]
+    lines = []
+    for h in registry:
+        lines += h.render(merged[h.name])
+    return lines
+
+
+async def _run_flusher():
+    while True:
+        try:
+            # Encoded on the loop, which is the only writer of the counters
+            await asyncio.to_thread(_publish, json.dumps(_snapshot()))
+        except Exception as e:
+            logging.error(f"Metrics: Failed to publish counters: {e}")
+        await asyncio.sleep(FLUSH_SECONDS)
+
+
+_flusher = None
+
+
+def start():
+    """Starts publishing this worker's counters every FLUSH_SECONDS."""
+    global _flusher
+    _flusher = asyncio.create_task(_run_flusher())
+
+
+async def shutdown():
+    global _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        try:
+            await _flusher
+        except asyncio.CancelledError:
+            pass
+        _flusher = None
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each HTTP request, labelled by route handler."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                endpoint = scope.get("endpoint")
+                request_seconds.observe(
+                    perf_counter() - start,
+                    scope["method"],
+                    getattr(endpoint, "__name__", "unmatched"),
+                    str(message["status"]),
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,72 @@
+"""
+bcrypt hashing and verification off the event loop.
+
+bcrypt releases the GIL, so a small thread pool runs hashes in parallel with
+request handling. A semaphore caps how many hashes may be queued or running
+at once; callers beyond that are turned away instead of piling up.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+
+from bcrypt import checkpw, gensalt, hashpw
+
+from aiodb import get_password_hash_db, set_password_hash_db
+from metrics import bcrypt_seconds
+
+# Threads running bcrypt concurrently
+HASH_WORKERS = int(environ.get("WG_HASH_WORKERS", "2"))
+
+# Hashes allowed in flight (running + queued) before new ones are rejected
+HASH_CONCURRENCY = int(environ.get("WG_HASH_CONCURRENCY", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+_slots = asyncio.Semaphore(HASH_CONCURRENCY)
+
+
+class HashingBusy(Exception):
+    """Raised when the bcrypt pool is saturated."""
+
+
+async def _run(operation, fn, *args):
+    if _slots.locked():
+        raise HashingBusy()
+    async with _slots:
+        loop = asyncio.get_running_loop()
+        with bcrypt_seconds.time(operation):
+            return await loop.run_in_executor(_executor, fn, *args)
+
+
+async def hash_password(password: str) -> bytes:
+    """Returns a fresh bcrypt hash of `password`."""
+    return await _run("hash", lambda: hashpw(password.encode("utf-8"), gensalt()))
+
+
+async def check_password(password: str, stored_hash: bytes) -> bool:
+    """Returns True if `password` matches `stored_hash`."""
+    return await _run("check", checkpw, password.encode("utf-8"), stored_hash)
+
+
+async def verify_user(username: str, password: str) -> bool:
+    """
+    Fetches the stored hash for `username` and verifies `password`.
+    Returns True if credentials match.
+    """
+    stored_hash = await get_password_hash_db(username)
+    if stored_hash is None:
+        return False
+    return await check_password(password, stored_hash)
+
+
+async def ensure_user(username: str, password: str) -> bool:
+    """
+    Makes `password` the password of `username`, creating the user if
+    needed. Costs one bcrypt check and no write when it already is;
+    returns True if the stored hash changed.
+    """
+    stored_hash = await get_password_hash_db(username)
+    if stored_hash is not None and await check_password(password, stored_hash):
+        return False
+    await set_password_hash_db(username, await hash_password(password))
+    return True
@@ -1,53 +1,218 @@
-from asyncio import gather
+"""
+Peer lifecycle: every mutation touches the database, the on-disk config
+and the live interface, so mutations are serialized host-wide through
+`peer_writes`. Reads go straight to the database and stay parallel.
+Each peer lives on one of the interfaces in interfaces.py; new peers are
+placed there by the configured policy.
+"""
+
+import asyncio
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone, timedelta
+from ipaddress import ip_network
 import logging
 
-from db import add_peer_db, remove_peer_db, get_all_peers
-from utils import (
-    generate_keypair,
-    next_available_ip,
-    append_peer_to_wgconf,
-    remake_peers_file,
-    run_command,
+from backend import get_backend
+from aiodb import (
+    add_placed_peers_db,
+    count_peers_by_interface_db,
+    get_all_peers,
+    get_peer_db,
+    list_peers_db,
+    remove_expired_peers_db,
+    remove_peers_db,
+    set_peers_disabled_db,
+    set_quota_db,
+    touch_peers_db,
 )
+from keys import key_pool
+from locks import SharedCounters, WriteLock
+from sampler import sampler
+from scheduler import scheduler
+from interfaces import INTERFACES, place_peers
+from ipam import get_address_pools
+from utils import peer_allowed_ips
+from wgconf import wg_configs
+
+# Held across the DB write, the config file update and the interface update
+peer_writes = WriteLock("peers")
+
+# Bumped by every committed mutation; readable by all workers without I/O
+peer_state = SharedCounters("peers", ("version", "count"))
 
-# Path to the on-disk WireGuard config file
-WG_PATH = "/etc/wireguard/wg0.conf"
+# Stored peers per interface, what least-loaded placement goes by
+interface_peers = SharedCounters("interfaces", INTERFACES)
 
+# Reconciles started after a failed interface update, kept referenced
+_repairs = set()
 
-async def create_peer(days_valid=7):
+
+def _committed(changes=None):
     """
-    Generate a new peer, store it in the DB, append to disk config,
-    and inject into the running WireGuard interface asynchronously.
+    Records a mutation in peer_state; `changes` maps interfaces to peers
+    added (or removed, if negative). Call while holding peer_writes.
+    """
+    changes = changes or {}
+    state = peer_state.read()
+    peer_state.write(
+        version=state["version"] + 1, count=state["count"] + sum(changes.values())
+    )
+    if changes:
+        counts = interface_peers.read()
+        interface_peers.write(
+            **{name: counts[name] + delta for name, delta in changes.items()}
+        )
+
+
+def _removals(removed):
+    """Returns {interface: -peers} for removed (public_key, interface) pairs."""
+    return {name: -n for name, n in Counter(i for _, i in removed).items()}
+
+
+def _recounted(counts):
+    """Stores {interface: peers} as counted from the database."""
+    state = peer_state.read()
+    peer_state.write(version=state["version"] + 1, count=sum(counts.values()))
+    interface_peers.write(**{name: counts.get(name, 0) for name in INTERFACES})
+
+
+async def _repair():
+    try:
+        restored, removed, _ = await reconcile_peers()
+        logging.info(f"Peers: Repaired {restored} restored, {removed} removed.")
+    except Exception as e:
+        logging.error(f"Peers: Repair failed, interfaces may lag the database: {e}")
+
+
+@asynccontextmanager
+async def _applying(changes=None):
+    """
+    Wraps the config and interface updates that follow a committed DB
+    write. The mutation is recorded in peer_state whatever happens; if an
+    update fails, the interfaces no longer match the database, so a
+    reconcile is started once peer_writes is free.
     """
-    # Generate keypair
-    priv, pub = await generate_keypair()
+    try:
+        yield
+    except Exception as e:
+        logging.error(f"Peers: Interface update failed after commit, reconciling: {e}")
+        task = asyncio.create_task(_repair())
+        _repairs.add(task)
+        task.add_done_callback(_repairs.discard)
+        raise
+    finally:
+        _committed(changes)
+
+
+async def init_peer_state():
+    """Recounts stored peers into peer_state, e.g. after a restart."""
+    async with peer_writes:
+        _recounted(await count_peers_by_interface_db())
 
-    # Allocate next free IPv4/IPv6
-    ipv4, ipv6 = await next_available_ip()
 
-    # Compute expiration timestamp
-    expires = datetime.now(timezone.utc) + timedelta(days=days_valid)
-    expires_str = expires.strftime("%Y-%m-%d %H:%M:%S")
+async def _unload(removed):
+    """Takes (public_key, interface) pairs off their interface and config."""
+    by_interface = defaultdict(list)
+    for pub, interface in removed:
+        by_interface[interface].append(pub)
+    for interface, keys in by_interface.items():
+        await get_backend().remove_peers(interface, keys)
+        await wg_configs[interface].remove_peers(keys)
 
-    # Persist in database
-    add_peer_db(pub, priv, ipv4, ipv6, expires_str)
 
-    # Append to the on-disk WireGuard config
-    await append_peer_to_wgconf(pub, ipv4, ipv6)
+async def _load(entries):
+    """Puts (public_key, allowed_ips, interface) onto their interface and config."""
+    by_interface = defaultdict(list)
+    for pub, allowed, interface in entries:
+        by_interface[interface].append((pub, allowed))
+    for interface, peers in by_interface.items():
+        await wg_configs[interface].add_peers(peers)
+        await get_backend().set_peers(interface, peers)
 
-    # Inject into the running interface without full reload
-    await run_command(f"wg set wg0 peer {pub} allowed-ips {ipv4}/32,{ipv6}/128")
+
+async def create_peers(specs):
+    """
+    Generate one peer per (label, days_valid) in `specs`, store them all
+    in one DB transaction, append them to the disk config in one write
+    and inject them into the running interface in one operation.
+    """
+    # Generate keypairs, from the pre-generated pool first
+    pairs = await key_pool.take(len(specs))
+
+    # Compute expiration timestamps
+    now = datetime.now(timezone.utc)
+    created_str = now.strftime("%Y-%m-%d %H:%M:%S")
+    expires = [now + timedelta(days=days_valid) for _, days_valid in specs]
+    expires_strs = [e.strftime("%Y-%m-%d %H:%M:%S") for e in expires]
+
+    rows = [
+        (pub, priv, expires_str, label)
+        for (priv, pub), expires_str, (label, _) in zip(pairs, expires_strs, specs)
+    ]
+    pools = await get_address_pools()
+
+    async with peer_writes:
+        # Spread the peers over the interfaces with room left
+        counts = interface_peers.read()
+        room = {n: pools.interface_capacity(n) - counts[n] for n in INTERFACES}
+        placed = place_peers([pub for _, pub in pairs], counts, room)
+        groups = defaultdict(list)
+        for i, interface in enumerate(placed):
+            groups[interface].append(i)
+
+        # Persist in database, allocating the next free IPv4/IPv6s of each
+        # peer's interface in one transaction
+        assigned = await add_placed_peers_db(
+            [
+                (interface, [rows[i] for i in indexes], pools.by_interface[interface])
+                for interface, indexes in groups.items()
+            ]
+        )
+        addresses = [None] * len(rows)
+        for indexes, group in zip(groups.values(), assigned):
+            for i, address in zip(indexes, group):
+                addresses[i] = address
+
+        async with _applying(Counter(placed)):
+            # Let the expiry engine fire exactly at `expires_at`
+            for (_, pub), expires_at in zip(pairs, expires):
+                scheduler.schedule(pub, int(expires_at.timestamp()))
+
+            # Append to the on-disk configs and inject into the running interfaces
+            await _load(
+                [
+                    (pub, peer_allowed_ips(ipv4, ipv6), interface)
+                    for (_, pub), (ipv4, ipv6), interface in zip(
+                        pairs, addresses, placed
+                    )
+                ]
+            )
 
     # Return details for frontend
-    return {
-        "private_key": priv,
-        "public_key": pub,
-        "ipv4_address": ipv4,
-        "ipv6_address": ipv6,
-        "expires_at": expires_str,
-        "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
-    }
+    return [
+        {
+            "private_key": priv,
+            "public_key": pub,
+            "ipv4_address": ipv4,
+            "ipv6_address": ipv6,
+            "expires_at": expires_str,
+            "created_at": created_str,
+            "label": label,
+            "interface": interface,
+        }
+        for (priv, pub), (ipv4, ipv6), expires_str, (label, _), interface in zip(
+            pairs, addresses, expires_strs, specs, placed
+        )
+    ]
+
+
+async def create_peer(days_valid=7, label=None):
+    """
+    Generate a new peer, store it in the DB, append to disk config,
+    and inject into the running WireGuard interface asynchronously.
+    """
+    return (await create_peers([(label, days_valid)]))[0]
 
 
 async def delete_peer(public_key):
@@ -55,68 +220,204 @@ async def delete_peer(public_key):
     Remove a peer by public key: delete from DB, remove stanza on disk,
     and remove from the running interface asynchronously.
     """
-    success = remove_peer_db(public_key)
-    if not success:
-        return False
+    return bool(await delete_peers([public_key]))
+
+
+async def delete_peers(public_keys):
+    """
+    Remove peers in one DB transaction, one interface update and one
+    config rewrite. Returns the public keys that were removed.
+    """
+    async with peer_writes:
+        removed = await remove_peers_db(public_keys)
+        if removed:
+            async with _applying(_removals(removed)):
+                await _unload(removed)
+    return [pub for pub, _ in removed]
+
+
+async def disable_peers(public_keys, reason):
+    """
+    Take active peers off the interface and the config file while keeping
+    them stored, recording `reason` ("quota", ...). Returns the public
+    keys that were disabled.
+    """
+    async with peer_writes:
+        rows = await set_peers_disabled_db(public_keys, reason)
+        if rows:
+            async with _applying():
+                await _unload([(pub, interface) for pub, _, _, interface in rows])
+    return [pub for pub, _, _, _ in rows]
+
+
+async def enable_peers(public_keys, reason=None):
+    """
+    Put disabled peers back on the interface and into the config file;
+    with `reason`, only those disabled for it. Returns the public keys
+    that were enabled.
+    """
+    async with peer_writes:
+        entries = [
+            (pub, peer_allowed_ips(ipv4, ipv6), interface)
+            for pub, ipv4, ipv6, interface in await set_peers_disabled_db(
+                public_keys, None, reason
+            )
+        ]
+        if entries:
+            async with _applying():
+                await _load(entries)
+    return [pub for pub, _, _ in entries]
+
+
+async def set_peer_quota(public_key, quota_bytes):
+    """
+    Set or clear (None) the lifetime byte quota of a peer, disabling it
+    right away if it is already over, or enabling it again if the quota
+    was what disabled it. Returns the bytes used so far, None if unknown.
+    """
+    used = await set_quota_db(public_key, quota_bytes)
+    if used is None:
+        return None
+    if quota_bytes is not None and used >= quota_bytes:
+        await disable_peers([public_key], "quota")
     else:
-        await remake_peers_file()
-        return True
+        await enable_peers([public_key], "quota")
+    return used
 
 
-def list_peers():
+async def resume_peer(public_key):
     """
-    Return all stored peers from the database.
+    Put a peer suspended for being idle back on the interface, counting
+    the resume as activity so it is not suspended again right away.
+    Returns True if the peer was suspended.
     """
-    return get_all_peers()
+    if not await enable_peers([public_key], "idle"):
+        return False
+    now = int(datetime.now(timezone.utc).timestamp())
+    await touch_peers_db([(now, public_key)])
+    return True
 
 
-async def peer_stats():
+async def list_peers(fields, **query):
     """
-    Return live WireGuard peer stats asynchronously.
+    Return one page of stored peers as (rows, next_after, version);
+    see db.list_peers_db for the query options.
     """
-    output = await run_command("wg show wg0 dump")
-    lines = output.strip().split("\n")[1:]  # Skip header line
-    stats = []
-    for line in lines:
-        fields = line.split("\t")
-        if len(fields) < 8:
-            continue
-        pub, _, _, _, last_hs, rx, tx, keepalive, *_ = fields
-        stats.append(
+    return await list_peers_db(fields, **query)
+
+
+async def get_peer(public_key):
+    """Return one stored peer with all PEER_FIELDS, or None."""
+    return await get_peer_db(public_key)
+
+
+async def iter_peer_pages(fields, page_size=500, **query):
+    """Yield every stored peer matching `query`, one page (list) at a time."""
+    after = None
+    while True:
+        rows, after, _ = await list_peers_db(
+            fields, limit=page_size, after=after, **query
+        )
+        if rows:
+            yield rows
+        if after is None:
+            return
+
+
+async def peer_stats(since=None, resolution=0):
+    """
+    Return peer stats of every interface from the background sampler.
+    With `since`, each entry also carries its rx/tx history after that
+    unix timestamp. Falls back to live interface reads until the first
+    sample lands.
+    """
+    if sampler.sampled_at is None:
+        backend = get_backend()
+        live = await asyncio.gather(*(backend.get_peers(i) for i in INTERFACES))
+        return [
             {
-                "public_key": pub,
-                "last_handshake_time": last_hs,
-                "rx_bytes": rx,
-                "tx_bytes": tx,
-                "persistent_keepalive": keepalive,
+                "public_key": p.public_key,
+                "last_handshake_time": p.last_handshake,
+                "rx_bytes": p.rx_bytes,
+                "tx_bytes": p.tx_bytes,
+                "persistent_keepalive": p.persistent_keepalive,
             }
-        )
+            for peers in live
+            for p in peers
+        ]
+    stats = sampler.current()
+    if since is not None:
+        history = await sampler.history(since, resolution)
+        empty = {"t": [], "rx": [], "tx": []}
+        for entry in stats:
+            entry["history"] = history.get(entry["public_key"], empty)
     return stats
 
 
 async def remove_expired_peers():
     """
-    Remove all peers whose `expires_at` is in the past.
+    Remove all peers whose `expires_at` is in the past, with one DB
+    transaction, one config rewrite and one interface update.
     Returns the number of peers that were removed.
     """
-    now = datetime.now(timezone.utc)
-    peers_to_remove = [
-        p
-        for p in get_all_peers()
-        if datetime.strptime(p["expires_at"], "%Y-%m-%d %H:%M:%S").replace(
-            tzinfo=timezone.utc
-        )
-        < now
-    ]
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    async with peer_writes:
+        expired = await remove_expired_peers_db(now)
+        if not expired:
+            return 0
+        async with _applying(_removals(expired)):
+            await _unload(expired)
 
-    if not peers_to_remove:
-        return 0
+    logging.info(f"Auto-expired and removed {len(expired)} peer(s).")
+    return len(expired)
+
+
+def _normalized(allowed_ips):
+    return {str(ip_network(cidr.strip(), strict=False)) for cidr in allowed_ips}
 
-    removed_count = sum(
-        await gather(*(delete_peer(p["public_key"]) for p in peers_to_remove))
-    )
 
-    if removed_count > 0:
-        logging.info(f"Auto-expired and removed {removed_count} peer(s).")
+def _same_allowed_ips(live, wanted):
+    # Backends usually report CIDRs exactly as we wrote them; parse otherwise
+    return set(live) == set(wanted) or _normalized(live) == _normalized(wanted)
+
+
+async def reconcile_peers():
+    """
+    Bring the config files and the live interfaces in line with the
+    database, e.g. after bootstrap rewrote the configs without peers or
+    peers moved to another interface. Drops expired peers first, then
+    diffs the stored peers of each interface against it and applies every
+    difference in one batched update per interface and direction.
+    Returns (added or updated, removed, expired) counts.
+    """
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    backend = get_backend()
+    async with peer_writes:
+        expired = await remove_expired_peers_db(now)
+        stored = await get_all_peers()
+        wanted = {name: {} for name in INTERFACES}
+        for p in stored:
+            if p["disabled_reason"] is None and p["interface"] in wanted:
+                wanted[p["interface"]][p["public_key"]] = peer_allowed_ips(
+                    p["ipv4_address"], p["ipv6_address"]
+                )
+        lives = await asyncio.gather(*(backend.get_peers(i) for i in INTERFACES))
+        restored = removed = 0
+        for (interface, peers), live_peers in zip(wanted.items(), lives):
+            live = {p.public_key: p.allowed_ips for p in live_peers}
+            stale = [
+                (pub, allowed)
+                for pub, allowed in peers.items()
+                if pub not in live or not _same_allowed_ips(live[pub], allowed)
+            ]
+            extra = [pub for pub in live if pub not in peers]
 
-    return removed_count
+            if extra:
+                await backend.remove_peers(interface, extra)
+            if stale:
+                await backend.set_peers(interface, stale)
+            await wg_configs[interface].replace_peers(peers.items())
+            restored += len(stale)
+            removed += len(extra)
+        _recounted(Counter(p["interface"] for p in stored))
+    return restored, removed, len(expired)
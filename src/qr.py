@@ -0,0 +1,393 @@
+"""
+Minimal QR code encoder (byte mode, any version) with SVG and PNG output.
+
+Enough of ISO/IEC 18004 to turn a client config into a scannable code
+without a third-party dependency: Reed-Solomon error correction,
+block interleaving, the eight data masks and penalty-based mask selection.
+"""
+
+import zlib
+from struct import pack
+
+# Error correction levels: (format bits, EC codewords per block by version,
+# EC blocks by version), indexed from version 1
+# fmt: off
+LEVELS = {
+    "L": (
+        1,
+        (
+            7, 10, 15, 20, 26, 18, 20, 24, 30, 18,
+            20, 24, 26, 30, 22, 24, 28, 30, 28, 28,
+            28, 28, 30, 30, 26, 28, 30, 30, 30, 30,
+            30, 30, 30, 30, 30, 30, 30, 30, 30, 30,
+        ),
+        (
+            1, 1, 1, 1, 1, 2, 2, 2, 2, 4,
+            4, 4, 4, 4, 6, 6, 6, 6, 7, 8,
+            8, 9, 9, 10, 12, 12, 12, 13, 14, 15,
+            16, 17, 18, 19, 19, 20, 21, 22, 24, 25,
+        ),
+    ),
+    "M": (
+        0,
+        (
+            10, 16, 26, 18, 24, 16, 18, 22, 22, 26,
+            30, 22, 22, 24, 24, 28, 28, 26, 26, 26,
+            26, 28, 28, 28, 28, 28, 28, 28, 28, 28,
+            28, 28, 28, 28, 28, 28, 28, 28, 28, 28,
+        ),
+        (
+            1, 1, 1, 2, 2, 4, 4, 4, 5, 5,
+            5, 8, 9, 9, 10, 10, 11, 13, 14, 16,
+            17, 17, 18, 20, 21, 23, 25, 26, 28, 29,
+            31, 33, 35, 37, 38, 40, 43, 45, 47, 49,
+        ),
+    ),
+    "Q": (
+        3,
+        (
+            13, 22, 18, 26, 18, 24, 18, 22, 20, 24,
+            28, 26, 24, 20, 30, 24, 28, 28, 26, 30,
+            28, 30, 30, 30, 30, 28, 30, 30, 30, 30,
+            30, 30, 30, 30, 30, 30, 30, 30, 30, 30,
+        ),
+        (
+            1, 1, 2, 2, 4, 4, 6, 6, 8, 8,
+            8, 10, 12, 16, 12, 17, 16, 18, 21, 20,
+            23, 23, 25, 27, 29, 34, 34, 35, 38, 40,
+            43, 45, 48, 51, 53, 56, 59, 62, 65, 68,
+        ),
+    ),
+    "H": (
+        2,
+        (
+            17, 28, 22, 16, 22, 28, 26, 26, 24, 28,
+            24, 28, 22, 24, 24, 30, 28, 28, 26, 28,
+            30, 24, 30, 30, 30, 30, 30, 30, 30, 30,
+            30, 30, 30, 30, 30, 30, 30, 30, 30, 30,
+        ),
+        (
+            1, 1, 2, 4, 4, 4, 5, 6, 8, 8,
+            11, 11, 16, 16, 18, 16, 19, 21, 25, 25,
+            25, 34, 30, 32, 35, 37, 40, 42, 45, 48,
+            51, 54, 57, 60, 63, 66, 70, 74, 77, 81,
+        ),
+    ),
+}
+# fmt: on
+
+MASKS = (
+    lambda x, y: (x + y) % 2 == 0,
+    lambda x, y: y % 2 == 0,
+    lambda x, y: x % 3 == 0,
+    lambda x, y: (x + y) % 3 == 0,
+    lambda x, y: (x // 3 + y // 2) % 2 == 0,
+    lambda x, y: x * y % 2 + x * y % 3 == 0,
+    lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+    lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+)
+
+# Light margin around the symbol, in modules
+QUIET_ZONE = 4
+
+
+def _gf_multiply(x, y):
+    z = 0
+    for i in reversed(range(8)):
+        z = (z << 1) ^ ((z >> 7) * 0x11D)
+        z ^= ((y >> i) & 1) * x
+    return z
+
+
+def _rs_divisor(degree):
+    result = [0] * (degree - 1) + [1]
+    root = 1
+    for _ in range(degree):
+        for j in range(degree):
+            result[j] = _gf_multiply(result[j], root)
+            if j + 1 < degree:
+                result[j] ^= result[j + 1]
+        root = _gf_multiply(root, 0x02)
+    return result
+
+
+def _rs_remainder(data, divisor):
+    result = [0] * len(divisor)
+    for b in data:
+        factor = b ^ result.pop(0)
+        result.append(0)
+        for i, coef in enumerate(divisor):
+            result[i] ^= _gf_multiply(coef, factor)
+    return result
+
+
+def _raw_data_modules(version):
+    result = (16 * version + 128) * version + 64
+    if version >= 2:
+        align = version // 7 + 2
+        result -= (25 * align - 10) * align - 55
+        if version >= 7:
+            result -= 36
+    return result
+
+
+def _data_codewords(version, level):
+    _, ecc, blocks = LEVELS[level]
+    return _raw_data_modules(version) // 8 - ecc[version - 1] * blocks[version - 1]
+
+
+def _alignment_positions(version, size):
+    if version == 1:
+        return []
+    align = version // 7 + 2
+    step = (version * 8 + align * 3 + 5) // (align * 4 - 4) * 2
+    return [6] + [size - 7 - i * step for i in reversed(range(align - 1))]
+
+
+def _encode_data(data, version, level):
+    count_bits = 8 if version <= 9 else 16
+    bits = [0, 1, 0, 0]
+    bits += [(len(data) >> i) & 1 for i in reversed(range(count_bits))]
+    for byte in data:
+        bits += [(byte >> i) & 1 for i in reversed(range(8))]
+    capacity = _data_codewords(version, level) * 8
+    bits += [0] * min(4, capacity - len(bits))
+    bits += [0] * (-len(bits) % 8)
+    codewords = [
+        int("".join(map(str, bits[i : i + 8])), 2) for i in range(0, len(bits), 8)
+    ]
+    pad = 0xEC
+    while len(codewords) < capacity // 8:
+        codewords.append(pad)
+        pad ^= 0xEC ^ 0x11
+    return codewords
+
+
+def _add_ecc(codewords, version, level):
+    _, ecc, blocks = LEVELS[level]
+    num_blocks = blocks[version - 1]
+    ecc_len = ecc[version - 1]
+    raw = _raw_data_modules(version) // 8
+    short_blocks = num_blocks - raw % num_blocks
+    short_len = raw // num_blocks
+    divisor = _rs_divisor(ecc_len)
+    chunks = []
+    k = 0
+    for i in range(num_blocks):
+        length = short_len - ecc_len + (0 if i < short_blocks else 1)
+        data = codewords[k : k + length]
+        k += length
+        block = data + ([0] if i < short_blocks else []) + _rs_remainder(data, divisor)
+        chunks.append(block)
+    result = []
+    for i in range(len(chunks[0])):
+        for j, block in enumerate(chunks):
+            if i != short_len - ecc_len or j >= short_blocks:
+                result.append(block[i])
+    return result
+
+
+class QrCode:
+    """A QR symbol: `size` x `size` rows of booleans, True for dark."""
+
+    def __init__(self, version, level, codewords, mask=None):
+        self.version = version
+        self.size = version * 4 + 17
+        self.level = level
+        self.modules = [[False] * self.size for _ in range(self.size)]
+        self._function = [[False] * self.size for _ in range(self.size)]
+        self._draw_function_patterns()
+        self._draw_codewords(codewords)
+        if mask is None:
+            mask = min(range(8), key=self._score_mask)
+        self._apply_mask(mask)
+        self._draw_format_bits(mask)
+        self.mask = mask
+
+    def _set(self, x, y, dark):
+        self.modules[y][x] = dark
+        self._function[y][x] = True
+
+    def _draw_function_patterns(self):
+        size = self.size
+        for i in range(size):
+            self._set(6, i, i % 2 == 0)
+            self._set(i, 6, i % 2 == 0)
+        for cx, cy in ((3, 3), (size - 4, 3), (3, size - 4)):
+            for dy in range(-4, 5):
+                for dx in range(-4, 5):
+                    x, y = cx + dx, cy + dy
+                    if 0 <= x < size and 0 <= y < size:
+                        self._set(x, y, max(abs(dx), abs(dy)) not in (2, 4))
+        positions = _alignment_positions(self.version, size)
+        last = len(positions) - 1
+        for i, cx in enumerate(positions):
+            for j, cy in enumerate(positions):
+                if (i, j) in ((0, 0), (0, last), (last, 0)):
+                    continue
+                for dy in range(-2, 3):
+                    for dx in range(-2, 3):
+                        self._set(cx + dx, cy + dy, max(abs(dx), abs(dy)) != 1)
+        # Reserve the format areas; real bits are drawn after masking
+        self._draw_format_bits(0)
+        if self.version >= 7:
+            rem = self.version
+            for _ in range(12):
+                rem = (rem << 1) ^ ((rem >> 11) * 0x1F25)
+            bits = self.version << 12 | rem
+            for i in range(18):
+                dark = (bits >> i) & 1 == 1
+                a, b = size - 11 + i % 3, i // 3
+                self._set(a, b, dark)
+                self._set(b, a, dark)
+
+    def _draw_format_bits(self, mask):
+        data = LEVELS[self.level][0] << 3 | mask
+        rem = data
+        for _ in range(10):
+            rem = (rem << 1) ^ ((rem >> 9) * 0x537)
+        bits = (data << 10 | rem) ^ 0x5412
+        size = self.size
+
+        def bit(i):
+            return (bits >> i) & 1 == 1
+
+        for i in range(6):
+            self._set(8, i, bit(i))
+        self._set(8, 7, bit(6))
+        self._set(8, 8, bit(7))
+        self._set(7, 8, bit(8))
+        for i in range(9, 15):
+            self._set(14 - i, 8, bit(i))
+        for i in range(8):
+            self._set(size - 1 - i, 8, bit(i))
+        for i in range(8, 15):
+            self._set(8, size - 15 + i, bit(i))
+        self._set(8, size - 8, True)
+
+    def _draw_codewords(self, codewords):
+        size = self.size
+        total = len(codewords) * 8
+        i = 0
+        right = size - 1
+        while right >= 1:
+            if right == 6:
+                right = 5
+            upward = (right + 1) & 2 == 0
+            for vert in range(size):
+                y = size - 1 - vert if upward else vert
+                for x in (right, right - 1):
+                    if not self._function[y][x] and i < total:
+                        bit = (codewords[i >> 3] >> (7 - (i & 7))) & 1
+                        self.modules[y][x] = bit == 1
+                        i += 1
+            right -= 2
+
+    def _apply_mask(self, mask):
+        test = MASKS[mask]
+        for y in range(self.size):
+            row = self.modules[y]
+            function = self._function[y]
+            for x in range(self.size):
+                if not function[x] and test(x, y):
+                    row[x] = not row[x]
+
+    def _score_mask(self, mask):
+        self._apply_mask(mask)
+        score = _penalty(self.modules)
+        self._apply_mask(mask)
+        return score
+
+    def svg(self):
+        """Returns the symbol as an SVG document, one unit per module."""
+        dim = self.size + 2 * QUIET_ZONE
+        path = "".join(
+            f"M{x + QUIET_ZONE},{y + QUIET_ZONE}h1v1h-1z"
+            for y, row in enumerate(self.modules)
+            for x, dark in enumerate(row)
+            if dark
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {dim} {dim}" '
+            'shape-rendering="crispEdges">'
+            f'<rect width="{dim}" height="{dim}" fill="#fff"/>'
+            f'<path d="{path}" fill="#000"/></svg>\n'
+        )
+
+    def png(self, scale=8):
+        """Returns the symbol as a 1-bit grayscale PNG, `scale` px per module."""
+        dim = (self.size + 2 * QUIET_ZONE) * scale
+        margin = [1] * QUIET_ZONE * scale
+        blank = b"\x00" + _pack_row([1] * dim)
+        rows = [blank] * (QUIET_ZONE * scale)
+        for row in self.modules:
+            pixels = margin[:]
+            for dark in row:
+                pixels += [0 if dark else 1] * scale
+            pixels += margin
+            rows += [b"\x00" + _pack_row(pixels)] * scale
+        rows += [blank] * (QUIET_ZONE * scale)
+
+        def chunk(kind, data):
+            body = kind + data
+            return pack(">I", len(data)) + body + pack(">I", zlib.crc32(body))
+
+        return (
+            b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", pack(">IIBBBBB", dim, dim, 1, 0, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(b"".join(rows), 9))
+            + chunk(b"IEND", b"")
+        )
+
+
+def _pack_row(pixels):
+    pixels = pixels + [0] * (-len(pixels) % 8)
+    return bytes(
+        int("".join(map(str, pixels[i : i + 8])), 2) for i in range(0, len(pixels), 8)
+    )
+
+
+def _penalty(modules):
+    size = len(modules)
+    score = 0
+    columns = [[modules[y][x] for y in range(size)] for x in range(size)]
+    finder = (True, False, True, True, True, False, True)
+    for line in modules + columns:
+        run = 1
+        for i in range(1, size + 1):
+            if i < size and line[i] == line[i - 1]:
+                run += 1
+                continue
+            if run >= 5:
+                score += run - 2
+            run = 1
+        padded = (False,) * 4 + tuple(line) + (False,) * 4
+        for i in range(len(padded) - 10):
+            if padded[i + 4 : i + 11] == finder and (
+                not any(padded[i : i + 4]) or not any(padded[i + 11 : i + 15])
+            ):
+                score += 40
+    for y in range(size - 1):
+        top, bottom = modules[y], modules[y + 1]
+        for x in range(size - 1):
+            if top[x] == top[x + 1] == bottom[x] == bottom[x + 1]:
+                score += 3
+    dark = sum(map(sum, modules))
+    total = size * size
+    score += ((abs(dark * 20 - total * 10) + total - 1) // total - 1) * 10
+    return score
+
+
+def encode(text, level="M", mask=None):
+    """Encodes `text` (UTF-8) in the smallest version that fits."""
+    data = text.encode("utf-8")
+    for version in range(1, 41):
+        count_bits = 8 if version <= 9 else 16
+        capacity = _data_codewords(version, level) * 8
+        if len(data) < 1 << count_bits and 4 + count_bits + len(data) * 8 <= capacity:
+            break
+    else:
+        raise ValueError("Data too long for a QR code")
+    codewords = _add_ecc(_encode_data(data, version, level), version, level)
+    return QrCode(version, level, codewords, mask)
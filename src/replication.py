@@ -0,0 +1,104 @@
+"""
+Peer change log served to gateway agents (see agent.py).
+
+Triggers append the public key of every peer whose addresses, interface or
+status change to `peer_changes`, whose autoincrement key is the log
+version. An agent opens GET /api/replication/stream with the log id and
+version it last applied: when the log still reaches back that far it only
+gets the changes since, otherwise a snapshot of every peer first. Changes
+are sent as the current state of each changed peer, so a batch can be
+applied in any order and applying one twice is harmless. New entries are
+noticed through the shared peer_state version, without polling the
+database.
+"""
+
+import asyncio
+import json
+from os import environ
+from time import monotonic
+
+from aiodb import get_changelog_db, get_peer_changes_db, get_replica_snapshot_db
+from peers import peer_state
+from utils import peer_allowed_ips
+
+# Bearer token agents must present; replication is disabled when unset
+REPLICATION_TOKEN = environ.get("WG_REPLICATION_TOKEN", "")
+
+# Seconds between checks of the shared peer_state version
+POLL_SECONDS = 0.05
+
+# Change log entries read per `changes` event
+BATCH_SIZE = 5000
+
+# Comment line sent on idle streams so proxies and agents keep them open
+KEEPALIVE_SECONDS = 15
+
+
+def replica_entry(peer):
+    """
+    What an agent applies for a peer: its interface and allowed IPs, or
+    only its public key if it must not be on any interface.
+    """
+    if peer["disabled_reason"] is not None:
+        return {"public_key": peer["public_key"]}
+    return {
+        "public_key": peer["public_key"],
+        "interface": peer["interface"],
+        "allowed_ips": peer_allowed_ips(peer["ipv4_address"], peer["ipv6_address"]),
+    }
+
+
+def _event(name, payload):
+    return f"event: {name}\ndata: {json.dumps(payload)}\n\n"
+
+
+async def change_events(since=None, log=None):
+    """
+    Yields a `snapshot` event unless the agent can resume from version
+    `since` of change log `log`, then a `changes` event per batch of new
+    log entries, forever.
+    """
+    log_id, oldest, latest = await get_changelog_db()
+    resumable = (
+        since is not None
+        and log == log_id
+        and since <= latest
+        and (oldest is None or since >= oldest - 1)
+    )
+    if not resumable:
+        log_id, since, peers = await get_replica_snapshot_db()
+        yield _event(
+            "snapshot",
+            {
+                "log": log_id,
+                "version": since,
+                "peers": [replica_entry(peer) for peer in peers],
+            },
+        )
+    seen = None
+    idle_since = monotonic()
+    while True:
+        state = peer_state.read()["version"]
+        if state == seen:
+            if monotonic() - idle_since >= KEEPALIVE_SECONDS:
+                idle_since = monotonic()
+                yield ": keepalive\n\n"
+            await asyncio.sleep(POLL_SECONDS)
+            continue
+        seen = state
+        while True:
+            version, changed = await get_peer_changes_db(since, BATCH_SIZE)
+            if not changed:
+                break
+            since = version
+            idle_since = monotonic()
+            yield _event(
+                "changes",
+                {
+                    "version": version,
+                    "peers": [
+                        replica_entry(peer) if peer else {"public_key": pub}
+                        for pub, peer in changed.items()
+                    ],
+                },
+            )
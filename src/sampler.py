@@ -0,0 +1,479 @@
+"""
+Background peer stats sampler.
+
+One worker per host (the holder of the "stats" leader lock) reads every
+interface every WG_STATS_INTERVAL seconds and publishes the sample to a
+small binary file under LOCK_DIR, which every worker picks up, so
+requests are answered from memory and any number of dashboards costs one
+interface read per interval. Stream subscribers get each sample's changes
+pushed as one shared delta.
+
+History is kept once per host, in two tiers of memory-mapped ring buffers
+the leader records into (see RingStore): every sample for the last
+WG_STATS_RETENTION seconds, and one point per WG_STATS_ROLLUP seconds (the
+last sample in that bucket) for WG_STATS_HISTORY seconds. Timestamps are
+shared per tier, counters are kept per peer, 16 bytes per peer and point:
+about 6 KB per peer with the defaults.
+
+A sample lists the peers of each interface in turn; its spans record how
+many belong to which interface, for per-interface stats.
+"""
+
+import asyncio
+import json
+from math import ceil
+from mmap import mmap
+from os import (
+    O_CREAT,
+    O_RDWR,
+    close,
+    environ,
+    fstat,
+    fsync,
+    ftruncate,
+    makedirs,
+    open as os_open,
+    path,
+    replace,
+    stat,
+)
+from struct import Struct
+from time import time
+
+from backend import get_backend
+from interfaces import INTERFACES
+from locks import LOCK_DIR, LeaderLoop
+
+# Seconds between interface reads
+INTERVAL_SECONDS = float(environ.get("WG_STATS_INTERVAL", "10"))
+
+# Seconds of full-resolution history kept
+RETENTION_SECONDS = float(environ.get("WG_STATS_RETENTION", "900"))
+
+# Bucket size and span of the downsampled history
+ROLLUP_SECONDS = float(environ.get("WG_STATS_ROLLUP", "300"))
+HISTORY_SECONDS = float(environ.get("WG_STATS_HISTORY", "86400"))
+
+# Seconds since the last handshake within which a peer counts as connected
+ACTIVE_SECONDS = 180
+
+# Events buffered per stream subscriber before it is resynced from scratch
+SUBSCRIBER_BACKLOG = 16
+
+# How often followers look for a new sample
+FOLLOW_POLL_SECONDS = 1
+
+SAMPLE_PATH = path.join(LOCK_DIR, "stats.sample")
+
+# timestamp, peers, interfaces
+_header = Struct("<dIH")
+# interface name, peers on it
+_span = Struct("<16sI")
+# public key (base64), rx, tx, last handshake, persistent keepalive
+_record = Struct("<44sQQqH")
+
+# History rings, in 8-byte words: a header (sequence, points, rows), then
+# per row a public key padded to _KEY_BYTES and the position of its first
+# point, followed by its rx and tx rings
+_RING_HEADER_WORDS = 3
+_KEY_BYTES = 48
+_ROW_HEAD_WORDS = _KEY_BYTES // 8 + 1
+
+# How often, and how far apart, a history read is retried while the
+# leader writes
+RING_READ_ATTEMPTS = 5
+RING_RETRY_SECONDS = 0.01
+
+
+def _as_stat(sample):
+    pub, rx, tx, handshake, keepalive = sample
+    return {
+        "public_key": pub,
+        "last_handshake_time": handshake,
+        "rx_bytes": rx,
+        "tx_bytes": tx,
+        "persistent_keepalive": keepalive,
+    }
+
+
+def _write_sample(ts, samples, spans):
+    buf = bytearray(_header.pack(ts, len(samples), len(spans)))
+    for interface, count in spans:
+        buf += _span.pack(interface.encode(), count)
+    for pub, rx, tx, handshake, keepalive in samples:
+        buf += _record.pack(pub.encode(), rx, tx, handshake, keepalive)
+    tmp = f"{SAMPLE_PATH}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(buf)
+        fsync(f.fileno())
+    replace(tmp, SAMPLE_PATH)
+
+
+def _read_sample():
+    with open(SAMPLE_PATH, "rb") as f:
+        data = f.read()
+    ts, count, interfaces = _header.unpack_from(data)
+    offset = _header.size + interfaces * _span.size
+    spans = [
+        (name.rstrip(b"\0").decode(), peers)
+        for name, peers in _span.iter_unpack(data[_header.size : offset])
+    ]
+    records = _record.iter_unpack(data[offset:][: count * _record.size])
+    return (
+        ts,
+        [
+            (pub.rstrip(b"\0").decode(), rx, tx, handshake, keepalive)
+            for pub, rx, tx, handshake, keepalive in records
+        ],
+        spans,
+    )
+
+
+class RingStore:
+    """
+    Fixed-size ring of points, one point per `step` seconds, in a file
+    under LOCK_DIR that every worker maps: the stats leader records into
+    it and the others read the same pages, so each host holds one copy.
+
+    The file holds a header, the shared timestamps, then one row per peer
+    (public key, position of its first point, rx ring, tx ring). Rows of
+    peers that left are cleared and reused; the file only ever grows.
+    Readers retry when the header's sequence number shows a write in
+    progress or a write happened while they read.
+    """
+
+    def __init__(self, name, step, span):
+        self.path = path.join(LOCK_DIR, f"stats.{name}.ring")
+        self.step = step
+        self.size = max(1, ceil(span / step))
+        self._row_words = _ROW_HEAD_WORDS + 2 * self.size
+        self._rows_start = _RING_HEADER_WORDS + self.size
+        self._map = None
+        self._words = None
+        self._times = None
+        self._mapped_rows = 0
+        # Leader only: row of each public key, rows free for reuse, and
+        # the point count it last wrote (anything else means another
+        # worker wrote since and the index must be reloaded)
+        self._index = None
+        self._free = []
+        self._recorded = None
+
+    def _remap(self, rows=None):
+        """Maps the whole file; the leader passes `rows` to grow it first."""
+        if self._map is not None:
+            self._words.release()
+            self._times.release()
+            self._map.close()
+            self._map = None
+        if rows is None and not path.exists(self.path):
+            self._mapped_rows = 0
+            return False
+        makedirs(LOCK_DIR, exist_ok=True)
+        fd = os_open(self.path, O_RDWR | O_CREAT, 0o600)
+        try:
+            words = self._rows_start + (rows or 0) * self._row_words
+            if fstat(fd).st_size < words * 8:
+                ftruncate(fd, words * 8)
+            self._map = mmap(fd, 0)
+        finally:
+            close(fd)
+        self._words = memoryview(self._map).cast("Q")
+        self._times = memoryview(self._map)[
+            _RING_HEADER_WORDS * 8 : self._rows_start * 8
+        ].cast("d")
+        self._mapped_rows = (len(self._words) - self._rows_start) // self._row_words
+        return True
+
+    def _header(self):
+        """Returns (sequence, points recorded, rows in use), mapping as needed."""
+        if self._map is None and not self._remap():
+            return 0, 0, 0
+        seq, count, rows = self._words[:_RING_HEADER_WORDS]
+        if rows > self._mapped_rows:
+            self._remap()
+        return seq, count, rows
+
+    def _key(self, row):
+        offset = (self._rows_start + row * self._row_words) * 8
+        return self._map[offset : offset + _KEY_BYTES].rstrip(b"\0").decode()
+
+    def _set_key(self, row, key):
+        offset = (self._rows_start + row * self._row_words) * 8
+        self._map[offset : offset + _KEY_BYTES] = key.encode().ljust(
+            _KEY_BYTES, b"\0"
+        )
+
+    def _load_index(self, rows):
+        self._index = {}
+        self._free = []
+        for row in range(rows):
+            key = self._key(row)
+            if key:
+                self._index[key] = row
+            else:
+                self._free.append(row)
+
+    def record(self, ts, samples):
+        """Stores `samples`, overwriting the point of the current bucket."""
+        if self._map is None:
+            self._remap(0)
+        seq, count, rows = self._header()
+        if self._index is None or count != self._recorded:
+            self._load_index(rows)
+        present = {sample[0] for sample in samples}
+        added = [pub for pub in present if pub not in self._index]
+        gone = [pub for pub in self._index if pub not in present]
+        grow = len(added) - len(self._free) - len(gone)
+        if grow > 0:
+            new_rows = max(rows + grow, 2 * rows, 64)
+            self._remap(new_rows)
+            self._free.extend(range(rows, new_rows))
+            rows = new_rows
+
+        self._words[0] = seq + 1
+        bucket = int(ts // self.step)
+        if not count or self._times[(count - 1) % self.size] // self.step != bucket:
+            count += 1
+        index = (count - 1) % self.size
+        self._times[index] = ts
+        for pub in gone:
+            row = self._index.pop(pub)
+            self._set_key(row, "")
+            self._free.append(row)
+        for pub in added:
+            row = self._free.pop()
+            self._set_key(row, pub)
+            first = self._rows_start + row * self._row_words + _ROW_HEAD_WORDS - 1
+            self._words[first] = count - 1
+            self._index[pub] = row
+        words = self._words
+        for pub, rx, tx, _, _ in samples:
+            base = self._rows_start + self._index[pub] * self._row_words
+            words[base + _ROW_HEAD_WORDS + index] = rx
+            words[base + _ROW_HEAD_WORDS + self.size + index] = tx
+        words[1] = count
+        words[2] = rows
+        words[0] = seq + 2
+        self._recorded = count
+
+    @property
+    def count(self):
+        """Points recorded so far, including those overwritten since."""
+        return self._header()[1]
+
+    @property
+    def oldest(self):
+        """Timestamp of the oldest point still held, or None if empty."""
+        count = self.count
+        if not count:
+            return None
+        return self._times[max(0, count - self.size) % self.size]
+
+    async def query(self, since, resolution):
+        """
+        Returns {public_key: {"t": [...], "rx": [...], "tx": [...]}} for
+        points newer than `since`, keeping the last point per `resolution`
+        seconds.
+        """
+        result = {}
+        for _ in range(RING_READ_ATTEMPTS):
+            seq = self._header()[0]
+            if not seq & 1:
+                result = self._query(since, resolution)
+                if self._words is None or self._words[0] == seq:
+                    break
+            await asyncio.sleep(RING_RETRY_SECONDS)
+        return result
+
+    def _query(self, since, resolution):
+        _, count, rows = self._header()
+        positions = []
+        last_bucket = None
+        for position in range(max(0, count - self.size), count):
+            ts = self._times[position % self.size]
+            if ts < since:
+                continue
+            bucket = int(ts // resolution) if resolution else position
+            if bucket == last_bucket:
+                positions[-1] = position
+            else:
+                positions.append(position)
+                last_bucket = bucket
+        words = self._words
+        result = {}
+        for row in range(rows):
+            pub = self._key(row)
+            if not pub:
+                continue
+            base = self._rows_start + row * self._row_words
+            first = words[base + _ROW_HEAD_WORDS - 1]
+            indexes = [p % self.size for p in positions if p >= first]
+            rx = base + _ROW_HEAD_WORDS
+            tx = rx + self.size
+            result[pub] = {
+                "t": [int(self._times[i]) for i in indexes],
+                "rx": [words[rx + i] for i in indexes],
+                "tx": [words[tx + i] for i in indexes],
+            }
+        return result
+
+
+class StatsSampler:
+    """Samples the interface on one worker and serves every worker's stats."""
+
+    def __init__(self):
+        self.fine = RingStore("fine", INTERVAL_SECONDS, RETENTION_SECONDS)
+        self.coarse = RingStore("coarse", ROLLUP_SECONDS, HISTORY_SECONDS)
+        self.latest = []
+        self.spans = []
+        self.sampled_at = None
+        self._leader = LeaderLoop(
+            "stats", "Stats", "sampling", "sampling peers", backoff=INTERVAL_SECONDS
+        )
+        self._signature = None
+        self._subscribers = set()
+        self._listeners = []
+
+    def start(self):
+        """Starts sampling (or following the sampler) in the running loop."""
+        self._leader.start(self._step, follow=self._follow)
+
+    async def shutdown(self):
+        await self._leader.shutdown()
+
+    def ingest(self, ts, samples, spans=()):
+        """
+        Adds one sample of (pub, rx, tx, handshake, keepalive) tuples, of
+        which consecutive runs belong to the (interface, count) `spans`.
+        """
+        previous, self.latest = self.latest, samples
+        self.spans = list(spans)
+        self.sampled_at = ts
+        if self._subscribers:
+            self._publish(ts, previous, samples)
+        for listener in self._listeners:
+            listener(ts, samples)
+
+    def current(self):
+        """Returns the latest counters of every peer."""
+        return [_as_stat(sample) for sample in self.latest]
+
+    def by_interface(self):
+        """Yields (interface, samples) of the latest sample."""
+        start = 0
+        for interface, count in self.spans:
+            yield interface, self.latest[start : start + count]
+            start += count
+
+    def interface_stats(self):
+        """
+        Returns the peers, connected peers and summed counters of each
+        interface in the latest sample, keyed by interface.
+        """
+        recent = (self.sampled_at or 0) - ACTIVE_SECONDS
+        return {
+            interface: {
+                "peers": len(samples),
+                "connected": sum(1 for s in samples if s[3] and s[3] >= recent),
+                "rx_bytes": sum(s[1] for s in samples),
+                "tx_bytes": sum(s[2] for s in samples),
+            }
+            for interface, samples in self.by_interface()
+        }
+
+    def add_listener(self, listener):
+        """Calls `listener(ts, samples)` with every sample this worker ingests."""
+        self._listeners.append(listener)
+
+    def subscribe(self):
+        """
+        Returns a queue receiving one JSON-encoded delta per sample that
+        changed anything, or None when the subscriber fell behind and must
+        start over from current().
+        """
+        queue = asyncio.Queue(SUBSCRIBER_BACKLOG)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    def _publish(self, ts, previous, samples):
+        # Diffed and encoded once, however many subscribers there are
+        before = {sample[0]: sample for sample in previous}
+        changed = [s for s in samples if before.pop(s[0], None) != s]
+        if not changed and not before:
+            return
+        event = json.dumps(
+            {
+                "t": int(ts),
+                "interval": INTERVAL_SECONDS,
+                "peers": [_as_stat(sample) for sample in changed],
+                "removed": list(before),
+            }
+        )
+        for queue in self._subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def history(self, since, resolution=0):
+        """
+        Returns per-peer counter history newer than `since`, read from the
+        full-resolution tier when it reaches back far enough and the
+        requested resolution is finer than a rollup bucket.
+        """
+        store = self.fine
+        truncated = self.fine.count > self.fine.size and since < self.fine.oldest
+        if resolution >= self.coarse.step or truncated:
+            store = self.coarse
+        if resolution <= store.step:
+            resolution = 0
+        return await store.query(since, resolution)
+
+    async def _sample(self):
+        backend = get_backend()
+        live = await asyncio.gather(*(backend.get_peers(i) for i in INTERFACES))
+        ts = time()
+        samples = [
+            (
+                p.public_key,
+                p.rx_bytes,
+                p.tx_bytes,
+                p.last_handshake,
+                p.persistent_keepalive or 0,
+            )
+            for peers in live
+            for p in peers
+        ]
+        spans = [(name, len(peers)) for name, peers in zip(INTERFACES, live)]
+        self.fine.record(ts, samples)
+        self.coarse.record(ts, samples)
+        self.ingest(ts, samples, spans)
+        await asyncio.to_thread(_write_sample, ts, samples, spans)
+
+    async def _step(self):
+        await self._sample()
+        now = time()
+        await asyncio.sleep((now // INTERVAL_SECONDS + 1) * INTERVAL_SECONDS - now)
+
+    async def _follow(self):
+        await asyncio.sleep(FOLLOW_POLL_SECONDS)
+        try:
+            st = stat(SAMPLE_PATH)
+        except FileNotFoundError:
+            return
+        signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+        if signature == self._signature:
+            return
+        ts, samples, spans = await asyncio.to_thread(_read_sample)
+        self._signature = signature
+        if self.sampled_at is None or ts > self.sampled_at:
+            self.ingest(ts, samples, spans)
+
+
+sampler = StatsSampler()
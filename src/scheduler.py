@@ -1,21 +1,99 @@
-from apscheduler.schedulers.background import BackgroundScheduler
-from peers import remove_expired_peers
+import asyncio
 import logging
+from datetime import datetime, timezone
+from heapq import heappop, heappush
+from os import environ
+from time import time
 
-# Use a standard BackgroundScheduler
-scheduler = BackgroundScheduler()
+from aiodb import get_peer_expiries
+from locks import LeaderLoop
+from metrics import sweep_seconds
 
-async def expire_peers_job():
-    """Scheduled job to remove expired peers."""
-    logging.info("Scheduler: Running job to remove expired peers...")
-    try:
-        removed_count = await remove_expired_peers()
+# How often the leader pulls upcoming expiries written by other workers
+RESYNC_SECONDS = float(environ.get("WG_EXPIRY_RESYNC", "30"))
+
+
+def _db_time(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class ExpiryScheduler:
+    """
+    Asyncio-native expiry engine. The leader worker keeps a min-heap of
+    (expires_at, public_key) covering the next two resync windows and sleeps
+    until the earliest entry is due, so peers are removed when they expire
+    rather than on an hourly poll. Only one worker per host holds the leader
+    lock; the others stand by and take over if it exits.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._scheduled = {}
+        self._wake = asyncio.Event()
+        self._leader = LeaderLoop(
+            "expiry", "Scheduler", "expiry", "removing expired peers"
+        )
+        self._job = None
+        self._next_resync = 0
+
+    def start(self, job):
+        """Starts the engine in the running loop; `job` performs one sweep."""
+        self._job = job
+        self._leader.start(self._step)
+
+    async def shutdown(self):
+        await self._leader.shutdown()
+
+    def schedule(self, public_key, expires_ts):
+        """Adds a peer expiry to the heap; no-op unless this worker leads."""
+        if not self._leader.held or self._scheduled.get(public_key) == expires_ts:
+            return
+        self._scheduled[public_key] = expires_ts
+        heappush(self._heap, (expires_ts, public_key))
+        self._wake.set()
+
+    async def _resync(self):
+        horizon = time() + 2 * RESYNC_SECONDS
+        for public_key, expires_ts in await get_peer_expiries(_db_time(horizon)):
+            self.schedule(public_key, expires_ts)
+        self._next_resync = time() + RESYNC_SECONDS
+
+    def _pop_due(self, now):
+        while self._heap and self._heap[0][0] <= now:
+            expires_ts, public_key = heappop(self._heap)
+            if self._scheduled.get(public_key) == expires_ts:
+                del self._scheduled[public_key]
+
+    async def _sweep(self):
+        logging.info("Scheduler: Running job to remove expired peers...")
+        with sweep_seconds.time():
+            removed_count = await self._job()
         if removed_count > 0:
-            logging.info(f"Scheduler: Successfully removed {removed_count} expired peers.")
+            logging.info(
+                f"Scheduler: Successfully removed {removed_count} expired peers."
+            )
         else:
             logging.info("Scheduler: No expired peers found.")
-    except Exception as e:
-        logging.error(f"Scheduler: Error during expired peer removal: {e}")
 
-# Add the job to the scheduler instance
-scheduler.add_job(expire_peers_job, 'interval', id='expire_peers', hours=1)
+    async def _sleep(self, timeout):
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+        except TimeoutError:
+            pass
+        self._wake.clear()
+
+    async def _step(self):
+        now = time()
+        if now >= self._next_resync:
+            await self._resync()
+        if self._heap and self._heap[0][0] <= now:
+            self._pop_due(now)
+            await self._sweep()
+            return
+        deadline = self._next_resync
+        if self._heap:
+            deadline = min(deadline, self._heap[0][0])
+        await self._sleep(max(0, deadline - time()))
+
+
+scheduler = ExpiryScheduler()
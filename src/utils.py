@@ -1,104 +1,32 @@
-from cli import run_command
-from db import get_all_peers
-from config import get_config
-from aiofiles import open
-
-WG_PATH = "/etc/wireguard/wg0.conf"
+import keys
+from aiodb import get_all_peers
+from wgconf import wg_configs
 
 
 async def generate_keypair():
     """
-    Generate a private/public keypair asynchronously.
-    """
-    private_key = await run_command("wg genkey")
-    public_key = await run_command("wg pubkey", stdin_input=private_key)
-    return private_key, public_key
-
-
-async def next_available_ip():
-    """
-    Allocate the next free IPv4/IPv6 addresses asynchronously.
+    Generate a private/public keypair asynchronously, in-process.
     """
-    config = await get_config()
-    peers = get_all_peers()
-    used_v4 = {p["ipv4_address"] for p in peers}
-    used_v6 = {p["ipv6_address"] for p in peers}
+    return await keys.generate_keypair()
 
-    ipv4_base = config.wg_ipv4_base_addr[:-1]
-    ipv6_base = config.wg_ipv6_base_addr[:-1]
 
-    ipv4 = ""
-    for i in range(2, 255):
-        candidate = f"{ipv4_base}{i}"
-        if candidate not in used_v4:
-            ipv4 = candidate
-            break
-    else:
-        raise RuntimeError(f"No free IPv4 addresses left in {ipv4_base}0/24")
-
-    ipv6 = ""
-    for suffix in range(0x100, 0x10000):
-        candidate6 = f"{ipv6_base}{suffix:x}"
-        if candidate6 not in used_v6:
-            ipv6 = candidate6
-            break
-    else:
-        raise RuntimeError(f"No free IPv6 addresses left in {ipv6_base}/64")
-
-    return ipv4, ipv6
-
-
-async def append_peer_to_wgconf(public_key, ipv4, ipv6):
+def peer_allowed_ips(ipv4, ipv6):
     """
-    Append a peer to the wg0.conf file asynchronously.
+    Returns the server-side AllowedIPs of a peer: its own /32 and /128.
     """
-    config = await get_config()
-    allowed_ips = config.wg_allowed_ips
-    async with open(WG_PATH, "a") as f:
-        lines = [
-            "",
-            "[Peer]",
-            f"PublicKey = {public_key}",
-            f"AllowedIPs = {allowed_ips}",
-        ]
-        await f.write("\n".join(lines) + "\n")
-
-
-async def reload_wireguard():
-    """
-    Reload peers dynamically (strip + syncconf) asynchronously.
-    """
-    stripped_config = await run_command(f"wg-quick strip {WG_PATH}")
-
-    async with open("/tmp/wg0.peers.conf", "w") as f:
-        await f.write(stripped_config)
-
-    await run_command("wg syncconf wg0 /tmp/wg0.peers.conf")
+    return [f"{ipv4}/32", f"{ipv6}/128"]
 
 
 async def remake_peers_file():
     """
-    Rebuilds the WireGuard config from the database and reloads the interface asynchronously.
-    """
-    # 1) read existing file up to—but not including—the first [Peer]
-    async with open(WG_PATH, "r") as f:
-        content = await f.read()
-    lines = content.splitlines()
-    interface_section = []
-    for line in lines:
-        if line.strip() == "[Peer]":
-            break
-        interface_section.append(line)
-
-    # 2) overwrite disk config with just the interface
-    async with open(WG_PATH, "w") as f:
-        await f.write("\n".join(interface_section))
-
-    # 3) re-append every peer from the DB
-    for p in get_all_peers():
-        await append_peer_to_wgconf(
-            p["public_key"], p["ipv4_address"], p["ipv6_address"]
-        )
-
-    # 4) push into the running interface
-    await reload_wireguard()
+    Rebuilds the on-disk WireGuard configs from the database, one atomic
+    write per interface. The live interfaces are updated separately through
+    the interface backend.
+    """
+    wanted = {name: [] for name in wg_configs}
+    for p in await get_all_peers():
+        if p["disabled_reason"] is None and p["interface"] in wanted:
+            allowed = peer_allowed_ips(p["ipv4_address"], p["ipv6_address"])
+            wanted[p["interface"]].append((p["public_key"], allowed))
+    for name, peers in wanted.items():
+        await wg_configs[name].replace_peers(peers)
@@ -0,0 +1,151 @@
+"""
+Incremental maintenance of the on-disk WireGuard config.
+
+`WgConfigFile` keeps an in-memory model of the file: the [Interface] section
+plus an insertion-ordered index of [Peer] stanzas keyed by public key.
+Additions are appended, removals rewrite the file atomically (temp file +
+rename) in one buffered write. The model is re-read whenever the file was
+changed behind our back (another worker, bootstrap), detected via stat.
+Every interface has its own file, see `wg_configs`.
+"""
+
+import asyncio
+from os import fchmod, fsync, path, replace, stat, unlink
+from tempfile import mkstemp
+
+from interfaces import INTERFACES
+
+# Directory of the on-disk WireGuard config files, one per interface
+WG_DIR = "/etc/wireguard"
+
+
+def render_peer(public_key, allowed_ips):
+    """Returns the [Peer] stanza lines for a peer."""
+    return [
+        "[Peer]",
+        f"PublicKey = {public_key}",
+        f"AllowedIPs = {', '.join(allowed_ips)}",
+    ]
+
+
+class WgConfigFile:
+    """Indexed model of a wg-quick config file."""
+
+    def __init__(self, file_path):
+        self.path = file_path
+        self.interface = []
+        self.peers = {}
+        self._signature = None
+        self._lock = asyncio.Lock()
+
+    def _stat_signature(self):
+        try:
+            st = stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _parse(self, content):
+        self.interface = []
+        self.peers = {}
+        stanza = None
+        for line in content.splitlines():
+            stripped = line.strip()
+            if stripped.startswith("["):
+                stanza = [] if stripped == "[Peer]" else None
+            if stanza is None:
+                self.interface.append(line)
+                continue
+            if stripped:
+                stanza.append(stripped)
+            key, _, value = stripped.partition("=")
+            if key.strip() == "PublicKey":
+                self.peers[value.strip()] = stanza
+        while self.interface and not self.interface[-1].strip():
+            self.interface.pop()
+
+    def _refresh(self):
+        """Re-reads the file if it changed since we last read or wrote it."""
+        signature = self._stat_signature()
+        if signature is not None and signature == self._signature:
+            return
+        if signature is None:
+            self._parse("")
+        else:
+            with open(self.path) as f:
+                self._parse(f.read())
+        self._signature = signature
+
+    def render(self):
+        parts = ["\n".join(self.interface)]
+        for stanza in self.peers.values():
+            parts.append("\n".join(stanza))
+        return "\n\n".join(parts) + "\n"
+
+    def _write_atomic(self):
+        directory = path.dirname(self.path) or "."
+        fd, tmp = mkstemp(dir=directory, prefix=".wg-", suffix=".conf")
+        try:
+            with open(fd, "w") as f:
+                fchmod(f.fileno(), 0o600)
+                f.write(self.render())
+                f.flush()
+                fsync(f.fileno())
+            replace(tmp, self.path)
+        except BaseException:
+            unlink(tmp)
+            raise
+        self._signature = self._stat_signature()
+
+    def _append(self, stanzas):
+        with open(self.path, "a") as f:
+            f.write("".join("\n" + "\n".join(s) + "\n" for s in stanzas))
+        self._signature = self._stat_signature()
+
+    def _add_peers(self, peers):
+        self._refresh()
+        fresh = []
+        replaced = False
+        for public_key, allowed_ips in peers:
+            stanza = render_peer(public_key, allowed_ips)
+            if public_key in self.peers:
+                replaced = True
+            else:
+                fresh.append(stanza)
+            self.peers[public_key] = stanza
+        if replaced or self._signature is None:
+            self._write_atomic()
+        elif fresh:
+            self._append(fresh)
+
+    def _remove_peers(self, public_keys):
+        self._refresh()
+        removed = sum(self.peers.pop(pub, None) is not None for pub in public_keys)
+        if removed:
+            self._write_atomic()
+        return removed
+
+    def _replace_peers(self, peers):
+        self._refresh()
+        self.peers = {pub: render_peer(pub, allowed) for pub, allowed in peers}
+        self._write_atomic()
+
+    async def add_peers(self, peers):
+        """Adds or updates (public_key, allowed_ips) pairs."""
+        async with self._lock:
+            await asyncio.to_thread(self._add_peers, list(peers))
+
+    async def remove_peers(self, public_keys):
+        """Removes peers by public key; returns how many stanzas were dropped."""
+        async with self._lock:
+            return await asyncio.to_thread(self._remove_peers, list(public_keys))
+
+    async def replace_peers(self, peers):
+        """Replaces every [Peer] stanza, keeping the [Interface] section."""
+        async with self._lock:
+            await asyncio.to_thread(self._replace_peers, list(peers))
+
+
+wg_configs = {
+    name: WgConfigFile(path.join(WG_DIR, f"{name}.conf")) for name in INTERFACES
+}
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of the FastAPI app: boots main.app (lifespan
+included) against a temporary database and the in-memory fake WireGuard
+backend, seeds N peers through POST /api/peers/batch, then drives create,
+list, stats, delete and login requests straight through the ASGI
+interface, plus one expiry sweep. Each size runs in a fresh subprocess.
+
+Reports latency percentiles and throughput per operation and writes them
+to JSON; pass an earlier result file with --compare to see the change.
+
+    python3 app_benchmark.py --sizes 100,1000 --output before.json
+    python3 app_benchmark.py --sizes 100,1000 --compare before.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+from os import path
+from tempfile import TemporaryDirectory
+from time import perf_counter, time
+from urllib.parse import urlencode
+
+SRC = path.join(path.dirname(path.abspath(__file__)), "..", "..", "src")
+
+SIZES = (100, 1_000, 10_000, 50_000)
+REQUESTS = 200
+# bcrypt makes every login cost a few hundred milliseconds
+LOGIN_REQUESTS = 10
+# Peers created per POST /api/peers/batch while seeding
+SEED_BATCH = 5_000
+# Share of peers expired before the sweep
+SWEEP_FRACTION = 0.01
+
+USERNAME = "bench"
+PASSWORD = "bench-password"
+
+
+async def request(app, method, target, headers=(), body=b""):
+    """Sends one HTTP request through the ASGI app; returns (status, body)."""
+    route, _, query = target.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": route,
+        "raw_path": route.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers],
+        "client": ("127.0.0.1", 50000),
+        "server": ("benchmark", 80),
+    }
+    pending = [{"type": "http.request", "body": body, "more_body": False}]
+    response = {"status": None, "body": []}
+
+    async def receive():
+        if pending:
+            return pending.pop()
+        # Never disconnect; streaming responses end on their own
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return response["status"], b"".join(response["body"])
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+async def drive(app, count, concurrency, make_request):
+    """
+    Runs `count` requests built by make_request(i) -> (method, target,
+    headers, body) over `concurrency` clients; returns latency statistics.
+    """
+    latencies = []
+    next_index = 0
+
+    async def client():
+        nonlocal next_index
+        while next_index < count:
+            i = next_index
+            next_index += 1
+            method, target, headers, body = make_request(i)
+            start = perf_counter()
+            status, content = await request(app, method, target, headers, body)
+            latencies.append(perf_counter() - start)
+            if status >= 400:
+                raise RuntimeError(f"{method} {target} -> {status}: {content[:200]}")
+
+    start = perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": count,
+        "throughput_rps": count / elapsed,
+        "mean_ms": sum(latencies) / count * 1e3,
+        "p50_ms": percentile(latencies, 0.50) * 1e3,
+        "p90_ms": percentile(latencies, 0.90) * 1e3,
+        "p99_ms": percentile(latencies, 0.99) * 1e3,
+        "max_ms": latencies[-1] * 1e3,
+    }
+
+
+async def run_size(size, requests, concurrency, tmp):
+    """Boots the app in this process and benchmarks it with `size` peers."""
+    # Point every path the app touches at the temp directory before import
+    os.environ.update(
+        WG_BACKEND="fake",
+        SECRET_KEY="benchmark",
+        WG_ENDPOINT="vpn.example.com",
+        WG_PORT="51820",
+        WG_IPV4_POOLS="10.8.0.0/16",
+        WG_IPV6_POOLS="fd86:ea04:1111::/64",
+    )
+    sys.path.insert(0, SRC)
+    import locks
+
+    locks.LOCK_DIR = path.join(tmp, "run")
+    import db
+
+    db.DB_FILE = path.join(tmp, "peers.db")
+    import config
+    import keys
+    import wgconf
+
+    config.PRIVATE_KEY_PATH = path.join(tmp, "privatekey")
+    with open(config.PRIVATE_KEY_PATH, "w") as f:
+        f.write(keys.generate_private_key())
+    for name, conf in wgconf.wg_configs.items():
+        conf.path = path.join(tmp, f"{name}.conf")
+        with open(conf.path, "w") as f:
+            f.write("[Interface]\nPrivateKey = benchmark\n")
+
+    import main
+    from peers import remove_expired_peers
+    from sampler import sampler
+
+    app = main.app
+    result = {"size": size}
+    start = perf_counter()
+    async with main.lifespan(app):
+        result["startup_ms"] = (perf_counter() - start) * 1e3
+        await asyncio.to_thread(db.add_or_update_user_db, USERNAME, PASSWORD)
+        token = app.state.config.ts.dumps({"user": USERNAME})
+        auth = [("Authorization", f"Bearer {token}")]
+        json_auth = auth + [("Content-Type", "application/json")]
+
+        start = perf_counter()
+        for seeded in range(0, size, SEED_BATCH):
+            batch = min(SEED_BATCH, size - seeded)
+            body = json.dumps({"count": batch, "days_valid": 30}).encode()
+            status, content = await request(
+                app, "POST", "/api/peers/batch", json_auth, body
+            )
+            if status != 201:
+                raise RuntimeError(f"Seeding failed: {status} {content[:200]}")
+        elapsed = perf_counter() - start
+        result["seed"] = {
+            "peers": size,
+            "seconds": elapsed,
+            "peers_per_s": size / elapsed,
+        }
+        # Let the stats endpoint answer from a sample covering every peer
+        await sampler._sample()
+
+        ops = result["ops"] = {}
+
+        def create(i):
+            body = json.dumps({"days_valid": 30}).encode()
+            return "POST", "/api/peers/new", json_auth, body
+
+        ops["create"] = await drive(app, requests, concurrency, create)
+        created = [
+            row["public_key"]
+            for row in db.list_peers_db(
+                ("public_key",), sort="created_at", descending=True, limit=requests
+            )[0]
+        ]
+        ops["list"] = await drive(
+            app,
+            requests,
+            concurrency,
+            lambda i: ("GET", "/api/peers/list?limit=100", auth, b""),
+        )
+        ops["list_search"] = await drive(
+            app,
+            requests,
+            concurrency,
+            lambda i: (
+                "GET",
+                f"/api/peers/list?limit=100&q=10.8.{i % 200}.",
+                auth,
+                b"",
+            ),
+        )
+        ops["stats"] = await drive(
+            app, requests, concurrency, lambda i: ("GET", "/api/peers/stats", auth, b"")
+        )
+        ops["delete"] = await drive(
+            app,
+            len(created),
+            concurrency,
+            lambda i: (
+                "POST",
+                "/api/peers/delete",
+                json_auth,
+                json.dumps({"public_key": created[i]}).encode(),
+            ),
+        )
+        login_body = urlencode({"username": USERNAME, "password": PASSWORD}).encode()
+        ops["login"] = await drive(
+            app,
+            LOGIN_REQUESTS,
+            concurrency,
+            lambda i: (
+                "POST",
+                "/api/login",
+                [("Content-Type", "application/x-www-form-urlencoded")],
+                login_body,
+            ),
+        )
+
+        expiring = max(1, int(size * SWEEP_FRACTION))
+        with db.db_conn() as conn:
+            conn.execute(
+                """
+              UPDATE peers SET expires_at = '2000-01-01 00:00:00'
+               WHERE public_key IN (SELECT public_key FROM peers LIMIT ?)
+            """,
+                (expiring,),
+            )
+        start = perf_counter()
+        removed = await remove_expired_peers()
+        elapsed = perf_counter() - start
+        result["sweep"] = {"expired": removed, "ms": elapsed * 1e3}
+    return result
+
+
+def run_child(size, requests, concurrency):
+    """Benchmarks one size in a fresh interpreter; returns its result."""
+    child = subprocess.run(
+        [
+            sys.executable,
+            path.abspath(__file__),
+            "--child",
+            str(size),
+            "--requests",
+            str(requests),
+            "--concurrency",
+            str(concurrency),
+        ],
+        capture_output=True,
+        text=True,
+    )
+    if child.returncode != 0:
+        sys.stderr.write(child.stderr)
+        raise RuntimeError(f"Benchmark of {size} peers failed")
+    return json.loads(child.stdout.splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=path.dirname(path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def report(result, baseline=None):
+    print(
+        f"\n{result['size']} peers: startup {result['startup_ms']:.0f} ms, "
+        f"seeded at {result['seed']['peers_per_s']:.0f} peers/s, "
+        f"sweep of {result['sweep']['expired']} in {result['sweep']['ms']:.1f} ms"
+    )
+    print(
+        f"  {'operation':<12} {'req/s':>9} {'p50 ms':>9} {'p90 ms':>9} "
+        f"{'p99 ms':>9} {'max ms':>9}"
+    )
+    for name, op in result["ops"].items():
+        line = (
+            f"  {name:<12} {op['throughput_rps']:9.1f} {op['p50_ms']:9.2f} "
+            f"{op['p90_ms']:9.2f} {op['p99_ms']:9.2f} {op['max_ms']:9.2f}"
+        )
+        before = baseline and baseline["ops"].get(name)
+        if before:
+            change = (op["p50_ms"] / before["p50_ms"] - 1) * 100
+            line += f"   p50 {change:+.0f}% vs baseline"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)))
+    parser.add_argument("--requests", type=int, default=REQUESTS)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument(
+        "--output", help="JSON file, default app_benchmark-<commit>.json"
+    )
+    parser.add_argument("--compare", help="earlier JSON result to compare against")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        with TemporaryDirectory() as tmp:
+            result = asyncio.run(
+                run_size(args.child, args.requests, args.concurrency, tmp)
+            )
+        print(json.dumps(result))
+        return
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {r["size"]: r for r in json.load(f)["results"]}
+
+    commit = git_commit()
+    results = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        result = run_child(size, args.requests, args.concurrency)
+        report(result, baseline.get(size))
+        results.append(result)
+
+    output = args.output or f"app_benchmark-{commit}.json"
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "commit": commit,
+                "timestamp": time(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Measures get_all_peers / add_peer_db throughput with a fresh sqlite3
+connection per call (the previous db_conn behaviour) against the pooled
+WAL connections in src/db.py.
+"""
+
+import sqlite3
+import sys
+from os import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+sys.path.insert(0, path.join(path.dirname(__file__), "..", "..", "src"))
+
+import db  # noqa: E402
+
+PEERS = 1000
+LIST_CALLS = 200
+
+
+def fresh_conn():
+    conn = sqlite3.connect(db.DB_FILE)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def add_peer_unpooled(i):
+    conn = fresh_conn()
+    with conn:
+        conn.execute(
+            """
+          INSERT INTO peers
+            (public_key, private_key, ipv4_address, ipv6_address, expires_at)
+          VALUES (?, ?, ?, ?, ?)
+        """,
+            (f"pub{i}", f"priv{i}", f"10.8.{i >> 8}.{i & 255}", f"fd::{i:x}", "2099"),
+        )
+    conn.close()
+
+
+def list_peers_unpooled():
+    conn = fresh_conn()
+    rows = conn.execute("SELECT * FROM peers").fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+def add_peer_pooled(i):
+    db.add_peer_db(
+        f"pub{i}", f"priv{i}", f"10.8.{i >> 8}.{i & 255}", f"fd::{i:x}", "2099"
+    )
+
+
+def timed(label, calls, fn):
+    start = perf_counter()
+    for i in range(calls):
+        fn(i)
+    elapsed = perf_counter() - start
+    print(
+        f"{label:<28} {calls:>6} calls  {elapsed:8.3f} s  "
+        f"{calls / elapsed:10.1f} ops/s  {elapsed / calls * 1e6:10.1f} us/op"
+    )
+
+
+def run(label, add, listing):
+    with TemporaryDirectory() as tmp:
+        db.DB_FILE = path.join(tmp, "peers.db")
+        db.init_db()
+        if label == "unpooled":
+            # Start from the default rollback journal, like the old code
+            db.close_db()
+            conn = sqlite3.connect(db.DB_FILE)
+            conn.execute("PRAGMA journal_mode = DELETE")
+            conn.close()
+        timed(f"{label} add_peer_db", PEERS, add)
+        timed(f"{label} get_all_peers", LIST_CALLS, lambda _: listing())
+        db.close_db()
+
+
+def main():
+    run("unpooled", add_peer_unpooled, list_peers_unpooled)
+    run("pooled", add_peer_pooled, db.get_all_peers)
+
+
+if __name__ == "__main__":
+    main()
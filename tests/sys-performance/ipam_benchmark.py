@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Allocates addresses for 60k peers from a /16 pool through db.add_peer_db
+(persisted free list + high-water mark) and compares the per-create cost
+with the previous approach of loading every peer and probing candidates
+linearly.
+"""
+
+import sys
+from ipaddress import IPv4Address
+from os import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+sys.path.insert(0, path.join(path.dirname(__file__), "..", "..", "src"))
+
+import db  # noqa: E402
+from ipam import AddressPool  # noqa: E402
+
+PEERS = 60_000
+SAMPLE = 1_000
+
+
+def legacy_next_ip():
+    """The previous allocator: load all peers, then probe candidates."""
+    peers = db.get_all_peers()
+    used_v4 = {p["ipv4_address"] for p in peers}
+    used_v6 = {p["ipv6_address"] for p in peers}
+    for i in range(0x10000 * 4):
+        candidate = str(IPv4Address(int(IPv4Address("10.8.0.2")) + i))
+        if candidate not in used_v4:
+            break
+    for suffix in range(0x100, 0x10000 * 4):
+        candidate6 = f"fd86:ea04:1111::{suffix:x}"
+        if candidate6 not in used_v6:
+            break
+
+
+def report(label, calls, elapsed):
+    print(
+        f"{label:<36} {calls:>6} calls  {elapsed:8.3f} s  "
+        f"{elapsed / calls * 1e6:10.1f} us/op"
+    )
+
+
+def main():
+    pools = [AddressPool("10.8.0.0/16", "fd86:ea04:1111::/64")]
+    with TemporaryDirectory() as tmp:
+        db.DB_FILE = path.join(tmp, "peers.db")
+        db.init_db()
+
+        start = perf_counter()
+        for i in range(PEERS):
+            db.add_peer_db(f"pub{i}", f"priv{i}", "2099-01-01 00:00:00", pools)
+            if i + 1 == SAMPLE:
+                report(f"add_peer_db first {SAMPLE}", SAMPLE, perf_counter() - start)
+        report(f"add_peer_db total {PEERS}", PEERS, perf_counter() - start)
+
+        start = perf_counter()
+        for i in range(0, SAMPLE * 2, 2):
+            db.remove_peer_db(f"pub{i}")
+        report(f"remove_peer_db at {PEERS}", SAMPLE, perf_counter() - start)
+
+        start = perf_counter()
+        for i in range(SAMPLE):
+            db.add_peer_db(f"new{i}", "priv", "2099-01-01 00:00:00", pools)
+        report(f"add_peer_db reusing freed at {PEERS}", SAMPLE, perf_counter() - start)
+
+        start = perf_counter()
+        for _ in range(20):
+            legacy_next_ip()
+        report(f"legacy scan allocation at {PEERS}", 20, perf_counter() - start)
+        db.close_db()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Compares WireGuard keypair generation through `wg genkey | wg pubkey`
+subprocesses against the in-process key service in src/keys.py.
+"""
+
+import subprocess
+import sys
+from os import path
+from shutil import which
+from time import perf_counter
+
+sys.path.insert(0, path.join(path.dirname(__file__), "..", "..", "src"))
+
+import keys  # noqa: E402
+
+COUNT = 500
+
+
+def cli_keypair():
+    priv = subprocess.run(
+        ["wg", "genkey"], capture_output=True, check=True, text=True
+    ).stdout.strip()
+    pub = subprocess.run(
+        ["wg", "pubkey"], input=priv, capture_output=True, check=True, text=True
+    ).stdout.strip()
+    return priv, pub
+
+
+def report(label, count, elapsed):
+    print(
+        f"{label:<24} {count:>6} keypairs  {elapsed:8.3f} s  "
+        f"{count / elapsed:10.1f} keys/s  {elapsed / count * 1e6:10.1f} us/key"
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else COUNT
+
+    start = perf_counter()
+    pairs = keys.generate_keypairs(count)
+    report("in-process (batch)", count, perf_counter() - start)
+
+    if which("wg") is None:
+        print("wg binary not found, skipping CLI comparison")
+        return
+
+    start = perf_counter()
+    for _ in range(count):
+        cli_keypair()
+    report("wg genkey | wg pubkey", count, perf_counter() - start)
+
+    # Cross-check the in-process derivation against wg(8)
+    for priv, pub in pairs[:10]:
+        cli_pub = subprocess.run(
+            ["wg", "pubkey"], input=priv, capture_output=True, check=True, text=True
+        ).stdout.strip()
+        assert cli_pub == pub, f"public key mismatch for {priv}"
+    print("Public keys match wg pubkey")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Multi-process benchmark of gateway replication: runs a primary (main.app
+under uvicorn) and several agents (agent.py), each in its own process with
+its own temporary database, config files and fake WireGuard backend.
+
+Seeds peers through the primary and times the agents' snapshot, then
+creates and deletes peers one at a time and measures how long each takes
+to appear in (or leave) every agent's config file. Finally stops one agent,
+creates peers while it is down, restarts it and checks that it catches up
+by resuming the change log rather than with a new snapshot.
+
+    python3 replication_benchmark.py --agents 3 --seed 10000 --changes 100
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+from os import path
+from tempfile import TemporaryDirectory
+from time import perf_counter, sleep
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+SRC = path.join(path.dirname(path.abspath(__file__)), "..", "..", "src")
+
+AGENTS = 2
+SEED = 1_000
+CHANGES = 50
+# Peers created while one agent is down
+MISSED = 100
+# Propagation target per change
+TARGET_SECONDS = 1.0
+# How often the config files are checked
+POLL_SECONDS = 0.002
+TIMEOUT_SECONDS = 60
+
+USERNAME = "bench"
+PASSWORD = "bench-password"
+TOKEN = "replication-benchmark"
+
+
+def prepare(tmp):
+    """Points every path the app touches at `tmp`; call before importing main."""
+    os.environ.update(
+        WG_BACKEND="fake",
+        SECRET_KEY="benchmark",
+        WG_ENDPOINT="vpn.example.com",
+        WG_PORT="51820",
+        WG_IPV4_POOLS="10.8.0.0/16",
+        WG_IPV6_POOLS="fd86:ea04:1111::/64",
+        WG_REPLICATION_TOKEN=TOKEN,
+    )
+    sys.path.insert(0, SRC)
+    import locks
+
+    locks.LOCK_DIR = path.join(tmp, "run")
+    import db
+
+    db.DB_FILE = path.join(tmp, "peers.db")
+    import config
+    import keys
+    import wgconf
+
+    config.PRIVATE_KEY_PATH = path.join(tmp, "privatekey")
+    if not path.exists(config.PRIVATE_KEY_PATH):
+        with open(config.PRIVATE_KEY_PATH, "w") as f:
+            f.write(keys.generate_private_key())
+    for name, conf in wgconf.wg_configs.items():
+        conf.path = path.join(tmp, f"{name}.conf")
+        if not path.exists(conf.path):
+            with open(conf.path, "w") as f:
+                f.write("[Interface]\nPrivateKey = benchmark\n")
+
+
+def run_primary(tmp, port):
+    prepare(tmp)
+    import uvicorn
+
+    import db
+    import main
+
+    db.init_db()
+    db.add_or_update_user_db(USERNAME, PASSWORD)
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def run_agent(tmp, port):
+    os.environ["WG_PRIMARY_URL"] = f"http://127.0.0.1:{port}"
+    prepare(tmp)
+    import logging
+
+    import agent
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(agent.main())
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn(role, tmp, port, log):
+    return subprocess.Popen(
+        [sys.executable, path.abspath(__file__), "--role", role, tmp, str(port)],
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+
+
+def call(port, method, route, token=None, body=None, form=None):
+    headers = {}
+    data = None
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    if body is not None:
+        headers["Content-Type"] = "application/json"
+        data = json.dumps(body).encode()
+    elif form is not None:
+        headers["Content-Type"] = "application/x-www-form-urlencoded"
+        data = urlencode(form).encode()
+    request = Request(
+        f"http://127.0.0.1:{port}/api{route}", data, headers, method=method
+    )
+    with urlopen(request, timeout=TIMEOUT_SECONDS) as response:
+        return response.read()
+
+
+def wait_for_primary(port, primary):
+    deadline = perf_counter() + TIMEOUT_SECONDS
+    while perf_counter() < deadline:
+        if primary.poll() is not None:
+            raise RuntimeError("Primary exited during startup")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            sleep(0.05)
+    raise RuntimeError("Primary did not start")
+
+
+def config_text(tmp):
+    text = []
+    for name in sorted(os.listdir(tmp)):
+        if name.startswith("wg") and name.endswith(".conf"):
+            with open(path.join(tmp, name)) as f:
+                text.append(f.read())
+    return "".join(text)
+
+
+def peer_count(tmp):
+    return config_text(tmp).count("[Peer]")
+
+
+def wait_until(predicate):
+    """Polls `predicate` until it holds; returns the seconds it took."""
+    start = perf_counter()
+    while not predicate():
+        if perf_counter() - start > TIMEOUT_SECONDS:
+            raise RuntimeError("Timed out waiting for the agents")
+        sleep(POLL_SECONDS)
+    return perf_counter() - start
+
+
+def propagation(agent_dirs, public_key, present):
+    """Seconds until every agent's configs have (or lack) `public_key`."""
+    pending = set(agent_dirs)
+    start = perf_counter()
+    while pending:
+        for tmp in list(pending):
+            if (public_key in config_text(tmp)) == present:
+                pending.discard(tmp)
+        if perf_counter() - start > TIMEOUT_SECONDS:
+            raise RuntimeError("Timed out waiting for the agents")
+        if pending:
+            sleep(POLL_SECONDS)
+    return perf_counter() - start
+
+
+def summary(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50_ms": values[len(values) // 2] * 1e3,
+        "p99_ms": values[min(len(values) - 1, int(0.99 * len(values)))] * 1e3,
+        "max_ms": values[-1] * 1e3,
+    }
+
+
+def benchmark(args, root):
+    primary_dir = path.join(root, "primary")
+    agent_dirs = [path.join(root, f"agent{i}") for i in range(args.agents)]
+    for tmp in [primary_dir, *agent_dirs]:
+        os.makedirs(tmp)
+    port = free_port()
+    logs = {
+        tmp: open(path.join(root, f"{path.basename(tmp)}.log"), "a")
+        for tmp in [primary_dir, *agent_dirs]
+    }
+    processes = {}
+    try:
+        processes[primary_dir] = spawn("primary", primary_dir, port, logs[primary_dir])
+        wait_for_primary(port, processes[primary_dir])
+        login = {"username": USERNAME, "password": PASSWORD}
+        token = json.loads(call(port, "POST", "/login", form=login))["access_token"]
+
+        for seeded in range(0, args.seed, 5000):
+            count = min(5000, args.seed - seeded)
+            call(port, "POST", "/peers/batch", token, {"count": count})
+        start = perf_counter()
+        for tmp in agent_dirs:
+            processes[tmp] = spawn("agent", tmp, port, logs[tmp])
+        for tmp in agent_dirs:
+            wait_until(lambda: peer_count(tmp) == args.seed)
+        result = {"agents": args.agents, "seed": args.seed}
+        result["snapshot_s"] = perf_counter() - start
+        print(
+            f"{args.agents} agents mirrored {args.seed} peers "
+            f"in {result['snapshot_s']:.2f} s"
+        )
+
+        added, removed = [], []
+        for _ in range(args.changes):
+            pub = json.loads(call(port, "POST", "/peers/new", token, {}))["public_key"]
+            added.append(propagation(agent_dirs, pub, True))
+            call(port, "POST", "/peers/delete", token, {"public_key": pub})
+            removed.append(propagation(agent_dirs, pub, False))
+        result["add"] = summary(added)
+        result["delete"] = summary(removed)
+        for name in ("add", "delete"):
+            stats = result[name]
+            print(
+                f"  {name:<7} p50 {stats['p50_ms']:7.1f} ms  "
+                f"p99 {stats['p99_ms']:7.1f} ms  max {stats['max_ms']:7.1f} ms"
+            )
+
+        # Restart one agent after it missed some changes
+        stopped = agent_dirs[0]
+        processes[stopped].terminate()
+        processes[stopped].wait()
+        call(port, "POST", "/peers/batch", token, {"count": args.missed})
+        expected = args.seed + args.missed
+        start = perf_counter()
+        processes[stopped] = spawn("agent", stopped, port, logs[stopped])
+        wait_until(lambda: peer_count(stopped) == expected)
+        result["catch_up_s"] = perf_counter() - start
+        logs[stopped].flush()
+        with open(logs[stopped].name) as f:
+            snapshots = f.read().count("Applied snapshot")
+        result["resumed"] = snapshots == 1
+        print(
+            f"  restarted agent caught up on {args.missed} peers in "
+            f"{result['catch_up_s']:.2f} s "
+            f"({'resumed' if result['resumed'] else 'NEW SNAPSHOT'})"
+        )
+        for tmp in agent_dirs[1:]:
+            wait_until(lambda: peer_count(tmp) == expected)
+        slow = result["add"]["max_ms"] > TARGET_SECONDS * 1e3
+        print(f"  {TARGET_SECONDS:.0f} s target {'MISSED' if slow else 'met'}")
+        return result
+    finally:
+        # Agents first: the primary waits for their streams on shutdown
+        for process in reversed(processes.values()):
+            process.terminate()
+        for process in processes.values():
+            process.wait()
+        for log in logs.values():
+            log.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--agents", type=int, default=AGENTS)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--changes", type=int, default=CHANGES)
+    parser.add_argument("--missed", type=int, default=MISSED)
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--role", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.role:
+        role, tmp, port = args.role
+        (run_primary if role == "primary" else run_agent)(tmp, int(port))
+        return
+
+    with TemporaryDirectory() as root:
+        try:
+            result = benchmark(args, root)
+        except Exception:
+            for name in sorted(os.listdir(root)):
+                if name.endswith(".log"):
+                    with open(path.join(root, name)) as f:
+                        sys.stderr.write(f"--- {name}\n{f.read()[-4000:]}")
+            raise
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Reads large peer dumps through backend.UapiBackend from a fake UAPI socket
+(as served by boringtun) and checks every peer comes back intact. A dump
+of a few hundred peers already exceeds asyncio's default 64 KiB stream
+limit, so this covers responses well past it.
+
+    python3 uapi_benchmark.py --peers 1000,20000
+"""
+
+import argparse
+import asyncio
+import sys
+from base64 import b64encode
+from os import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+sys.path.insert(0, path.join(path.dirname(__file__), "..", "..", "src"))
+
+from backend import UapiBackend  # noqa: E402
+
+SIZES = "1000,20000"
+READS = 5
+INTERFACE = "wg0"
+
+
+def dump(count):
+    """A get=1 response for `count` peers, as boringtun formats it."""
+    lines = ["private_key=" + "11" * 32, "listen_port=51820"]
+    for i in range(count):
+        lines += [
+            f"public_key={i.to_bytes(32, 'big').hex()}",
+            "endpoint=203.0.113.7:51820",
+            f"last_handshake_time_sec={1_700_000_000 + i}",
+            "last_handshake_time_nsec=0",
+            f"rx_bytes={i * 1000}",
+            f"tx_bytes={i * 2000}",
+            "persistent_keepalive_interval=25",
+            f"allowed_ip=10.8.{i // 256}.{i % 256}/32",
+            f"allowed_ip=fd86:ea04:1111::{i:x}/128",
+        ]
+    return ("\n".join(lines) + "\nerrno=0\n\n").encode()
+
+
+async def serve(socket_path, response):
+    async def handle(reader, writer):
+        await reader.readuntil(b"\n\n")
+        # Trickle it out in small writes, like a busy userspace daemon
+        for i in range(0, len(response), 4096):
+            writer.write(response[i : i + 4096])
+            await writer.drain()
+        writer.close()
+
+    return await asyncio.start_unix_server(handle, socket_path)
+
+
+async def measure(count, reads):
+    with TemporaryDirectory() as tmp:
+        response = dump(count)
+        backend = UapiBackend(tmp)
+        server = await serve(backend.socket_path(INTERFACE), response)
+        async with server:
+            timings = []
+            for _ in range(reads):
+                start = perf_counter()
+                peers = await backend.get_peers(INTERFACE)
+                timings.append(perf_counter() - start)
+        if len(peers) != count:
+            raise RuntimeError(f"Read {len(peers)} of {count} peers")
+        last = peers[-1]
+        expected = b64encode((count - 1).to_bytes(32, "big")).decode()
+        if last.public_key != expected or len(last.allowed_ips) != 2:
+            raise RuntimeError(f"Peer {count - 1} came back garbled")
+        if last.tx_bytes != (count - 1) * 2000:
+            raise RuntimeError(f"Peer {count - 1} has the wrong counters")
+        best = min(timings)
+        print(
+            f"{count:>7} peers  {len(response) / 1024:9.0f} KiB  "
+            f"{best * 1e3:8.1f} ms  {count / best:10.0f} peers/s"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--peers", default=SIZES)
+    parser.add_argument("--reads", type=int, default=READS)
+    args = parser.parse_args()
+    for count in map(int, args.peers.split(",")):
+        asyncio.run(measure(count, args.reads))
+
+
+if __name__ == "__main__":
+    main()